@@ -1,5 +1,6 @@
-from app.database import get_users_db_connection
+from app.database import get_users_db_connection, release_connection
 from app.auth.utils import hash_password, verify_password
+from app.db_errors import map_db_error
 
 
 def check_user_login(login: str, password: str) -> dict:
@@ -64,7 +65,7 @@ def check_user_login(login: str, password: str) -> dict:
         print(f"❌ Ошибка при проверке пользователя: {e}")
         return {"success": False, "error": "Ошибка при проверке пользователя"}
     finally:
-        conn.close()
+        release_connection(conn)
 
 def check_login_unique(login: str) -> bool:
     """
@@ -98,7 +99,7 @@ def check_login_unique(login: str) -> bool:
         print(f"❌ Ошибка при проверке логина: {e}")
         return False
     finally:
-        conn.close()
+        release_connection(conn)
 
 
 def check_email_unique(email: str) -> bool:
@@ -133,7 +134,7 @@ def check_email_unique(email: str) -> bool:
         print(f"❌ Ошибка при проверке email: {e}")
         return False
     finally:
-        conn.close()
+        release_connection(conn)
 
 
 def create_user(full_name: str, email: str, login: str, password: str) -> dict:
@@ -167,7 +168,13 @@ def create_user(full_name: str, email: str, login: str, password: str) -> dict:
     except Exception as e:
         conn.rollback()
         print(f"❌ Ошибка при создании пользователя: {e}")
+        # Занятые логин и email отклоняет сама БД (unique_user_login, unique_user_email),
+        # поэтому одновременные регистрации с одним логином не проходят обе
+        mapped = map_db_error(e)
+        if mapped is not None:
+            code, message = mapped
+            return {"success": False, "error": message, "code": code}
         return {"success": False, "error": f"Ошибка при создании пользователя: {e}"}
     finally:
-        conn.close()
+        release_connection(conn)
 
@@ -0,0 +1,126 @@
+import select
+import threading
+
+import psycopg2
+from psycopg2 import extensions
+
+from app.database import MAIN_DB_CONFIG
+
+# Канал, в который триггеры основной БД публикуют имя изменённой таблицы
+# (см. notify_cache_event в scripts.sql)
+CACHE_EVENTS_CHANNEL = "cache_events"
+
+LISTEN_POLL_INTERVAL = 5  # сек: как часто проверять флаг остановки
+RECONNECT_DELAY = 3  # сек: пауза перед переподключением после ошибки
+
+
+class CacheEventListener:
+    """
+    Фоновый поток, слушающий LISTEN cache_events на основной БД.
+    Каждое уведомление (имя таблицы) передаётся подписчикам этой таблицы —
+    так все воркеры сбрасывают свои кэши после изменения данных в любом из них.
+    """
+
+    def __init__(self, db_config: dict, channel: str):
+        self.db_config = db_config
+        self.channel = channel
+        self._subscribers = {}  # {таблица: [callback, ...]}
+        self._thread = None
+        self._stop = threading.Event()
+        self.stats = {"received": 0, "dispatched": 0, "reconnects": 0, "errors": 0}
+
+    def subscribe(self, table: str, callback):
+        """Регистрирует callback() на изменения таблицы"""
+        self._subscribers.setdefault(table, []).append(callback)
+
+    def dispatch(self, table: str):
+        for callback in self._subscribers.get(table, ()):
+            try:
+                callback()
+                self.stats["dispatched"] += 1
+            except Exception as error:
+                self.stats["errors"] += 1
+                print(f"⚠️ Ошибка обработки события кэша {table}: {error}")
+
+    def _connect(self):
+        connection = psycopg2.connect(**self.db_config)
+        connection.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        connection.cursor().execute(f"LISTEN {self.channel}")
+        return connection
+
+    def _listen(self, connection):
+        while not self._stop.is_set():
+            if select.select([connection], [], [], LISTEN_POLL_INTERVAL) == ([], [], []):
+                continue
+            connection.poll()
+            # Одна транзакция может прислать несколько таблиц — каждую обрабатываем один раз
+            tables = []
+            while connection.notifies:
+                table = connection.notifies.pop(0).payload
+                self.stats["received"] += 1
+                if table not in tables:
+                    tables.append(table)
+            for table in tables:
+                self.dispatch(table)
+
+    def _run(self):
+        reconnecting = False
+        while not self._stop.is_set():
+            connection = None
+            try:
+                connection = self._connect()
+                print(f"📡 Слушаем события кэша ({self.channel})")
+                if reconnecting:
+                    # Пока соединения не было, события могли быть пропущены — сбрасываем всё
+                    for table in list(self._subscribers):
+                        self.dispatch(table)
+                self._listen(connection)
+            except Exception as error:
+                self.stats["errors"] += 1
+                print(f"⚠️ Потеряно соединение слушателя событий кэша: {error}")
+            finally:
+                if connection is not None:
+                    connection.close()
+            reconnecting = True
+            if not self._stop.wait(RECONNECT_DELAY):
+                self.stats["reconnects"] += 1
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-events", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=LISTEN_POLL_INTERVAL + 1)
+            self._thread = None
+
+    def get_stats(self) -> dict:
+        return {
+            "channel": self.channel,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "tables": sorted(self._subscribers),
+            **self.stats
+        }
+
+
+cache_event_listener = CacheEventListener(MAIN_DB_CONFIG, CACHE_EVENTS_CHANNEL)
+
+
+def on_table_change(table: str, callback):
+    cache_event_listener.subscribe(table, callback)
+
+
+def start_cache_listener():
+    cache_event_listener.start()
+
+
+def stop_cache_listener():
+    cache_event_listener.stop()
+
+
+def get_cache_listener_stats() -> dict:
+    return cache_event_listener.get_stats()
@@ -0,0 +1,118 @@
+import threading
+
+from app.database import main_db_connection
+
+# Пауза после изменения услуг перед пересчетом куба: изменения, пришедшие за это
+# время (серия правок в админке, импорт), объединяются в один REFRESH
+REFRESH_DELAY = 2  # сек
+
+
+def refresh_services_cube(conn):
+    """
+    Пересчитывает куб агрегатов services_cube, из которого читают отчеты.
+    Ошибка обновления не отменяет уже зафиксированные изменения — куб догонит
+    данные при следующем обновлении.
+    """
+    try:
+        cur = conn.cursor()
+        cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY services_cube")
+        # Новая версия куба меняет ETag отчетов, читающих из него
+        cur.execute("SELECT bump_data_version('services_cube')")
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        print(f"⚠️ Не удалось обновить services_cube: {e}")
+        return False
+
+
+class CubeRefresher:
+    """
+    Фоновый поток, пересчитывающий services_cube после изменений услуг.
+    Запрос на обновление не ждет REFRESH (он сравнивает весь куб с services):
+    запросы, пришедшие до начала пересчета, объединяются в одно обновление.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._requested = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"requested": 0, "refreshed": 0, "errors": 0}
+
+    def request(self):
+        """Помечает куб устаревшим; пересчет выполнится в фоне"""
+        self.stats["requested"] += 1
+        self._requested.set()
+
+    def _refresh(self):
+        with main_db_connection() as conn:
+            if conn is None:
+                raise ConnectionError("Ошибка подключения к БД")
+            if not refresh_services_cube(conn):
+                raise RuntimeError("REFRESH services_cube не выполнен")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._requested.wait()
+            if self._stop.wait(self.delay):
+                break
+            # Сброс до пересчета: изменения, пришедшие во время REFRESH, вызовут следующий
+            self._requested.clear()
+            try:
+                self._refresh()
+                self.stats["refreshed"] += 1
+            except Exception as error:
+                self.stats["errors"] += 1
+                print(f"⚠️ Ошибка фонового обновления services_cube: {error}")
+                self._requested.set()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cube-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Останавливает поток; несделанный пересчет выполняется сразу"""
+        self._stop.set()
+        pending = self._requested.is_set()
+        self._requested.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.delay + 1)
+            self._thread = None
+        self._requested.clear()
+        if pending:
+            try:
+                self._refresh()
+                self.stats["refreshed"] += 1
+            except Exception as error:
+                self.stats["errors"] += 1
+                print(f"⚠️ Ошибка обновления services_cube при остановке: {error}")
+
+    def get_stats(self) -> dict:
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "pending": self._requested.is_set(),
+            **self.stats
+        }
+
+
+cube_refresher = CubeRefresher(REFRESH_DELAY)
+
+
+def request_cube_refresh():
+    cube_refresher.request()
+
+
+def start_cube_refresher():
+    cube_refresher.start()
+
+
+def stop_cube_refresher():
+    cube_refresher.stop()
+
+
+def get_cube_refresher_stats() -> dict:
+    return cube_refresher.get_stats()
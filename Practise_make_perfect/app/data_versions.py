@@ -0,0 +1,64 @@
+import hashlib
+import threading
+
+from app.database import main_db_connection
+
+# Версии данных по таблицам ("Таблица" -> "Версия") из data_versions.
+# Версия растёт при фиксации каждой транзакции, изменившей таблицу (триггеры
+# notify_cache_event), и при обновлении куба services_cube; из версий строятся ETag
+# отчетных и справочных API.
+_versions = None
+_versions_lock = threading.Lock()
+_generation = 0  # растёт при каждом сбросе, чтобы не сохранить устаревшую загрузку
+
+
+def peek_data_versions():
+    """Версии из памяти процесса или None, если их нужно загрузить из БД"""
+    return _versions
+
+
+def get_data_versions() -> dict:
+    """Возвращает версии всех таблиц (из памяти или из БД)"""
+    global _versions
+    with _versions_lock:
+        if _versions is not None:
+            return _versions
+        generation = _generation
+
+    with main_db_connection() as conn:
+        if conn is None:
+            raise ConnectionError("Ошибка подключения к БД")
+        cur = conn.cursor()
+        cur.execute('SELECT "Таблица", "Версия" FROM data_versions')
+        versions = dict(cur.fetchall())
+
+    with _versions_lock:
+        if _generation == generation:
+            _versions = versions
+    return versions
+
+
+def invalidate_data_versions():
+    global _versions, _generation
+    with _versions_lock:
+        _versions = None
+        _generation += 1
+
+
+def make_etag(versions: dict, tables: tuple, key: str) -> str:
+    """Сильный ETag: адрес запроса + версии таблиц, из которых строится ответ"""
+    source = key + "|" + ",".join(f"{table}:{versions.get(table, 0)}" for table in tables)
+    return '"' + hashlib.sha1(source.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Проверяет заголовок If-None-Match (список ETag через запятую или *)"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
@@ -1,4 +1,11 @@
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
+import psycopg2.pool
+from anyio import to_thread
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
 
 # Настройки подключения к ОСНОВНОЙ базе данных
@@ -19,42 +26,289 @@ USERS_DB_CONFIG = {
     "port": "5432"
 }
 
+# Настройки пулов соединений
+POOL_CONFIG = {
+    "min_size": 1,  # сколько соединений держим открытыми всегда
+    "max_size": 10,  # максимум одновременно открытых соединений
+    "idle_timeout": 300,  # через сколько секунд простоя лишнее соединение закрывается
+    "health_check_after": 30,  # простой (сек), после которого соединение проверяется SELECT 1
+    "checkout_timeout": 30  # сколько секунд ждать свободное соединение
+}
+
+# Сколько синхронных обработчиков (запросы к БД, bcrypt) выполняется одновременно.
+# FastAPI запускает обычные def-обработчики в пуле потоков, не блокируя event loop;
+# держим лимит равным max_size, чтобы потоки не простаивали в ожидании соединения.
+DB_CONCURRENCY_LIMIT = POOL_CONFIG["max_size"]
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений psycopg2.
+    Выдаёт соединения с проверкой работоспособности, закрывает лишние
+    простаивающие соединения и ведёт статистику использования.
+    """
+
+    def __init__(self, name: str, db_config: dict, min_size: int = 1, max_size: int = 10,
+                 idle_timeout: float = 300, health_check_after: float = 30, checkout_timeout: float = 30):
+        self.name = name
+        self.db_config = db_config
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.checkout_timeout = checkout_timeout
+
+        self._lock = threading.Condition()
+        self._idle = []  # [(connection, время возврата в пул)], последние возвращённые — в конце
+        self._in_use = set()  # id() выданных соединений
+        self._opened = 0  # сколько соединений сейчас открыто (свободные + выданные)
+        self._closed = False
+
+        self.stats = {
+            "created": 0,
+            "closed": 0,
+            "checkouts": 0,
+            "returns": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "failed_health_checks": 0,
+            "reaped": 0,
+            "connect_errors": 0
+        }
+
+    def _discard(self, connection):
+        """Закрывает соединение, которое больше не вернётся в пул (вызывается под блокировкой)"""
+        self._opened -= 1
+        self.stats["closed"] += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+        self._lock.notify()
+
+    def _is_healthy(self, connection, idle_for: float) -> bool:
+        if connection.closed:
+            return False
+        if idle_for < self.health_check_after:
+            return True
+        try:
+            cur = connection.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _reap_idle(self):
+        """Закрывает соединения, простаивающие дольше idle_timeout, не опускаясь ниже min_size"""
+        now = time.monotonic()
+        kept = []
+        for connection, returned_at in self._idle:
+            if self._opened > self.min_size and now - returned_at > self.idle_timeout:
+                self._discard(connection)
+                self.stats["reaped"] += 1
+            else:
+                kept.append((connection, returned_at))
+        self._idle = kept
+
+    def _checkout(self, connection, created: bool = False):
+        with self._lock:
+            self._in_use.add(id(connection))
+            self.stats["checkouts"] += 1
+            if created:
+                self.stats["created"] += 1
+        return connection
+
+    def getconn(self):
+        """
+        Берёт соединение из пула. При исчерпании пула ждёт до checkout_timeout секунд.
+        Подключение к БД и проверка соединения выполняются вне блокировки пула.
+        """
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            candidate = None
+            with self._lock:
+                self._reap_idle()
+                while True:
+                    if self._closed:
+                        raise psycopg2.pool.PoolError(f"Пул {self.name} закрыт")
+                    if self._idle:
+                        # Самое свежее свободное соединение — в конце списка
+                        candidate = self._idle.pop()
+                        break
+                    if self._opened < self.max_size:
+                        # Резервируем место под новое соединение
+                        self._opened += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats["timeouts"] += 1
+                        raise psycopg2.pool.PoolError(f"Пул {self.name} исчерпан (max_size={self.max_size})")
+                    self.stats["waits"] += 1
+                    self._lock.wait(remaining)
+
+            if candidate is None:
+                try:
+                    connection = psycopg2.connect(**self.db_config)
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                        self.stats["connect_errors"] += 1
+                        self._lock.notify()
+                    raise
+                return self._checkout(connection, created=True)
+
+            connection, returned_at = candidate
+            if self._is_healthy(connection, time.monotonic() - returned_at):
+                return self._checkout(connection)
+
+            # Соединение «умерло», пока лежало в пуле — закрываем и пробуем снова
+            with self._lock:
+                self.stats["failed_health_checks"] += 1
+                self._discard(connection)
+
+    def putconn(self, connection):
+        """Возвращает соединение в пул, откатывая незавершённую транзакцию"""
+        reusable = not connection.closed
+        if reusable and connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except Exception:
+                reusable = False
+
+        with self._lock:
+            if id(connection) not in self._in_use:
+                return
+            self._in_use.discard(id(connection))
+            self.stats["returns"] += 1
+
+            if reusable and not self._closed:
+                self._idle.append((connection, time.monotonic()))
+            else:
+                self._discard(connection)
+            self._lock.notify()
+
+    def owns(self, connection) -> bool:
+        with self._lock:
+            return id(connection) in self._in_use
+
+    def warm_up(self):
+        """Открывает min_size соединений заранее"""
+        connections = [self.getconn() for _ in range(self.min_size)]
+        for connection in connections:
+            self.putconn(connection)
+
+    def closeall(self):
+        with self._lock:
+            self._closed = True
+            for connection, _ in self._idle:
+                self._discard(connection)
+            self._idle = []
+            self._lock.notify_all()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "opened": self._opened,
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                **self.stats
+            }
+
+
+main_db_pool = ConnectionPool("main", MAIN_DB_CONFIG, **POOL_CONFIG)
+users_db_pool = ConnectionPool("users", USERS_DB_CONFIG, **POOL_CONFIG)
+
 
 def get_main_db_connection():
-    """Подключение к основной базе данных"""
+    """Берёт соединение с основной базой данных из пула (вернуть через release_connection)"""
     try:
-        connection = psycopg2.connect(**MAIN_DB_CONFIG)
-        return connection
+        return main_db_pool.getconn()
     except Exception as error:
         print(f"Ошибка подключения к основной БД: {error}")
         return None
 
 
 def get_users_db_connection():
-    """Подключение к базе пользователей"""
+    """Берёт соединение с базой пользователей из пула (вернуть через release_connection)"""
     try:
-        connection = psycopg2.connect(**USERS_DB_CONFIG)
-        return connection
+        return users_db_pool.getconn()
     except Exception as error:
         print(f"Ошибка подключения к БД пользователей: {error}")
         return None
 
 
+def release_connection(connection):
+    """Возвращает соединение в тот пул, из которого оно было взято"""
+    if connection is None:
+        return
+    for pool in (main_db_pool, users_db_pool):
+        if pool.owns(connection):
+            pool.putconn(connection)
+            return
+    connection.close()
+
+
+@contextmanager
+def main_db_connection():
+    """
+    Контекстный менеджер для основной БД:
+    with main_db_connection() as conn: ...
+    Соединение возвращается в пул при выходе из блока (None, если БД недоступна).
+    """
+    connection = get_main_db_connection()
+    try:
+        yield connection
+    finally:
+        release_connection(connection)
+
+
+@contextmanager
+def users_db_connection():
+    """Контекстный менеджер для БД пользователей (аналог main_db_connection)"""
+    connection = get_users_db_connection()
+    try:
+        yield connection
+    finally:
+        release_connection(connection)
+
+
+def get_pool_stats() -> dict:
+    """Статистика по обоим пулам соединений"""
+    return {
+        "main": main_db_pool.get_stats(),
+        "users": users_db_pool.get_stats()
+    }
+
+
+def configure_db_concurrency(limit: int = DB_CONCURRENCY_LIMIT):
+    """Ограничивает пул потоков, в котором выполняются блокирующие обработчики (вызывать при старте)"""
+    to_thread.current_default_thread_limiter().total_tokens = limit
+    print(f"🧵 Лимит одновременных обращений к БД: {limit}")
+
+
+def close_all_pools():
+    main_db_pool.closeall()
+    users_db_pool.closeall()
+
+
 def test_connections():
     print("🔍 Тестируем подключения к базам данных...")
 
-    # Тест основной БД
-    main_conn = get_main_db_connection()
-    if main_conn:
+    # Тест основной БД (заодно прогреваем пул)
+    try:
+        main_db_pool.warm_up()
         print("✅ Подключение к основной БД успешно")
-        main_conn.close()
-    else:
-        print("❌ Ошибка подключения к основной БД")
+    except Exception as error:
+        print(f"❌ Ошибка подключения к основной БД: {error}")
 
     # Тест БД пользователей
-    users_conn = get_users_db_connection()
-    if users_conn:
+    try:
+        users_db_pool.warm_up()
         print("✅ Подключение к БД пользователей успешно")
-        users_conn.close()
-    else:
-        print("❌ Ошибка подключения к БД пользователей")
\ No newline at end of file
+    except Exception as error:
+        print(f"❌ Ошибка подключения к БД пользователей: {error}")
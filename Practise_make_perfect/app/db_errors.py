@@ -0,0 +1,60 @@
+from psycopg2 import errorcodes
+
+# Уникальные ограничения: имя -> сообщение о повторе
+UNIQUE_ERRORS = {
+    "unique_enterprise_reg_number": "Предприятие с таким регистрационным номером уже существует",
+    "unique_reg_period": "Отчётный период для этого предприятия уже существует",
+    "unique_service": "Услуга с такими параметрами уже существует",
+    "unique_user_email": "Пользователь с таким email уже существует",
+    "unique_user_login": "Пользователь с таким логином уже существует",
+}
+
+# Внешние ключи: имя -> (таблица, на которую ссылается ключ,
+#                        сообщение при записи ссылки, сообщение при удалении используемой записи)
+FOREIGN_KEY_ERRORS = {
+    "fk_enterprise_ministry": ("ministries", "Министерство не найдено", "Министерство используется предприятиями"),
+    "fk_enterprise_industry": ("industries", "Отрасль не найдена", "Отрасль используется предприятиями"),
+    "fk_enterprise_region": ("regions", "Область не найдена", "Область используется предприятиями"),
+    "fk_period_enterprise": ("enterprises", "Предприятие с указанным регистрационным номером не найдено",
+                             "У предприятия есть отчётные периоды"),
+    "fk_service_enterprise": ("enterprises", "Предприятие не найдено", "У предприятия есть услуги"),
+    "fk_service_district": ("districts", "Район не найден", "Район используется в услугах"),
+    "fk_service_region": ("regions", "Область не найдена", "Область используется в услугах"),
+    "fk_service_period": ("period", "У предприятия нет этого отчетного периода",
+                          "По отчётному периоду есть услуги — сначала удалите их"),
+    "fk_service_type": ("service_types", "Вид услуги не найден", "Вид услуги используется в услугах"),
+}
+
+# Проверочные ограничения: имя -> сообщение
+CHECK_ERRORS = {
+    "valid_role": "Некорректная роль пользователя",
+    "valid_status": "Некорректный статус",
+}
+
+
+def map_db_error(error):
+    """
+    Сопоставляет ошибку БД с кодом ошибки API и сообщением для пользователя.
+    Возвращает (код, сообщение) или None, если ошибка не связана с ограничениями данных.
+    Коды: duplicate — повтор уникального ключа, not_found — нет записи, на которую ссылаются,
+    in_use — запись используется другими, invalid — недопустимое значение,
+    rejected — запись отклонена триггером (например, закрытый отчетный год).
+    """
+    pgcode = getattr(error, "pgcode", None)
+    diag = getattr(error, "diag", None)
+    constraint = diag.constraint_name if diag is not None else None
+
+    if pgcode == errorcodes.UNIQUE_VIOLATION:
+        return "duplicate", UNIQUE_ERRORS.get(constraint, "Такая запись уже существует")
+    if pgcode == errorcodes.FOREIGN_KEY_VIOLATION:
+        referenced_table, missing_message, in_use_message = FOREIGN_KEY_ERRORS.get(
+            constraint, (None, "Связанная запись не найдена", "Запись используется в других данных"))
+        # При удалении ошибка относится к таблице, на которую ссылаются, при записи — к ссылающейся
+        if referenced_table is not None and diag.table_name == referenced_table:
+            return "in_use", in_use_message
+        return "not_found", missing_message
+    if pgcode == errorcodes.CHECK_VIOLATION:
+        return "invalid", CHECK_ERRORS.get(constraint, "Недопустимое значение")
+    if pgcode == errorcodes.RAISE_EXCEPTION:
+        return "rejected", diag.message_primary
+    return None
@@ -1,10 +1,31 @@
-from fastapi import FastAPI, Request, Form
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, Request, Form, Body, File, UploadFile
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.templating import Jinja2Templates
-from app.database import test_connections, get_main_db_connection, get_users_db_connection
+from app.database import (test_connections, get_main_db_connection, get_users_db_connection,
+                          release_connection, get_pool_stats, close_all_pools, configure_db_concurrency)
+from app.reference_cache import (REFERENCE_QUERIES, get_reference, invalidate_reference,
+                                 get_reference_cache_stats, warm_up_reference_cache)
+from app.cache_events import on_table_change, start_cache_listener, stop_cache_listener, get_cache_listener_stats
+from app.data_versions import (peek_data_versions, get_data_versions, invalidate_data_versions,
+                               make_etag, etag_matches)
+from app.report_store import (peek_closed_years, get_closed_years, invalidate_closed_years,
+                              report_stamp, report_etag, load_report, save_report, purge_reports)
+from app.cube_refresh import (refresh_services_cube, request_cube_refresh, start_cube_refresher,
+                              stop_cube_refresher, get_cube_refresher_stats)
+from app.single_flight import report_single_flight, get_single_flight_stats
+from app.services_import import ImportFileError, read_import_file, import_services
+from app.db_errors import map_db_error
 from app.auth.routes import check_user_login, check_login_unique, check_email_unique, create_user
 from app.auth.security import record_failed_attempt, record_successful_attempt, is_blocked, get_remaining_attempts
 from datetime import datetime
+import base64
+import csv
+import gzip
+import io
+import json
+import re
+import threading
 app = FastAPI(title="Enterprise Reporting System")
 templates = Jinja2Templates(directory="app/templates")
 
@@ -12,7 +33,298 @@ templates = Jinja2Templates(directory="app/templates")
 # Тестируем подключение к БД при старте
 @app.on_event("startup")
 async def startup_event():
+    configure_db_concurrency()
     test_connections()
+    warm_up_reference_cache()
+    start_cache_listener()
+    start_cube_refresher()
+
+
+# Закрываем пулы соединений при остановке
+@app.on_event("shutdown")
+async def shutdown_event():
+    stop_cache_listener()
+    stop_cube_refresher()
+    close_all_pools()
+
+
+# Кэш кодов показателей по видам услуг: {вид услуги: код показателя}.
+# Загружается один раз и сбрасывается при изменении услуг через админку
+_indicator_codes_cache = None
+_indicator_codes_lock = threading.Lock()
+
+
+def get_indicator_codes(cur) -> dict:
+    """Возвращает коды показателей по видам услуг (из кэша или из БД)"""
+    global _indicator_codes_cache
+    with _indicator_codes_lock:
+        if _indicator_codes_cache is None:
+            # Для каждого вида услуг берём код из последней добавленной записи
+            cur.execute("""
+                SELECT DISTINCT ON (s."Код_вида_услуг") st."Наименование_вида_услуг", s."Код_показателя"
+                FROM services s
+                JOIN service_types st ON st.id = s."Код_вида_услуг"
+                ORDER BY s."Код_вида_услуг", s.id DESC
+            """)
+            _indicator_codes_cache = {row[0]: row[1] for row in cur.fetchall()}
+        return _indicator_codes_cache
+
+
+def invalidate_indicator_codes():
+    global _indicator_codes_cache
+    with _indicator_codes_lock:
+        _indicator_codes_cache = None
+
+
+# Изменения в БД, сделанные другими воркерами, приходят через LISTEN cache_events
+for _table in ("ministries", "industries", "regions", "districts", "service_types"):
+    on_table_change(_table, lambda table=_table: invalidate_reference(table))
+on_table_change("services", invalidate_indicator_codes)
+on_table_change("service_types", invalidate_indicator_codes)
+for _table in ("enterprises", "services", "services_cube", "period", "districts", "regions",
+               "ministries", "industries", "service_types"):
+    on_table_change(_table, invalidate_data_versions)
+on_table_change("closed_years", invalidate_closed_years)
+
+# Отчеты, одинаковые одновременные запросы к которым выполняются один раз
+COALESCED_PREFIXES = ("/api/reports/", "/api/district/", "/api/main/")
+COALESCED_SUFFIXES = ("/combined-reports-server",)
+
+
+def request_key(request: Request) -> str:
+    """Адрес запроса с параметрами в постоянном порядке — ключ кэшей и объединения запросов"""
+    query = "&".join(f"{name}={value}" for name, value in sorted(request.query_params.multi_items()))
+    return f"{request.url.path}?{query}"
+
+
+def is_coalesced_report(path: str) -> bool:
+    return path.startswith(COALESCED_PREFIXES) or path.endswith(COALESCED_SUFFIXES)
+
+
+# Объявлен раньше остальных middleware — выполняется ближе всех к обработчику,
+# после проверок ETag и сохраненных отчетов закрытых годов
+@app.middleware("http")
+async def coalesce_reports_middleware(request: Request, call_next):
+    """
+    Одновременные одинаковые запросы отчетов (адрес + параметры) разделяют одно
+    вычисление: обработчик выполняется один раз, все получают его ответ.
+    """
+    if request.method != "GET" or not is_coalesced_report(request.url.path):
+        return await call_next(request)
+
+    # Версии данных входят в ключ (те же, из которых conditional_get_middleware построил ETag):
+    # запрос, пришедший после записи, не получит ответ вычисления, начатого до неё
+    versions = getattr(request.state, "data_versions", None)
+    if versions is None:
+        try:
+            versions = peek_data_versions()
+            if versions is None:
+                versions = await run_in_threadpool(get_data_versions)
+        except Exception as e:
+            print(f"⚠️ Не удалось получить версии данных для объединения запросов: {e}")
+            return await call_next(request)
+    key = request_key(request) + "|" + ",".join(f"{table}:{versions.get(table, 0)}" for table in REPORT_TABLES)
+
+    async def compute():
+        response = await call_next(request)
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        return response.status_code, dict(response.headers), body, response.media_type
+
+    status_code, headers, body, media_type = await report_single_flight.do(key, compute)
+    return Response(content=body, status_code=status_code, headers=headers, media_type=media_type)
+
+
+# Таблицы, из которых строятся ответы GET API (по префиксу адреса) — их версии входят в ETag
+REPORT_TABLES = ("enterprises", "services", "services_cube", "period", "districts", "regions", "service_types")
+CATALOG_TABLES = ("enterprises", "ministries", "industries", "regions", "districts", "service_types")
+ETAG_PREFIXES = (
+    ("/api/reports/", REPORT_TABLES),
+    ("/api/district/", REPORT_TABLES),
+    ("/api/main/", REPORT_TABLES),
+    ("/api/catalogs/", CATALOG_TABLES),
+    ("/api/filters/", CATALOG_TABLES),
+)
+
+
+def get_etag_tables(path: str):
+    for prefix, tables in ETAG_PREFIXES:
+        if path.startswith(prefix):
+            return tables
+    return None
+
+
+@app.middleware("http")
+async def conditional_get_middleware(request: Request, call_next):
+    """
+    Условные GET для отчетов и справочников: ETag строится из адреса и версий данных,
+    поэтому при совпадении If-None-Match ответ 304 отдаётся без обращения к обработчику.
+    """
+    tables = get_etag_tables(request.url.path) if request.method == "GET" else None
+    if not tables:
+        return await call_next(request)
+
+    try:
+        versions = peek_data_versions()
+        if versions is None:
+            versions = await run_in_threadpool(get_data_versions)
+    except Exception as e:
+        print(f"⚠️ Не удалось получить версии данных для ETag: {e}")
+        return await call_next(request)
+
+    # Ответ вычисляется под этими же версиями (ключ объединения запросов)
+    request.state.data_versions = versions
+    etag = make_etag(versions, tables, request_key(request))
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    response = await call_next(request)
+    if response.status_code != 200:
+        return response
+
+    # Ответ с ошибкой ({"success": false}) не должен закрепиться в кэше клиента
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    try:
+        cacheable = json.loads(body).get("success") is not False
+    except (ValueError, AttributeError):
+        cacheable = False
+    response_headers = dict(response.headers)
+    if cacheable:
+        response_headers.update(headers)
+    return Response(content=body, status_code=response.status_code,
+                    headers=response_headers, media_type=response.media_type)
+
+
+# Отчеты, которые для закрытых годов хранятся на диске (год — в адресе или start_year..end_year)
+CLOSED_YEAR_REPORT_PATHS = (
+    re.compile(r"^/api/reports/enterprise/\d+/periods/(?P<year>\d+)/regions/\d+/districts/\d+/final-report$"),
+    re.compile(r"^/api/district/districts/\d+/periods/(?P<year>\d+)/summary$"),
+    re.compile(r"^/api/reports/filtered-report$"),
+)
+# Таблицы, из которых строятся сохраненные отчеты: услуги и периоды закрытого года не меняются
+# (триггер forbid_closed_year_changes), а справочники можно править, и куб services_cube
+# догоняет услуги в фоне — их версии входят в отметку отчета
+CLOSED_REPORT_TABLES = ("enterprises", "districts", "regions", "service_types", "services_cube")
+# Клиент перепроверяет отчет по ETag (отметка + адрес): после открытия и повторного
+# закрытия года или правки справочника отметка меняется, и клиент получает новый отчет
+CLOSED_YEAR_CACHE_CONTROL = "no-cache"
+MAX_CLOSED_REPORT_YEARS = 50  # длиннее диапазоны лет не сохраняем
+
+
+def get_report_years(request: Request):
+    """Годы (первый, последний), за которые строится отчет, или None для остальных адресов"""
+    for pattern in CLOSED_YEAR_REPORT_PATHS:
+        match = pattern.match(request.url.path)
+        if not match:
+            continue
+        if match.groupdict().get("year"):
+            year = int(match.group("year"))
+            return year, year
+        try:
+            return int(request.query_params["start_year"]), int(request.query_params["end_year"])
+        except (KeyError, ValueError):
+            return None
+    return None
+
+
+def report_closed_range(start_year: int, end_year: int):
+    """
+    Годы, которые должны быть закрыты, чтобы отчет за start_year..end_year можно было хранить:
+    отчет за один год показывает и факт предыдущего года, поэтому предыдущий год тоже нужен закрытым
+    """
+    return (start_year - 1 if start_year == end_year else start_year), end_year
+
+
+def years_closed(closed_years, start_year: int, end_year: int) -> bool:
+    if closed_years is None or not 0 <= end_year - start_year < MAX_CLOSED_REPORT_YEARS:
+        return False
+    return all(year in closed_years for year in range(start_year, end_year + 1))
+
+
+def closed_report_response(request: Request, compressed: bytes, etag: str) -> Response:
+    headers = {"Cache-Control": CLOSED_YEAR_CACHE_CONTROL, "Vary": "Accept-Encoding", "ETag": etag}
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=compressed, media_type="application/json", headers=headers)
+    return Response(content=gzip.decompress(compressed), media_type="application/json", headers=headers)
+
+
+@app.middleware("http")
+async def closed_year_reports_middleware(request: Request, call_next):
+    """
+    Отчеты закрытых годов не меняются, пока год закрыт: первый ответ сохраняется на диск
+    в сжатом виде, следующие отдаются из файла без обращения к БД, повторная проверка
+    клиента по ETag получает 304 без чтения файла.
+    """
+    years = get_report_years(request) if request.method == "GET" else None
+    if years is None:
+        return await call_next(request)
+    start_year, end_year = years
+    first_closed_year, last_closed_year = report_closed_range(start_year, end_year)
+
+    try:
+        closed_years = peek_closed_years()
+        if closed_years is None:
+            closed_years = await run_in_threadpool(get_closed_years)
+        if not years_closed(closed_years, first_closed_year, last_closed_year):
+            return await call_next(request)
+        versions = peek_data_versions()
+        if versions is None:
+            versions = await run_in_threadpool(get_data_versions)
+    except Exception as e:
+        print(f"⚠️ Не удалось получить закрытые годы или версии данных: {e}")
+        return await call_next(request)
+
+    key = request_key(request)
+    stamp = report_stamp(closed_years, first_closed_year, last_closed_year, versions, CLOSED_REPORT_TABLES)
+    etag = report_etag(stamp, key)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CLOSED_YEAR_CACHE_CONTROL})
+    compressed = await run_in_threadpool(load_report, start_year, end_year, stamp, key)
+    if compressed is not None:
+        return closed_report_response(request, compressed, etag)
+
+    response = await call_next(request)
+    if response.status_code != 200:
+        return response
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    try:
+        success = json.loads(body).get("success") is not False
+    except (ValueError, AttributeError):
+        success = False
+    # Пока строился отчет, год могли открыть для изменений или поправить справочник —
+    # тогда не сохраняем. Если этот воркер ещё не знает об изменении, отчет ляжет под
+    # старой отметкой и после обновления закрытых годов и версий читаться не будет
+    current_years = peek_closed_years()
+    current_versions = peek_data_versions()
+    if (not success or current_versions is None
+            or not years_closed(current_years, first_closed_year, last_closed_year)
+            or report_stamp(current_years, first_closed_year, last_closed_year,
+                            current_versions, CLOSED_REPORT_TABLES) != stamp):
+        return Response(content=body, status_code=response.status_code,
+                        headers=dict(response.headers), media_type=response.media_type)
+
+    try:
+        compressed = await run_in_threadpool(save_report, start_year, end_year, stamp, key, body)
+    except Exception as e:
+        # Отчет уже построен: ошибка записи на диск не должна превращать его в ошибку ответа
+        print(f"⚠️ Не удалось сохранить отчет закрытого года: {e}")
+        return Response(content=body, status_code=response.status_code,
+                        headers=dict(response.headers), media_type=response.media_type)
+    return closed_report_response(request, compressed, etag)
+
+
+def write_error_response(error):
+    """
+    Ответ на ошибку записи из админки. Нарушения ограничений БД (повтор, нет связанной
+    записи, запись используется) возвращаются с кодом ошибки и понятным сообщением —
+    проверки выполняет сама БД, поэтому они верны и при одновременных изменениях.
+    """
+    mapped = map_db_error(error)
+    if mapped is None:
+        return JSONResponse(content={"success": False, "error": str(error)})
+    code, message = mapped
+    return JSONResponse(content={"success": False, "error": message, "code": code})
 
 
 # Главная страница выбора режима
@@ -43,7 +355,7 @@ async def admin_login_page(request: Request):
 
 # Обновляем обработчики входа с защитой от брут-форса
 @app.post("/api/login")
-async def api_login(request: Request, username: str = Form(...), password: str = Form(...)):
+def api_login(request: Request, username: str = Form(...), password: str = Form(...)):
     client_ip = request.client.host
 
     # Проверяем не заблокирован ли пользователь
@@ -84,7 +396,7 @@ async def api_login(request: Request, username: str = Form(...), password: str =
 
 
 @app.post("/api/admin_login")
-async def api_admin_login(request: Request, username: str = Form(...), password: str = Form(...)):
+def api_admin_login(request: Request, username: str = Form(...), password: str = Form(...)):
     client_ip = request.client.host
 
     # Проверяем не заблокирован ли пользователь
@@ -191,7 +503,7 @@ async def logout():
 
 # API для регистрации нового пользователя
 @app.post("/api/register")
-async def api_register(
+def api_register(
         full_name: str = Form(...),
         email: str = Form(...),
         username: str = Form(...),
@@ -214,21 +526,7 @@ async def api_register(
             "error": "Пароль должен содержать минимум 6 символов"
         })
 
-    # 3. Проверяем уникальность логина
-    if not check_login_unique(username):
-        return JSONResponse(content={
-            "success": False,
-            "error": "Логин уже занят"
-        })
-
-    # 4. Проверяем уникальность email
-    if not check_email_unique(email):
-        return JSONResponse(content={
-            "success": False,
-            "error": "Email уже занят"
-        })
-
-    # 5. Создаем пользователя
+    # 3. Создаем пользователя — занятые логин и email отклоняет ограничение БД
     result = create_user(full_name, email, username, password)
 
     if result["success"]:
@@ -238,20 +536,23 @@ async def api_register(
             "redirect_url": "/login"
         })
     else:
-        return JSONResponse(content={
+        content = {
             "success": False,
             "error": result.get("error", "Неизвестная ошибка при регистрации")
-        })
+        }
+        if "code" in result:
+            content["code"] = result["code"]
+        return JSONResponse(content=content)
 
 # API для проверки уникальности логина
 @app.get("/api/check_login")
-async def api_check_login(login: str):
+def api_check_login(login: str):
     is_unique = check_login_unique(login)
     return JSONResponse(content={"available": is_unique})
 
 # API для проверки уникальности email
 @app.get("/api/check_email")
-async def api_check_email(email: str):
+def api_check_email(email: str):
     is_unique = check_email_unique(email)
     return JSONResponse(content={"available": is_unique})
 #------------------------------------------------------------------------
@@ -259,7 +560,7 @@ async def api_check_email(email: str):
 # API для главной страницы - общая статистика
 # API для главной страницы - общая статистика
 @app.get("/api/main/statistics")
-async def get_main_statistics():
+def get_main_statistics():
     """Возвращает общую статистику для главной страницы"""
     conn = get_main_db_connection()
     if conn:
@@ -270,14 +571,14 @@ async def get_main_statistics():
             cur.execute("SELECT COUNT(*) FROM enterprises")
             total_enterprises = cur.fetchone()[0]
 
-            # 2. Суммарные показатели по всем услугам (общие)
+            # 2. Общие и сельские итоги по всем услугам — слоты общего итога services_summary
+            # (поддерживаются триггерами на services, суммировать таблицу услуг не нужно)
             cur.execute("""
-                SELECT 
-                    COALESCE(SUM(s."План_всего"), 0) as total_plan,
-                    COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as total_fact
-                FROM services s
+                SELECT SUM("План_всего"), SUM("Фактически_выполнено_всего"), SUM("План_село"), SUM("Факт_село")
+                FROM services_summary
+                WHERE "Срез" = 'global' AND "Ключ" = ''
             """)
-            totals = cur.fetchone()
+            totals = cur.fetchone() or (0, 0, 0, 0)
 
             # Преобразуем в числа
             total_plan = float(totals[0]) if totals[0] else 0.0
@@ -286,27 +587,9 @@ async def get_main_statistics():
             # 3. Расчет процента выполнения (общего)
             total_percentage = (total_fact / total_plan * 100) if total_plan > 0 else 0.0
 
-            # 4. Статистика по сельской местности - только для соответствующих категорий
-            rural_categories = [
-                "Услуги транспорта, в т.ч. в сельской местности",
-                "Услуги связи, в т.ч. в сельской местности",
-                "Услуги жилищного хозяйства, в т.ч. в сельской местности",
-                "Услуги культуры, в т.ч. в сельской местности",
-                "Прочие услуги, в т.ч. в сельской местности"
-            ]
-
-            # Суммируем только сельские категории
-            cur.execute("""
-                SELECT 
-                    COALESCE(SUM(s."План_всего"), 0) as rural_plan,
-                    COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as rural_fact
-                FROM services s
-                WHERE s."Наименование_вида_услуг" IN %s
-            """, (tuple(rural_categories),))
-
-            rural_totals = cur.fetchone()
-            rural_plan = float(rural_totals[0]) if rural_totals[0] else 0.0
-            rural_fact = float(rural_totals[1]) if rural_totals[1] else 0.0
+            # 4. Статистика по сельской местности
+            rural_plan = float(totals[2]) if totals[2] else 0.0
+            rural_fact = float(totals[3]) if totals[3] else 0.0
             rural_percentage = (rural_fact / rural_plan * 100) if rural_plan > 0 else 0.0
 
             return JSONResponse(content={
@@ -324,28 +607,33 @@ async def get_main_statistics():
             print(f"❌ Ошибка в get_main_statistics: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 
 # API для детальной информации по услугам
 @app.get("/api/main/services-detailed")
-async def get_services_detailed():
+def get_services_detailed():
     """Возвращает детальную информацию по всем видам услуг"""
     conn = get_main_db_connection()
     if conn:
         try:
             cur = conn.cursor()
 
-            # Получаем все виды услуг (даже если по ним нет данных)
+            # Получаем все виды услуг (даже если по ним нет данных) с итогами из services_summary
             cur.execute("""
                 SELECT st."Наименование_вида_услуг",
-                       COALESCE(SUM(s."План_всего"), 0) as plan_total,
-                       COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as fact_total
+                       COALESCE(ss."План_всего", 0) as plan_total,
+                       COALESCE(ss."Фактически_выполнено_всего", 0) as fact_total
                 FROM service_types st
-                LEFT JOIN services s ON st."Наименование_вида_услуг" = s."Наименование_вида_услуг"
-                GROUP BY st."Наименование_вида_услуг"
+                LEFT JOIN (
+                    SELECT "Ключ", SUM("План_всего") AS "План_всего",
+                           SUM("Фактически_выполнено_всего") AS "Фактически_выполнено_всего"
+                    FROM services_summary
+                    WHERE "Срез" = 'service_type'
+                    GROUP BY "Ключ"
+                ) ss ON ss."Ключ" = st."Наименование_вида_услуг"
                 ORDER BY st."Наименование_вида_услуг"
             """)
 
@@ -372,7 +660,7 @@ async def get_services_detailed():
             print(f"❌ Ошибка в get_services_detailed: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 #--------------------------------------------------------------------------------------------
@@ -416,67 +704,43 @@ async def catalogs_page(request: Request):
 # API для получения списка предприятий с статистикой
 # API для получения списка предприятий с статистикой (ОБНОВЛЕННАЯ ВЕРСИЯ)
 @app.get("/api/reports/enterprises")
-async def get_enterprises_with_stats():
+def get_enterprises_with_stats():
     """Возвращает список всех предприятий с агрегированной статистикой"""
     conn = get_main_db_connection()
     if conn:
         try:
             cur = conn.cursor()
 
-            # Получаем предприятия с общей статистикой (БЕЗ Выполнено_за_прошлый_год)
+            # Общая и сельская статистика по всем предприятиям одним запросом
+            # по кубу агрегатов services_cube (условная агрегация по признаку сельской местности)
             cur.execute("""
                 SELECT 
                     e."Регистрационный_номер",
                     e."Наименование_предприятия",
-                    e."Код_министерства",
-                    e."Код_отрасли", 
-                    e."Код_области",
-                    COALESCE(SUM(s."План_всего"), 0) as total_plan,
-                    COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as total_fact
+                    COALESCE(SUM(c."План_всего"), 0) as total_plan,
+                    COALESCE(SUM(c."Фактически_выполнено_всего"), 0) as total_fact,
+                    COALESCE(SUM(c."План_всего") FILTER (WHERE c."Сельская_местность"), 0) as rural_plan,
+                    COALESCE(SUM(c."Фактически_выполнено_всего") FILTER (WHERE c."Сельская_местность"), 0) as rural_fact
                 FROM enterprises e
-                LEFT JOIN services s ON e."Регистрационный_номер" = s."Регистрационный_номер"
-                GROUP BY e."Регистрационный_номер", e."Наименование_предприятия", 
-                         e."Код_министерства", e."Код_отрасли", e."Код_области"
+                LEFT JOIN services_cube c ON e."Регистрационный_номер" = c."Регистрационный_номер"
+                GROUP BY e."Регистрационный_номер", e."Наименование_предприятия"
                 ORDER BY e."Наименование_предприятия"
             """)
 
             enterprises = []
             for row in cur.fetchall():
-                reg_number = row[0]
-                name = row[1]
-                # Исправленные индексы - теперь только 7 полей вместо 8
-                total_plan = float(row[5]) if row[5] else 0.0
-                total_fact = float(row[6]) if row[6] else 0.0
+                total_plan = float(row[2]) if row[2] else 0.0
+                total_fact = float(row[3]) if row[3] else 0.0
+                rural_plan = float(row[4]) if row[4] else 0.0
+                rural_fact = float(row[5]) if row[5] else 0.0
 
                 # Расчет процентов
                 total_percentage = (total_fact / total_plan * 100) if total_plan > 0 else 0.0
-
-                # Статистика по сельской местности
-                rural_categories = [
-                    "Услуги транспорта, в т.ч. в сельской местности",
-                    "Услуги связи, в т.ч. в сельской местности",
-                    "Услуги жилищного хозяйства, в т.ч. в сельской местности",
-                    "Услуги культуры, в т.ч. в сельской местности",
-                    "Прочие услуги, в т.ч. в сельской местности"
-                ]
-
-                cur.execute("""
-                    SELECT 
-                        COALESCE(SUM("План_всего"), 0) as rural_plan,
-                        COALESCE(SUM("Фактически_выполнено_всего"), 0) as rural_fact
-                    FROM services 
-                    WHERE "Регистрационный_номер" = %s 
-                    AND "Наименование_вида_услуг" IN %s
-                """, (reg_number, tuple(rural_categories)))
-
-                rural_stats = cur.fetchone()
-                rural_plan = float(rural_stats[0]) if rural_stats[0] else 0.0
-                rural_fact = float(rural_stats[1]) if rural_stats[1] else 0.0
                 rural_percentage = (rural_fact / rural_plan * 100) if rural_plan > 0 else 0.0
 
                 enterprises.append({
-                    "reg_number": reg_number,
-                    "name": name,
+                    "reg_number": row[0],
+                    "name": row[1],
                     "total_plan": total_plan,
                     "total_fact": total_fact,
                     "total_percentage": total_percentage,
@@ -491,7 +755,7 @@ async def get_enterprises_with_stats():
             print(f"❌ Ошибка в get_enterprises_with_stats: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
@@ -500,7 +764,7 @@ async def get_enterprises_with_stats():
 # API для детальной статистики по услугам предприятия за конкретный год (ОБНОВЛЕННАЯ ВЕРСИЯ)
 # API для детальной статистики по услугам предприятия за конкретный год с динамикой
 @app.get("/api/reports/enterprise/{reg_number}/services")
-async def get_enterprise_services_detail(reg_number: int, year: int = None):
+def get_enterprise_services_detail(reg_number: int, year: int = None):
     """Возвращает детальную статистику по услугам для конкретного предприятия и года с динамикой"""
     conn = get_main_db_connection()
     if conn:
@@ -518,7 +782,7 @@ async def get_enterprise_services_detail(reg_number: int, year: int = None):
                     COALESCE(SUM(s."План_всего"), 0) as plan_total,
                     COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as fact_total
                 FROM service_types st
-                LEFT JOIN services s ON st."Наименование_вида_услуг" = s."Наименование_вида_услуг" 
+                LEFT JOIN services s ON s."Код_вида_услуг" = st.id 
                     AND s."Регистрационный_номер" = %s
             """
             params_current = [reg_number]
@@ -540,7 +804,7 @@ async def get_enterprise_services_detail(reg_number: int, year: int = None):
                         st."Наименование_вида_услуг",
                         COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as previous_fact
                     FROM service_types st
-                    LEFT JOIN services s ON st."Наименование_вида_услуг" = s."Наименование_вида_услуг" 
+                    LEFT JOIN services s ON s."Код_вида_услуг" = st.id 
                         AND s."Регистрационный_номер" = %s AND s."Отчетный_период" = %s
                     GROUP BY st."Наименование_вида_услуг"
                 """
@@ -582,7 +846,7 @@ async def get_enterprise_services_detail(reg_number: int, year: int = None):
             print(f"❌ Ошибка в get_enterprise_services_detail: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 #-----------------------------------------------------------------------------------------------
@@ -623,93 +887,55 @@ async def enterprise_periods(request: Request, reg_number: int):
 # API для получения отчетных периодов предприятия с статистикой
 # API для получения отчетных периодов предприятия с статистикой (ОБНОВЛЕННАЯ ВЕРСИЯ)
 @app.get("/api/reports/enterprise/{reg_number}/periods")
-async def get_enterprise_periods(reg_number: int):
+def get_enterprise_periods(reg_number: int):
     """Возвращает список отчетных периодов для предприятия с агрегированной статистикой"""
     conn = get_main_db_connection()
     if conn:
         try:
             cur = conn.cursor()
 
-            # Получаем уникальные отчетные периоды для предприятия
+            # Итоги по каждому году предприятия и факт предыдущего года одним запросом:
+            # годовые суммы считаются один раз по кубу агрегатов, а прошлый год подтягивается self-join'ом
             cur.execute("""
-                SELECT DISTINCT s."Отчетный_период"
-                FROM services s
-                WHERE s."Регистрационный_номер" = %s
-                ORDER BY s."Отчетный_период" DESC
+                WITH yearly AS (
+                    SELECT 
+                        "Отчетный_период" as year,
+                        COALESCE(SUM("План_всего"), 0) as total_plan,
+                        COALESCE(SUM("Фактически_выполнено_всего"), 0) as total_fact,
+                        COALESCE(SUM("План_всего") FILTER (WHERE "Сельская_местность"), 0) as rural_plan,
+                        COALESCE(SUM("Фактически_выполнено_всего") FILTER (WHERE "Сельская_местность"), 0) as rural_fact
+                    FROM services_cube 
+                    WHERE "Регистрационный_номер" = %s
+                    GROUP BY "Отчетный_период"
+                )
+                SELECT 
+                    cur.year,
+                    cur.total_plan,
+                    cur.total_fact,
+                    cur.rural_plan,
+                    cur.rural_fact,
+                    COALESCE(prev.total_fact, 0) as previous_fact,
+                    COALESCE(prev.rural_fact, 0) as rural_previous_fact
+                FROM yearly cur
+                LEFT JOIN yearly prev ON prev.year = cur.year - 1
+                ORDER BY cur.year DESC
             """, (reg_number,))
 
             periods = []
             for row in cur.fetchall():
                 year = row[0]
+                current_plan = float(row[1]) if row[1] else 0.0
+                current_fact = float(row[2]) if row[2] else 0.0
+                rural_plan = float(row[3]) if row[3] else 0.0
+                rural_fact = float(row[4]) if row[4] else 0.0
+                previous_fact = float(row[5]) if row[5] else 0.0
+                rural_previous_fact = float(row[6]) if row[6] else 0.0
 
-                # Статистика за текущий год (БЕЗ Выполнено_за_прошлый_год)
-                cur.execute("""
-                    SELECT 
-                        COALESCE(SUM("План_всего"), 0) as total_plan,
-                        COALESCE(SUM("Фактически_выполнено_всего"), 0) as total_fact   
-                    FROM services 
-                    WHERE "Регистрационный_номер" = %s AND "Отчетный_период" = %s
-                """, (reg_number, year))
-
-                current_stats = cur.fetchone()
-                current_plan = float(current_stats[0]) if current_stats[0] else 0.0
-                current_fact = float(current_stats[1]) if current_stats[1] else 0.0
                 current_percentage = (current_fact / current_plan * 100) if current_plan > 0 else 0.0
-
-                # Статистика по сельской местности за текущий год
-                rural_categories = [
-                    "Услуги транспорта, в т.ч. в сельской местности",
-                    "Услуги связи, в т.ч. в сельской местности",
-                    "Услуги жилищного хозяйства, в т.ч. в сельской местности",
-                    "Услуги культуры, в т.ч. в сельской местности",
-                    "Прочие услуги, в т.ч. в сельской местности"
-                ]
-
-                cur.execute("""
-                    SELECT 
-                        COALESCE(SUM("План_всего"), 0) as rural_plan,
-                        COALESCE(SUM("Фактически_выполнено_всего"), 0) as rural_fact
-                    FROM services 
-                    WHERE "Регистрационный_номер" = %s 
-                    AND "Отчетный_период" = %s
-                    AND "Наименование_вида_услуг" IN %s
-                """, (reg_number, year, tuple(rural_categories)))
-
-                rural_stats = cur.fetchone()
-                rural_plan = float(rural_stats[0]) if rural_stats[0] else 0.0
-                rural_fact = float(rural_stats[1]) if rural_stats[1] else 0.0
                 rural_percentage = (rural_fact / rural_plan * 100) if rural_plan > 0 else 0.0
 
-                # Статистика за предыдущий год для динамики (используем фактические данные)
-                previous_year = year - 1
-                cur.execute("""
-                    SELECT 
-                        COALESCE(SUM("Фактически_выполнено_всего"), 0) as previous_fact
-                    FROM services 
-                    WHERE "Регистрационный_номер" = %s AND "Отчетный_период" = %s
-                """, (reg_number, previous_year))
-
-                previous_stats = cur.fetchone()
-                previous_fact = float(previous_stats[0]) if previous_stats[0] else 0.0
-
-                # Расчет динамики - ПРАВИЛЬНАЯ ФОРМУЛА
-                # Динамика = (Текущий год - Прошлый год) / Прошлый год * 100
-                dynamics_total = (current_fact/ previous_fact * 100) if previous_fact > 0 else 0.0
-
-                # Статистика по сельской местности за предыдущий год для динамики
-                cur.execute("""
-                    SELECT 
-                        COALESCE(SUM("Фактически_выполнено_всего"), 0) as rural_previous_fact
-                    FROM services 
-                    WHERE "Регистрационный_номер" = %s 
-                    AND "Отчетный_период" = %s
-                    AND "Наименование_вида_услуг" IN %s
-                """, (reg_number, previous_year, tuple(rural_categories)))
-
-                rural_previous_stats = cur.fetchone()
-                rural_previous_fact = float(rural_previous_stats[0]) if rural_previous_stats[0] else 0.0
-
-                # Динамика для сельской местности
+                # Динамика = Текущий год / Прошлый год * 100
+                dynamics_total = (current_fact / previous_fact * 100) if previous_fact > 0 else 0.0
                 dynamics_rural = (rural_fact / rural_previous_fact * 100) if rural_previous_fact > 0 else 0.0
 
                 periods.append({
@@ -730,13 +956,13 @@ async def get_enterprise_periods(reg_number: int):
             print(f"❌ Ошибка в get_enterprise_periods: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 #-----------------------------------------------------------------------------------------------
 ## API для получения областей с статистикой для предприятия и периода (ПОЛНОСТЬЮ ПЕРЕПИСАННАЯ ВЕРСИЯ)
 @app.get("/api/reports/enterprise/{reg_number}/periods/{year}/regions")
-async def get_enterprise_regions(reg_number: int, year: int):
+def get_enterprise_regions(reg_number: int, year: int):
     """Возвращает список областей с агрегированной статистикой для предприятия и периода"""
     conn = get_main_db_connection()
     if conn:
@@ -744,143 +970,75 @@ async def get_enterprise_regions(reg_number: int, year: int):
             cur = conn.cursor()
             print(f"🔍 Поиск областей для предприятия {reg_number} за {year} год")
 
-            # Сначала проверим, есть ли вообще данные для этого предприятия и периода
-            check_query = """
-            SELECT COUNT(*) FROM services 
-            WHERE "Регистрационный_номер" = %s AND "Отчетный_период" = %s
-            """
-            cur.execute(check_query, (reg_number, year))
-            total_services = cur.fetchone()[0]
-
-            if total_services == 0:
-                print(f"⚠️ Нет данных для предприятия {reg_number} за {year} год")
-                return JSONResponse(content={"success": True, "regions": []})
-
-            # Получаем уникальные области
+            # Все области предприятия за год с количеством районов/услуг, текущей статистикой
+            # и фактом прошлого года — одним сгруппированным запросом по кубу агрегатов services_cube
             regions_query = """
-            SELECT DISTINCT 
+            SELECT 
                 r."Код_области",
-                r."Наименование_области"
-            FROM services s
-            JOIN districts d ON s."Код_района" = d."Код_района" 
-            JOIN regions r ON d."Код_области" = r."Код_области"
-            WHERE s."Регистрационный_номер" = %s AND s."Отчетный_период" = %s
+                r."Наименование_области",
+                COUNT(DISTINCT s."Код_района") FILTER (WHERE s."Отчетный_период" = %(year)s) as districts_count,
+                COALESCE(SUM(s."Количество_записей") FILTER (WHERE s."Отчетный_период" = %(year)s), 0) as services_count,
+                COALESCE(SUM(s."План_всего") FILTER (WHERE s."Отчетный_период" = %(year)s), 0) as total_plan,
+                COALESCE(SUM(s."Фактически_выполнено_всего") FILTER (WHERE s."Отчетный_период" = %(year)s), 0) as total_fact,
+                COALESCE(SUM(s."План_всего") FILTER (
+                    WHERE s."Отчетный_период" = %(year)s
+                        AND s."Сельская_местность"
+                ), 0) as rural_plan,
+                COALESCE(SUM(s."Фактически_выполнено_всего") FILTER (
+                    WHERE s."Отчетный_период" = %(year)s
+                        AND s."Сельская_местность"
+                ), 0) as rural_fact,
+                COALESCE(SUM(s."Фактически_выполнено_всего") FILTER (
+                    WHERE s."Отчетный_период" = %(prev_year)s
+                ), 0) as prev_total_fact,
+                COALESCE(SUM(s."Фактически_выполнено_всего") FILTER (
+                    WHERE s."Отчетный_период" = %(prev_year)s
+                        AND s."Сельская_местность"
+                ), 0) as prev_rural_fact
+            FROM services_cube s
+            JOIN regions r ON s."Код_области" = r."Код_области"
+            WHERE s."Регистрационный_номер" = %(reg_number)s 
+                AND s."Отчетный_период" IN (%(year)s, %(prev_year)s)
+            GROUP BY r."Код_области", r."Наименование_области"
+            HAVING COUNT(*) FILTER (WHERE s."Отчетный_период" = %(year)s) > 0
             ORDER BY r."Наименование_области"
             """
 
-            cur.execute(regions_query, (reg_number, year))
+            cur.execute(regions_query, {"reg_number": reg_number, "year": year, "prev_year": year - 1})
             regions_data = cur.fetchall()
             print(f"📊 Найдено областей: {len(regions_data)}")
 
             regions = []
-            for region in regions_data:
-                region_code = region[0]
-                region_name = region[1]
-                print(f"🔍 Обрабатываем область: {region_name} (код: {region_code})")
-
-                try:
-                    # Получаем количество районов и услуг
-                    count_query = """
-                    SELECT 
-                        COUNT(DISTINCT d."Код_района") as districts_count,
-                        COUNT(DISTINCT s.id) as services_count
-                    FROM services s
-                    JOIN districts d ON s."Код_района" = d."Код_района"
-                    WHERE s."Регистрационный_номер" = %s 
-                        AND s."Отчетный_период" = %s 
-                        AND d."Код_области" = %s
-                    """
-                    cur.execute(count_query, (reg_number, year, region_code))
-                    count_result = cur.fetchone()
-
-                    districts_count = count_result[0] if count_result else 0
-                    services_count = count_result[1] if count_result else 0
-
-                    # Получаем статистику по области
-                    stats_query = """
-                    SELECT 
-                        COALESCE(SUM(s."План_всего"), 0) as total_plan,
-                        COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as total_fact,
-                        COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
-                            THEN s."План_всего" ELSE 0 
-                        END), 0) as rural_plan,
-                        COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
-                            THEN s."Фактически_выполнено_всего" ELSE 0 
-                        END), 0) as rural_fact
-                    FROM services s
-                    JOIN districts d ON s."Код_района" = d."Код_района"
-                    WHERE s."Регистрационный_номер" = %s 
-                        AND s."Отчетный_период" = %s 
-                        AND d."Код_области" = %s
-                    """
-
-                    cur.execute(stats_query, (reg_number, year, region_code))
-                    stats_result = cur.fetchone()
-
-                    if stats_result:
-                        total_plan = float(stats_result[0]) if stats_result[0] is not None else 0.0
-                        total_fact = float(stats_result[1]) if stats_result[1] is not None else 0.0
-                        rural_plan = float(stats_result[2]) if stats_result[2] is not None else 0.0
-                        rural_fact = float(stats_result[3]) if stats_result[3] is not None else 0.0
-                    else:
-                        total_plan = total_fact = rural_plan = rural_fact = 0.0
-
-                    # Расчет процентов
-                    total_percentage = (total_fact / total_plan * 100) if total_plan > 0 else 0.0
-                    rural_percentage = (rural_fact / rural_plan * 100) if rural_plan > 0 else 0.0
-
-                    # Статистика за предыдущий год
-                    prev_year = year - 1
-                    prev_stats_query = """
-                    SELECT 
-                        COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as prev_total_fact,
-                        COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
-                            THEN s."Фактически_выполнено_всего" ELSE 0 
-                        END), 0) as prev_rural_fact
-                    FROM services s
-                    JOIN districts d ON s."Код_района" = d."Код_района"
-                    WHERE s."Регистрационный_номер" = %s 
-                        AND s."Отчетный_период" = %s 
-                        AND d."Код_области" = %s
-                    """
-
-                    cur.execute(prev_stats_query, (reg_number, prev_year, region_code))
-                    prev_stats_result = cur.fetchone()
-
-                    if prev_stats_result:
-                        prev_total_fact = float(prev_stats_result[0]) if prev_stats_result[0] is not None else 0.0
-                        prev_rural_fact = float(prev_stats_result[1]) if prev_stats_result[1] is not None else 0.0
-                    else:
-                        prev_total_fact = prev_rural_fact = 0.0
+            for row in regions_data:
+                total_plan = float(row[4]) if row[4] is not None else 0.0
+                total_fact = float(row[5]) if row[5] is not None else 0.0
+                rural_plan = float(row[6]) if row[6] is not None else 0.0
+                rural_fact = float(row[7]) if row[7] is not None else 0.0
+                prev_total_fact = float(row[8]) if row[8] is not None else 0.0
+                prev_rural_fact = float(row[9]) if row[9] is not None else 0.0
 
-                    # Расчет динамики
-                    dynamics_total = (total_fact / prev_total_fact * 100) if prev_total_fact > 0 else 0.0
-                    dynamics_rural = (rural_fact / prev_rural_fact * 100) if prev_rural_fact > 0 else 0.0
-
-                    region_data = {
-                        "region_code": region_code,
-                        "region_name": region_name,
-                        "districts_count": districts_count,
-                        "services_count": services_count,
-                        "total_plan": total_plan,
-                        "total_fact": total_fact,
-                        "total_percentage": total_percentage,
-                        "rural_plan": rural_plan,
-                        "rural_fact": rural_fact,
-                        "rural_percentage": rural_percentage,
-                        "dynamics_total": dynamics_total,
-                        "dynamics_rural": dynamics_rural
-                    }
+                # Расчет процентов
+                total_percentage = (total_fact / total_plan * 100) if total_plan > 0 else 0.0
+                rural_percentage = (rural_fact / rural_plan * 100) if rural_plan > 0 else 0.0
 
-                    regions.append(region_data)
-                    print(f"✅ Область {region_name} обработана успешно")
+                # Расчет динамики
+                dynamics_total = (total_fact / prev_total_fact * 100) if prev_total_fact > 0 else 0.0
+                dynamics_rural = (rural_fact / prev_rural_fact * 100) if prev_rural_fact > 0 else 0.0
 
-                except Exception as region_error:
-                    print(f"❌ Ошибка при обработке области {region_name}: {region_error}")
-                    continue
+                regions.append({
+                    "region_code": row[0],
+                    "region_name": row[1],
+                    "districts_count": row[2],
+                    "services_count": int(row[3]),
+                    "total_plan": total_plan,
+                    "total_fact": total_fact,
+                    "total_percentage": total_percentage,
+                    "rural_plan": rural_plan,
+                    "rural_fact": rural_fact,
+                    "rural_percentage": rural_percentage,
+                    "dynamics_total": dynamics_total,
+                    "dynamics_rural": dynamics_rural
+                })
 
             print(f"✅ Всего обработано областей: {len(regions)}")
             return JSONResponse(content={"success": True, "regions": regions})
@@ -891,12 +1049,12 @@ async def get_enterprise_regions(reg_number: int, year: int):
             print(f"🔍 Детальный traceback: {traceback.format_exc()}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 # API для детальной статистики по услугам в области (С ДИНАМИКОЙ)
 @app.get("/api/reports/enterprise/{reg_number}/periods/{year}/regions/{region_code}/services")
-async def get_region_services_detail(reg_number: int, year: int, region_code: int):
+def get_region_services_detail(reg_number: int, year: int, region_code: int):
     """Возвращает детальную статистику по услугам для области с динамикой"""
     conn = get_main_db_connection()
     if conn:
@@ -911,13 +1069,10 @@ async def get_region_services_detail(reg_number: int, year: int, region_code: in
                 COALESCE(SUM(s."План_всего"), 0) as plan_total,
                 COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as fact_total
             FROM service_types st
-            LEFT JOIN services s ON st."Наименование_вида_услуг" = s."Наименование_вида_услуг"
+            LEFT JOIN services s ON s."Код_вида_услуг" = st.id
                 AND s."Регистрационный_номер" = %s 
                 AND s."Отчетный_период" = %s
-                AND EXISTS (
-                    SELECT 1 FROM districts d 
-                    WHERE d."Код_района" = s."Код_района" AND d."Код_области" = %s
-                )
+                AND s."Код_области" = %s
             GROUP BY st."Наименование_вида_услуг"
             ORDER BY st."Наименование_вида_услуг"
             """
@@ -932,13 +1087,10 @@ async def get_region_services_detail(reg_number: int, year: int, region_code: in
                 st."Наименование_вида_услуг",
                 COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as previous_fact
             FROM service_types st
-            LEFT JOIN services s ON st."Наименование_вида_услуг" = s."Наименование_вида_услуг"
+            LEFT JOIN services s ON s."Код_вида_услуг" = st.id
                 AND s."Регистрационный_номер" = %s 
                 AND s."Отчетный_период" = %s
-                AND EXISTS (
-                    SELECT 1 FROM districts d 
-                    WHERE d."Код_района" = s."Код_района" AND d."Код_области" = %s
-                )
+                AND s."Код_области" = %s
             GROUP BY st."Наименование_вида_услуг"
             """
 
@@ -987,7 +1139,7 @@ async def get_region_services_detail(reg_number: int, year: int, region_code: in
             print(f"🔍 Детальный traceback: {traceback.format_exc()}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
     # Шаг 2.5: Выбор области
@@ -1012,7 +1164,7 @@ async def enterprise_regions(request: Request, reg_number: int, year: int):
 
 # API для получения районов в области с статистикой для предприятия и периода
 @app.get("/api/reports/enterprise/{reg_number}/periods/{year}/regions/{region_code}/districts")
-async def get_enterprise_districts(reg_number: int, year: int, region_code: int):
+def get_enterprise_districts(reg_number: int, year: int, region_code: int):
     """Возвращает список районов в области с агрегированной статистикой для предприятия и периода"""
     conn = get_main_db_connection()
     if conn:
@@ -1023,10 +1175,9 @@ async def get_enterprise_districts(reg_number: int, year: int, region_code: int)
             # Проверяем, есть ли данные
             check_query = """
             SELECT COUNT(*) FROM services s
-            JOIN districts d ON s."Код_района" = d."Код_района"
             WHERE s."Регистрационный_номер" = %s 
                 AND s."Отчетный_период" = %s 
-                AND d."Код_области" = %s
+                AND s."Код_области" = %s
             """
             cur.execute(check_query, (reg_number, year, region_code))
             total_services = cur.fetchone()[0]
@@ -1044,7 +1195,7 @@ async def get_enterprise_districts(reg_number: int, year: int, region_code: int)
             JOIN districts d ON s."Код_района" = d."Код_района"
             WHERE s."Регистрационный_номер" = %s 
                 AND s."Отчетный_период" = %s 
-                AND d."Код_области" = %s
+                AND s."Код_области" = %s
             GROUP BY d."Код_района", d."Наименование_района"
             ORDER BY d."Наименование_района"
             """
@@ -1066,11 +1217,11 @@ async def get_enterprise_districts(reg_number: int, year: int, region_code: int)
                         COALESCE(SUM(s."План_всего"), 0) as total_plan,
                         COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as total_fact,
                         COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                            WHEN s."Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                             THEN s."План_всего" ELSE 0 
                         END), 0) as rural_plan,
                         COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                            WHEN s."Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                             THEN s."Фактически_выполнено_всего" ELSE 0 
                         END), 0) as rural_fact
                     FROM services s
@@ -1100,7 +1251,7 @@ async def get_enterprise_districts(reg_number: int, year: int, region_code: int)
                     SELECT 
                         COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as prev_total_fact,
                         COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                            WHEN s."Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                             THEN s."Фактически_выполнено_всего" ELSE 0 
                         END), 0) as prev_rural_fact
                     FROM services s
@@ -1151,7 +1302,7 @@ async def get_enterprise_districts(reg_number: int, year: int, region_code: int)
             print(f"🔍 Детальный traceback: {traceback.format_exc()}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
@@ -1160,7 +1311,7 @@ async def get_enterprise_districts(reg_number: int, year: int, region_code: int)
 
 # API для детальной статистики по услугам в районе
 @app.get("/api/reports/enterprise/{reg_number}/periods/{year}/regions/{region_code}/districts/{district_code}/services")
-async def get_district_services_detail(reg_number: int, year: int, region_code: int, district_code: int):
+def get_district_services_detail(reg_number: int, year: int, region_code: int, district_code: int):
     """Возвращает детальную статистику по услугам для района с динамикой"""
     conn = get_main_db_connection()
     if conn:
@@ -1175,7 +1326,7 @@ async def get_district_services_detail(reg_number: int, year: int, region_code:
                 COALESCE(SUM(s."План_всего"), 0) as plan_total,
                 COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as fact_total
             FROM service_types st
-            LEFT JOIN services s ON st."Наименование_вида_услуг" = s."Наименование_вида_услуг"
+            LEFT JOIN services s ON s."Код_вида_услуг" = st.id
                 AND s."Регистрационный_номер" = %s 
                 AND s."Отчетный_период" = %s
                 AND s."Код_района" = %s
@@ -1193,7 +1344,7 @@ async def get_district_services_detail(reg_number: int, year: int, region_code:
                 st."Наименование_вида_услуг",
                 COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as previous_fact
             FROM service_types st
-            LEFT JOIN services s ON st."Наименование_вида_услуг" = s."Наименование_вида_услуг"
+            LEFT JOIN services s ON s."Код_вида_услуг" = st.id
                 AND s."Регистрационный_номер" = %s 
                 AND s."Отчетный_период" = %s
                 AND s."Код_района" = %s
@@ -1245,7 +1396,7 @@ async def get_district_services_detail(reg_number: int, year: int, region_code:
             print(f"🔍 Детальный traceback: {traceback.format_exc()}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
@@ -1271,7 +1422,7 @@ async def enterprise_districts(request: Request, reg_number: int, year: int, reg
 # API для получения данных для финального отчета (бланк формы № ПУ)
 @app.get(
     "/api/reports/enterprise/{reg_number}/periods/{year}/regions/{region_code}/districts/{district_code}/final-report")
-async def get_final_report_data(reg_number: int, year: int, region_code: int, district_code: int):
+def get_final_report_data(reg_number: int, year: int, region_code: int, district_code: int):
     """Возвращает все данные для заполнения бланка формы № ПУ"""
     conn = get_main_db_connection()
     if conn:
@@ -1320,16 +1471,17 @@ async def get_final_report_data(reg_number: int, year: int, region_code: int, di
             # 3. Данные по услугам для таблицы (зона 5)
             services_query = """
             SELECT 
-                "Наименование_вида_услуг",
-                "Код_показателя",
-                COALESCE(SUM("План_всего"), 0) as plan_total,
-                COALESCE(SUM("Фактически_выполнено_всего"), 0) as fact_total
-            FROM services 
-            WHERE "Регистрационный_номер" = %s 
-                AND "Отчетный_период" = %s 
-                AND "Код_района" = %s
-            GROUP BY "Наименование_вида_услуг", "Код_показателя"
-            ORDER BY "Наименование_вида_услуг"
+                st."Наименование_вида_услуг",
+                s."Код_показателя",
+                COALESCE(SUM(s."План_всего"), 0) as plan_total,
+                COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as fact_total
+            FROM services s
+            JOIN service_types st ON st.id = s."Код_вида_услуг"
+            WHERE s."Регистрационный_номер" = %s 
+                AND s."Отчетный_период" = %s 
+                AND s."Код_района" = %s
+            GROUP BY st."Наименование_вида_услуг", s."Код_показателя"
+            ORDER BY st."Наименование_вида_услуг"
             """
 
             cur.execute(services_query, (reg_number, year, district_code))
@@ -1339,13 +1491,14 @@ async def get_final_report_data(reg_number: int, year: int, region_code: int, di
             previous_year = year - 1
             previous_year_query = """
             SELECT 
-                "Наименование_вида_услуг",
-                COALESCE(SUM("Фактически_выполнено_всего"), 0) as previous_fact
-            FROM services 
-            WHERE "Регистрационный_номер" = %s 
-                AND "Отчетный_период" = %s 
-                AND "Код_района" = %s
-            GROUP BY "Наименование_вида_услуг"
+                st."Наименование_вида_услуг",
+                COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as previous_fact
+            FROM services s
+            JOIN service_types st ON st.id = s."Код_вида_услуг"
+            WHERE s."Регистрационный_номер" = %s 
+                AND s."Отчетный_период" = %s 
+                AND s."Код_района" = %s
+            GROUP BY st."Наименование_вида_услуг"
             """
 
             cur.execute(previous_year_query, (reg_number, previous_year, district_code))
@@ -1431,7 +1584,7 @@ async def get_final_report_data(reg_number: int, year: int, region_code: int, di
             print(f"🔍 Детальный traceback: {traceback.format_exc()}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
@@ -1462,50 +1615,29 @@ async def enterprise_final_report(request: Request, reg_number: int, year: int,
 
 # API для получения всех локаций (областей и районов)
 @app.get("/api/filters/locations")
-async def get_all_locations():
+def get_all_locations():
     """Возвращает список всех областей и районов для фильтра"""
-    conn = get_main_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor()
+    try:
+        regions = [{"id": f"region_{row.code}", "name": row.name, "type": "region"}
+                   for row in get_reference("regions")]
+        districts = [{"id": f"district_{row.code}", "name": f"{row.name} ({row.region_name})", "type": "district"}
+                     for row in get_reference("districts")]
 
-            # Получаем все области
-            cur.execute("""
-                 SELECT "Код_области", "Наименование_области" 
-                 FROM regions 
-                 ORDER BY "Наименование_области"
-             """)
-            regions = [{"id": f"region_{row[0]}", "name": row[1], "type": "region"} for row in cur.fetchall()]
+        return JSONResponse(content={
+            "success": True,
+            "regions": regions,
+            "districts": districts
+        })
 
-            # Получаем все районы
-            cur.execute("""
-                 SELECT d."Код_района", d."Наименование_района", r."Наименование_области"
-                 FROM districts d
-                 JOIN regions r ON d."Код_области" = r."Код_области"
-                 ORDER BY r."Наименование_области", d."Наименование_района"
-             """)
-            districts = [{"id": f"district_{row[0]}", "name": f"{row[1]} ({row[2]})", "type": "district"} for row in
-                         cur.fetchall()]
-
-            return JSONResponse(content={
-                "success": True,
-                "regions": regions,
-                "districts": districts
-            })
-
-        except Exception as e:
-            print(f"❌ Ошибка в get_all_locations: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
-        finally:
-            conn.close()
-    else:
-        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
+    except Exception as e:
+        print(f"❌ Ошибка в get_all_locations: {e}")
+        return JSONResponse(content={"success": False, "error": str(e)})
 
 
 # API для формирования отчета по фильтру
 # API для формирования отчета по фильтру
 @app.get("/api/reports/filtered-report")
-async def get_filtered_report(
+def get_filtered_report(
         enterprise_id: int,
         start_year: int,
         end_year: int,
@@ -1562,10 +1694,9 @@ async def get_filtered_report(
                     
 
             # 3. Получаем коды показателей для услуг
-            cur.execute('SELECT "Наименование_вида_услуг", "Код_показателя" FROM services')
-            service_codes = {row[0]: row[1] for row in cur.fetchall()}
+            service_codes = get_indicator_codes(cur)
 
-            # 4. Формируем запрос для данных в зависимости от типа локации и периода
+            # 4. Данные по всем видам услуг одним запросом
             services_data = []
 
             # Базовый список услуг
@@ -1582,105 +1713,65 @@ async def get_filtered_report(
                 "Прочие услуги, в т.ч. в сельской местности"
             ]
 
+            # Район — по коду района, область — по всем районам области (суммы из куба services_cube)
+            if location_type == "district":
+                location_filter = 's."Код_района" = %(location)s'
+            else:
+                location_filter = 's."Код_области" = %(location)s'
+
+            # Для одного года дополнительно берём факт предыдущего года (для динамики),
+            # для периода предыдущий год не нужен (previous_year = NULL -> 0)
+            previous_year = start_year - 1 if is_single_year else None
+            cur.execute(f"""
+                SELECT 
+                    st."Наименование_вида_услуг",
+                    COALESCE(SUM(s."План_всего") FILTER (
+                        WHERE s."Отчетный_период" BETWEEN %(start_year)s AND %(end_year)s
+                    ), 0) as plan_total,
+                    COALESCE(SUM(s."Фактически_выполнено_всего") FILTER (
+                        WHERE s."Отчетный_период" BETWEEN %(start_year)s AND %(end_year)s
+                    ), 0) as fact_total,
+                    COALESCE(SUM(s."Фактически_выполнено_всего") FILTER (
+                        WHERE s."Отчетный_период" = %(previous_year)s
+                    ), 0) as previous_year
+                FROM services_cube s
+                JOIN service_types st ON st.id = s."Код_вида_услуг"
+                WHERE s."Регистрационный_номер" = %(enterprise_id)s
+                    AND {location_filter}
+                    AND s."Отчетный_период" BETWEEN %(from_year)s AND %(end_year)s
+                    AND st."Наименование_вида_услуг" IN %(categories)s
+                GROUP BY st."Наименование_вида_услуг"
+            """, {
+                "enterprise_id": enterprise_id,
+                "location": region_district_code,
+                "start_year": start_year,
+                "end_year": end_year,
+                "previous_year": previous_year,
+                "from_year": previous_year if is_single_year else start_year,
+                "categories": tuple(service_categories)
+            })
+            totals_by_service = {row[0]: row[1:] for row in cur.fetchall()}
+
             for service_name in service_categories:
-                # Для каждого вида услуг формируем запрос
-                if location_type == "district":
-                    # Отчет по конкретному району
-                    if is_single_year:
-                        # Один год - включаем данные за предыдущий год
-                        query = """
-                            SELECT 
-                                COALESCE(SUM("План_всего"), 0) as plan_total,
-                                COALESCE(SUM("Фактически_выполнено_всего"), 0) as fact_total,
-                                COALESCE((
-                                    SELECT SUM("Фактически_выполнено_всего")
-                                    FROM services s2
-                                    WHERE s2."Регистрационный_номер" = %s
-                                        AND s2."Код_района" = %s
-                                        AND s2."Отчетный_период" = %s
-                                        AND s2."Наименование_вида_услуг" = %s
-                                ), 0) as previous_year
-                            FROM services 
-                            WHERE "Регистрационный_номер" = %s
-                                AND "Код_района" = %s
-                                AND "Отчетный_период" = %s
-                                AND "Наименование_вида_услуг" = %s
-                        """
-                        cur.execute(query, (enterprise_id, region_district_code, start_year - 1, service_name,
-                                            enterprise_id, region_district_code, start_year, service_name))
-                    else:
-                        # Период - суммируем данные
-                        query = """
-                            SELECT 
-                                COALESCE(SUM("План_всего"), 0) as plan_total,
-                                COALESCE(SUM("Фактически_выполнено_всего"), 0) as fact_total,
-                                0 as previous_year
-                            FROM services 
-                            WHERE "Регистрационный_номер" = %s
-                                AND "Код_района" = %s
-                                AND "Отчетный_период" BETWEEN %s AND %s
-                                AND "Наименование_вида_услуг" = %s
-                        """
-                        cur.execute(query, (enterprise_id, region_district_code, start_year, end_year, service_name))
-                else:
-                    if is_single_year:
-                        query = """
-                                                SELECT 
-                                                    COALESCE(SUM(s."План_всего"), 0) as plan_total,
-                                                    COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as fact_total,
-                                                    COALESCE((
-                                    SELECT SUM("Фактически_выполнено_всего")
-                                    FROM services s2
-                                                JOIN districts d2 ON s2."Код_района" = d2."Код_района"
-                                                WHERE s2."Регистрационный_номер" = %s
-                                                    AND d2."Код_области" = %s
-                                                    AND s2."Отчетный_период" = %s
-                                                    AND s2."Наименование_вида_услуг" = %s
-                                ), 0) as previous_year
-                                                FROM services s
-                                                JOIN districts d ON s."Код_района" = d."Код_района"
-                                                WHERE s."Регистрационный_номер" = %s
-                                                    AND d."Код_области" = %s
-                                                    AND s."Отчетный_период" = %s
-                                                    AND s."Наименование_вида_услуг" = %s
-                                            """
-                        cur.execute(query, (enterprise_id, region_district_code, start_year - 1, service_name,
-                                            enterprise_id, region_district_code, start_year, service_name))
-                    # Отчет по области (агрегация по всем районам)
-                    else:
-                        query = """
-                                                SELECT 
-                                                    COALESCE(SUM(s."План_всего"), 0) as plan_total,
-                                                    COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as fact_total,
-                                                    0 as previous_year
-                                                FROM services s
-                                                JOIN districts d ON s."Код_района" = d."Код_района"
-                                                WHERE s."Регистрационный_номер" = %s
-                                                    AND d."Код_области" = %s
-                                                    AND s."Отчетный_период" BETWEEN %s AND %s
-                                                    AND s."Наименование_вида_услуг" = %s
-                                            """
-                        cur.execute(query, (enterprise_id, region_district_code, start_year, end_year, service_name))
-
-
-                row = cur.fetchone()
-                if row:
-                    services_data.append({
-                        "service_name": service_name,
-                        "indicator_code": service_codes.get(service_name, ""),
-                        "plan_total": float(row[0]) if row[0] else 0.0,
-                        "fact_total": float(row[1]) if row[1] else 0.0,
-                        "previous_year": float(row[2]) if row[2] else 0.0
-                    })
+                row = totals_by_service.get(service_name, (0, 0, 0))
+                services_data.append({
+                    "service_name": service_name,
+                    "indicator_code": service_codes.get(service_name, ""),
+                    "plan_total": float(row[0]) if row[0] else 0.0,
+                    "fact_total": float(row[1]) if row[1] else 0.0,
+                    "previous_year": float(row[2]) if row[2] else 0.0
+                })
 
-            # 5. Получаем ФИО директора (берем из последнего периода)
+            # 5. Получаем ФИО директора (берем из последнего периода отчета, а не из более
+            # поздних лет — иначе отчет закрытых лет менялся бы при открытии следующего года)
             cur.execute("""
                 SELECT "ФИО_директора" 
                 FROM period 
                 WHERE "Регистрационный_номер" = %s 
+                    AND "Отчетный_период" BETWEEN %s AND %s
                 ORDER BY "Отчетный_период" DESC 
                 LIMIT 1
-            """, (enterprise_id,))
+            """, (enterprise_id, start_year, end_year))
             director_result = cur.fetchone()
             director_name = director_result[0] if director_result else "Не указано"
             print(region_district_code, enterprise_data[4])
@@ -1710,7 +1801,7 @@ async def get_filtered_report(
             print(f"🔍 Детальный traceback: {traceback.format_exc()}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
     # Страница фильтрованного отчета
@@ -1734,7 +1825,7 @@ async def filtered_report_page(request: Request):
 
 # API для получения областей со статистикой для сводного отчета
 @app.get("/api/district/regions")
-async def get_district_regions():
+def get_district_regions():
     """Возвращает список областей с агрегированной статистикой"""
     conn = get_main_db_connection()
     if conn:
@@ -1750,11 +1841,11 @@ async def get_district_regions():
                     COALESCE(SUM(s."План_всего"), 0) as total_plan,
                     COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as total_fact,
                     COALESCE(SUM(CASE 
-                        WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                        WHEN s."Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                         THEN s."План_всего" ELSE 0 
                     END), 0) as rural_plan,
                     COALESCE(SUM(CASE 
-                        WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                        WHEN s."Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                         THEN s."Фактически_выполнено_всего" ELSE 0 
                     END), 0) as rural_fact
                 FROM regions r
@@ -1796,7 +1887,7 @@ async def get_district_regions():
             print(f"❌ Ошибка в get_district_regions: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
@@ -1805,7 +1896,7 @@ async def get_district_regions():
 
 # API для получения предприятий по области с детальной статистикой (ОБНОВЛЕННАЯ ВЕРСИЯ)
 @app.get("/api/district/regions/{region_code}/enterprises")
-async def get_region_enterprises(region_code: int):
+def get_region_enterprises(region_code: int):
     """Возвращает список предприятий в области с детальной статистикой"""
     conn = get_main_db_connection()
     if conn:
@@ -1820,8 +1911,7 @@ async def get_region_enterprises(region_code: int):
                     e."Наименование_предприятия"
                 FROM enterprises e
                 JOIN services s ON e."Регистрационный_номер" = s."Регистрационный_номер"
-                JOIN districts d ON s."Код_района" = d."Код_района"
-                WHERE d."Код_области" = %s
+                WHERE s."Код_области" = %s
                 ORDER BY e."Наименование_предприятия"
             """, (region_code,))
 
@@ -1839,16 +1929,15 @@ async def get_region_enterprises(region_code: int):
                         COALESCE(SUM(s."План_всего"), 0) as total_plan,
                         COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as total_fact,
                         COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                            WHEN s."Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                             THEN s."План_всего" ELSE 0 
                         END), 0) as rural_plan,
                         COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                            WHEN s."Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                             THEN s."Фактически_выполнено_всего" ELSE 0 
                         END), 0) as rural_fact
                     FROM services s
-                    JOIN districts d ON s."Код_района" = d."Код_района"
-                    WHERE s."Регистрационный_номер" = %s AND d."Код_области" = %s
+                    WHERE s."Регистрационный_номер" = %s AND s."Код_области" = %s
                 """, (reg_number, region_code))
 
                 stats = cur.fetchone()
@@ -1876,14 +1965,14 @@ async def get_region_enterprises(region_code: int):
             print(f"🔍 Детальный traceback: {traceback.format_exc()}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 
 # API для получения услуг по области с детальной статистикой (ОБНОВЛЕННАЯ ВЕРСИЯ)
 @app.get("/api/district/regions/{region_code}/services")
-async def get_region_services(region_code: int):
+def get_region_services(region_code: int):
     """Возвращает список услуг в области с детальной статистикой"""
     conn = get_main_db_connection()
     if conn:
@@ -1905,8 +1994,7 @@ async def get_region_services(region_code: int):
                         COALESCE(SUM(s."План_всего"), 0) as plan_total,
                         COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as fact_total
                     FROM services s
-                    JOIN districts d ON s."Код_района" = d."Код_района"
-                    WHERE d."Код_области" = %s AND s."Наименование_вида_услуг" = %s
+                    WHERE s."Код_области" = %s AND s."Код_вида_услуг" = (SELECT id FROM service_types WHERE "Наименование_вида_услуг" = %s)
                 """, (region_code, service_name))
 
                 stats = cur.fetchone()
@@ -1930,14 +2018,14 @@ async def get_region_services(region_code: int):
             print(f"🔍 Детальный traceback: {traceback.format_exc()}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 
 # API для получения детальной информации по услугам предприятия в области
 @app.get("/api/district/regions/{region_code}/enterprises/{enterprise_id}/services")
-async def get_enterprise_region_services(region_code: int, enterprise_id: int):
+def get_enterprise_region_services(region_code: int, enterprise_id: int):
     """Возвращает детальную информацию по услугам предприятия в области"""
     conn = get_main_db_connection()
     if conn:
@@ -1972,10 +2060,9 @@ async def get_enterprise_region_services(region_code: int, enterprise_id: int):
                         COALESCE(SUM(s."План_всего"), 0) as plan_total,
                         COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as fact_total
                     FROM services s
-                    JOIN districts d ON s."Код_района" = d."Код_района"
-                    WHERE d."Код_области" = %s 
+                    WHERE s."Код_области" = %s 
                         AND s."Регистрационный_номер" = %s 
-                        AND s."Наименование_вида_услуг" = %s
+                        AND s."Код_вида_услуг" = (SELECT id FROM service_types WHERE "Наименование_вида_услуг" = %s)
                 """, (region_code, enterprise_id, service_name))
 
                 stats = cur.fetchone()
@@ -2004,14 +2091,14 @@ async def get_enterprise_region_services(region_code: int, enterprise_id: int):
             print(f"🔍 Детальный traceback: {traceback.format_exc()}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 #------------------------------------------------------------------------------------------------------
 # API для получения районов по области со статистикой
 @app.get("/api/district/regions/{region_code}/districts")
-async def get_district_region_districts(region_code: int):
+def get_district_region_districts(region_code: int):
     """Возвращает список районов в области с агрегированной статистикой"""
     conn = get_main_db_connection()
     if conn:
@@ -2027,11 +2114,11 @@ async def get_district_region_districts(region_code: int):
                     COALESCE(SUM(s."План_всего"), 0) as total_plan,
                     COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as total_fact,
                     COALESCE(SUM(CASE 
-                        WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                        WHEN s."Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                         THEN s."План_всего" ELSE 0 
                     END), 0) as rural_plan,
                     COALESCE(SUM(CASE 
-                        WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                        WHEN s."Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                         THEN s."Фактически_выполнено_всего" ELSE 0 
                     END), 0) as rural_fact
                 FROM districts d
@@ -2073,14 +2160,14 @@ async def get_district_region_districts(region_code: int):
             print(f"❌ Ошибка в get_district_region_districts: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 
 # API для получения периодов по району со статистикой
 @app.get("/api/district/districts/{district_code}/periods")
-async def get_district_district_periods(district_code: int):
+def get_district_district_periods(district_code: int):
     """Возвращает список периодов для района с агрегированной статистикой"""
     conn = get_main_db_connection()
     if conn:
@@ -2108,11 +2195,11 @@ async def get_district_district_periods(district_code: int):
                         COALESCE(SUM("План_всего"), 0) as total_plan,
                         COALESCE(SUM("Фактически_выполнено_всего"), 0) as total_fact,
                         COALESCE(SUM(CASE 
-                            WHEN "Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                            WHEN "Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                             THEN "План_всего" ELSE 0 
                         END), 0) as rural_plan,
                         COALESCE(SUM(CASE 
-                            WHEN "Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                            WHEN "Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                             THEN "Фактически_выполнено_всего" ELSE 0 
                         END), 0) as rural_fact
                     FROM services
@@ -2136,7 +2223,7 @@ async def get_district_district_periods(district_code: int):
                     SELECT 
                         COALESCE(SUM("Фактически_выполнено_всего"), 0) as prev_total_fact,
                         COALESCE(SUM(CASE 
-                            WHEN "Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                            WHEN "Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                             THEN "Фактически_выполнено_всего" ELSE 0 
                         END), 0) as prev_rural_fact
                     FROM services
@@ -2170,7 +2257,7 @@ async def get_district_district_periods(district_code: int):
             print(f"❌ Ошибка в get_district_district_periods: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
@@ -2238,7 +2325,7 @@ async def district_district_periods(request: Request, district_code: int):
 
 # API для получения предприятий в районе с детальной статистикой
 @app.get("/api/district/districts/{district_code}/enterprises")
-async def get_district_enterprises(district_code: int):
+def get_district_enterprises(district_code: int):
     """Возвращает список предприятий в районе с детальной статистикой"""
     conn = get_main_db_connection()
     if conn:
@@ -2269,11 +2356,11 @@ async def get_district_enterprises(district_code: int):
                         COALESCE(SUM(s."План_всего"), 0) as total_plan,
                         COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as total_fact,
                         COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                            WHEN s."Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                             THEN s."План_всего" ELSE 0 
                         END), 0) as rural_plan,
                         COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                            WHEN s."Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                             THEN s."Фактически_выполнено_всего" ELSE 0 
                         END), 0) as rural_fact
                     FROM services s
@@ -2302,14 +2389,14 @@ async def get_district_enterprises(district_code: int):
             print(f"❌ Ошибка в get_district_enterprises: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 
 # API для получения услуг в районе с детальной статистикой
 @app.get("/api/district/districts/{district_code}/services")
-async def get_district_services(district_code: int):
+def get_district_services(district_code: int):
     """Возвращает список услуг в районе с детальной статистикой"""
     conn = get_main_db_connection()
     if conn:
@@ -2329,7 +2416,7 @@ async def get_district_services(district_code: int):
                         COALESCE(SUM(s."План_всего"), 0) as plan_total,
                         COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as fact_total
                     FROM services s
-                    WHERE s."Код_района" = %s AND s."Наименование_вида_услуг" = %s
+                    WHERE s."Код_района" = %s AND s."Код_вида_услуг" = (SELECT id FROM service_types WHERE "Наименование_вида_услуг" = %s)
                 """, (district_code, service_name))
 
                 stats = cur.fetchone()
@@ -2350,14 +2437,14 @@ async def get_district_services(district_code: int):
             print(f"❌ Ошибка в get_district_services: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 
 # API для получения детальной информации по услугам предприятия в районе
 @app.get("/api/district/districts/{district_code}/enterprises/{enterprise_id}/services")
-async def get_enterprise_district_services(district_code: int, enterprise_id: int):
+def get_enterprise_district_services(district_code: int, enterprise_id: int):
     """Возвращает детальную информацию по услугам предприятия в районе"""
     conn = get_main_db_connection()
     if conn:
@@ -2392,7 +2479,7 @@ async def get_enterprise_district_services(district_code: int, enterprise_id: in
                     FROM services s
                     WHERE s."Код_района" = %s 
                         AND s."Регистрационный_номер" = %s 
-                        AND s."Наименование_вида_услуг" = %s
+                        AND s."Код_вида_услуг" = (SELECT id FROM service_types WHERE "Наименование_вида_услуг" = %s)
                 """, (district_code, enterprise_id, service_name))
 
                 stats = cur.fetchone()
@@ -2419,7 +2506,7 @@ async def get_enterprise_district_services(district_code: int, enterprise_id: in
             print(f"❌ Ошибка в get_enterprise_district_services: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
     
@@ -2428,7 +2515,7 @@ async def get_enterprise_district_services(district_code: int, enterprise_id: in
 
 # API для получения услуг в районе за конкретный период с динамикой
 @app.get("/api/district/districts/{district_code}/periods/{year}/services")
-async def get_district_period_services(district_code: int, year: int):
+def get_district_period_services(district_code: int, year: int):
     """Возвращает детальную информацию по услугам в районе за период с динамикой"""
     conn = get_main_db_connection()
     if conn:
@@ -2450,7 +2537,7 @@ async def get_district_period_services(district_code: int, year: int):
                     FROM services s
                     WHERE s."Код_района" = %s 
                         AND s."Отчетный_период" = %s 
-                        AND s."Наименование_вида_услуг" = %s
+                        AND s."Код_вида_услуг" = (SELECT id FROM service_types WHERE "Наименование_вида_услуг" = %s)
                 """, (district_code, year, service_name))
 
                 current_stats = cur.fetchone()
@@ -2466,7 +2553,7 @@ async def get_district_period_services(district_code: int, year: int):
                     FROM services s
                     WHERE s."Код_района" = %s 
                         AND s."Отчетный_период" = %s 
-                        AND s."Наименование_вида_услуг" = %s
+                        AND s."Код_вида_услуг" = (SELECT id FROM service_types WHERE "Наименование_вида_услуг" = %s)
                 """, (district_code, previous_year, service_name))
 
                 previous_stats = cur.fetchone()
@@ -2494,14 +2581,14 @@ async def get_district_period_services(district_code: int, year: int):
             print(f"❌ Ошибка в get_district_period_services: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 
 # API для получения предприятий в районе за период с динамикой
 @app.get("/api/district/districts/{district_code}/periods/{year}/enterprises")
-async def get_district_period_enterprises(district_code: int, year: int):
+def get_district_period_enterprises(district_code: int, year: int):
     """Возвращает детальную информацию по предприятиям в районе за период с динамикой"""
     conn = get_main_db_connection()
     if conn:
@@ -2530,11 +2617,11 @@ async def get_district_period_enterprises(district_code: int, year: int):
                         COALESCE(SUM(s."План_всего"), 0) as total_plan,
                         COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as total_fact,
                         COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                            WHEN s."Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                             THEN s."План_всего" ELSE 0 
                         END), 0) as rural_plan,
                         COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                            WHEN s."Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                             THEN s."Фактически_выполнено_всего" ELSE 0 
                         END), 0) as rural_fact
                     FROM services s
@@ -2555,7 +2642,7 @@ async def get_district_period_enterprises(district_code: int, year: int):
                     SELECT 
                         COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as prev_total_fact,
                         COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                            WHEN s."Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                             THEN s."Фактически_выполнено_всего" ELSE 0 
                         END), 0) as prev_rural_fact
                     FROM services s
@@ -2589,13 +2676,13 @@ async def get_district_period_enterprises(district_code: int, year: int):
             print(f"❌ Ошибка в get_district_period_enterprises: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
     
 # API для получения детальной информации по услугам предприятия в районе за конкретный период с динамикой
 @app.get("/api/district/districts/{district_code}/periods/{year}/enterprises/{enterprise_id}/services")
-async def get_enterprise_district_period_services(district_code: int, year: int, enterprise_id: int):
+def get_enterprise_district_period_services(district_code: int, year: int, enterprise_id: int):
     """Возвращает детальную информацию по услугам предприятия в районе за период с динамикой"""
     conn = get_main_db_connection()
     if conn:
@@ -2631,7 +2718,7 @@ async def get_enterprise_district_period_services(district_code: int, year: int,
                     WHERE s."Код_района" = %s 
                         AND s."Отчетный_период" = %s 
                         AND s."Регистрационный_номер" = %s
-                        AND s."Наименование_вида_услуг" = %s
+                        AND s."Код_вида_услуг" = (SELECT id FROM service_types WHERE "Наименование_вида_услуг" = %s)
                 """, (district_code, year, enterprise_id, service_name))
 
                 current_stats = cur.fetchone()
@@ -2648,7 +2735,7 @@ async def get_enterprise_district_period_services(district_code: int, year: int,
                     WHERE s."Код_района" = %s 
                         AND s."Отчетный_период" = %s 
                         AND s."Регистрационный_номер" = %s
-                        AND s."Наименование_вида_услуг" = %s
+                        AND s."Код_вида_услуг" = (SELECT id FROM service_types WHERE "Наименование_вида_услуг" = %s)
                 """, (district_code, previous_year, enterprise_id, service_name))
 
                 previous_stats = cur.fetchone()
@@ -2678,7 +2765,7 @@ async def get_enterprise_district_period_services(district_code: int, year: int,
             print(f"❌ Ошибка в get_enterprise_district_period_services: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
@@ -2690,7 +2777,7 @@ async def get_enterprise_district_period_services(district_code: int, year: int,
 
 # API для получения сводного отчета по району за период
 @app.get("/api/district/districts/{district_code}/periods/{year}/summary")
-async def get_district_period_summary(district_code: int, year: int):
+def get_district_period_summary(district_code: int, year: int):
     """Возвращает данные для сводного отчета по району за период"""
     conn = get_main_db_connection()
     if conn:
@@ -2714,87 +2801,73 @@ async def get_district_period_summary(district_code: int, year: int):
             region_name = district_info[2]
             region_code = district_info[3]
 
-            # 2. Получаем предприятия в районе за указанный период с детальной статистикой
+            # 2. Статистика всех предприятий района за текущий и предыдущий год одним проходом по services_cube.
+            # ROLLUP добавляет строку итогов (grouping = 1) по всему району; HAVING оставляет
+            # только предприятия с данными за текущий год, итог прошлого года — по всему району
             cur.execute("""
-                SELECT DISTINCT 
+                SELECT 
+                    GROUPING(e."Регистрационный_номер") as is_total,
                     e."Регистрационный_номер",
-                    e."Наименование_предприятия"
-                FROM enterprises e
-                JOIN services s ON e."Регистрационный_номер" = s."Регистрационный_номер"
-                WHERE s."Код_района" = %s AND s."Отчетный_период" = %s
-                ORDER BY e."Наименование_предприятия"
-            """, (district_code, year))
+                    e."Наименование_предприятия",
+                    COALESCE(SUM(s."План_всего") FILTER (WHERE s."Отчетный_период" = %(year)s), 0) as total_plan,
+                    COALESCE(SUM(s."Фактически_выполнено_всего") FILTER (WHERE s."Отчетный_период" = %(year)s), 0) as total_fact,
+                    COALESCE(SUM(s."План_всего") FILTER (
+                        WHERE s."Отчетный_период" = %(year)s
+                            AND s."Сельская_местность"
+                    ), 0) as rural_plan,
+                    COALESCE(SUM(s."Фактически_выполнено_всего") FILTER (
+                        WHERE s."Отчетный_период" = %(year)s
+                            AND s."Сельская_местность"
+                    ), 0) as rural_fact,
+                    COALESCE(SUM(s."Фактически_выполнено_всего") FILTER (WHERE s."Отчетный_период" = %(prev_year)s), 0) as prev_total_fact,
+                    COALESCE(SUM(s."Фактически_выполнено_всего") FILTER (
+                        WHERE s."Отчетный_период" = %(prev_year)s
+                            AND s."Сельская_местность"
+                    ), 0) as prev_rural_fact
+                FROM services_cube s
+                JOIN enterprises e ON e."Регистрационный_номер" = s."Регистрационный_номер"
+                WHERE s."Код_района" = %(district_code)s 
+                    AND s."Отчетный_период" IN (%(year)s, %(prev_year)s)
+                GROUP BY ROLLUP ((e."Регистрационный_номер", e."Наименование_предприятия"))
+                HAVING GROUPING(e."Регистрационный_номер") = 1
+                    OR COUNT(*) FILTER (WHERE s."Отчетный_период" = %(year)s) > 0
+                ORDER BY is_total, e."Наименование_предприятия"
+            """, {"district_code": district_code, "year": year, "prev_year": year - 1})
 
-            enterprises_list = cur.fetchall()
             enterprises = []
 
-            # Итоговые суммы
-            total_plan_all = 0
-            total_rural_plan_all = 0
-            total_fact_all = 0
-            total_rural_fact_all = 0
-
-            for enterprise in enterprises_list:
-                reg_number = enterprise[0]
-                name = enterprise[1]
-
-                # Статистика за текущий год
-                cur.execute("""
-                    SELECT 
-                        COALESCE(SUM(s."План_всего"), 0) as total_plan,
-                        COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as total_fact,
-                        COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
-                            THEN s."План_всего" ELSE 0 
-                        END), 0) as rural_plan,
-                        COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
-                            THEN s."Фактически_выполнено_всего" ELSE 0 
-                        END), 0) as rural_fact
-                    FROM services s
-                    WHERE s."Регистрационный_номер" = %s 
-                        AND s."Код_района" = %s 
-                        AND s."Отчетный_период" = %s
-                """, (reg_number, district_code, year))
-
-                current_stats = cur.fetchone()
-                total_plan = float(current_stats[0]) if current_stats[0] else 0.0
-                total_fact = float(current_stats[1]) if current_stats[1] else 0.0
-                rural_plan = float(current_stats[2]) if current_stats[2] else 0.0
-                rural_fact = float(current_stats[3]) if current_stats[3] else 0.0
-
-                # Статистика за предыдущий год для динамики
-                previous_year = year - 1
-                cur.execute("""
-                    SELECT 
-                        COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as prev_total_fact,
-                        COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
-                            THEN s."Фактически_выполнено_всего" ELSE 0 
-                        END), 0) as prev_rural_fact
-                    FROM services s
-                    WHERE s."Регистрационный_номер" = %s 
-                        AND s."Код_района" = %s 
-                        AND s."Отчетный_период" = %s
-                """, (reg_number, district_code, previous_year))
+            # Итоговые суммы (строка ROLLUP; если данных нет совсем — нули)
+            total_plan_all = 0.0
+            total_rural_plan_all = 0.0
+            total_fact_all = 0.0
+            total_rural_fact_all = 0.0
+            prev_total_fact_all = 0.0
+            prev_rural_fact_all = 0.0
 
-                prev_stats = cur.fetchone()
-                prev_total_fact = float(prev_stats[0]) if prev_stats[0] else 0.0
-                prev_rural_fact = float(prev_stats[1]) if prev_stats[1] else 0.0
+            for row in cur.fetchall():
+                total_plan = float(row[3]) if row[3] else 0.0
+                total_fact = float(row[4]) if row[4] else 0.0
+                rural_plan = float(row[5]) if row[5] else 0.0
+                rural_fact = float(row[6]) if row[6] else 0.0
+                prev_total_fact = float(row[7]) if row[7] else 0.0
+                prev_rural_fact = float(row[8]) if row[8] else 0.0
+
+                if row[0]:
+                    total_plan_all = total_plan
+                    total_fact_all = total_fact
+                    total_rural_plan_all = rural_plan
+                    total_rural_fact_all = rural_fact
+                    prev_total_fact_all = prev_total_fact
+                    prev_rural_fact_all = prev_rural_fact
+                    continue
 
                 # Расчет динамики
                 dynamics_total = (total_fact / prev_total_fact * 100) if prev_total_fact > 0 else 0.0
                 dynamics_rural = (rural_fact / prev_rural_fact * 100) if prev_rural_fact > 0 else 0.0
 
-                # Суммируем для итогов
-                total_plan_all += total_plan
-                total_rural_plan_all += rural_plan
-                total_fact_all += total_fact
-                total_rural_fact_all += rural_fact
-
                 enterprises.append({
-                    "reg_number": reg_number,
-                    "name": name,
+                    "reg_number": row[1],
+                    "name": row[2],
                     "total_plan": total_plan,
                     "rural_plan": rural_plan,
                     "total_fact": total_fact,
@@ -2804,21 +2877,6 @@ async def get_district_period_summary(district_code: int, year: int):
                 })
 
             # Расчет итоговой динамики
-            prev_year_total_query = """
-                SELECT 
-                    COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as prev_total_fact,
-                    COALESCE(SUM(CASE 
-                        WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
-                        THEN s."Фактически_выполнено_всего" ELSE 0 
-                    END), 0) as prev_rural_fact
-                FROM services s
-                WHERE s."Код_района" = %s AND s."Отчетный_период" = %s
-            """
-            cur.execute(prev_year_total_query, (district_code, year - 1))
-            prev_totals = cur.fetchone()
-            prev_total_fact_all = float(prev_totals[0]) if prev_totals[0] else 0.0
-            prev_rural_fact_all = float(prev_totals[1]) if prev_totals[1] else 0.0
-
             dynamics_total_all = (total_fact_all / prev_total_fact_all * 100) if prev_total_fact_all > 0 else 0.0
             dynamics_rural_all = (total_rural_fact_all / prev_rural_fact_all * 100) if prev_rural_fact_all > 0 else 0.0
 
@@ -2847,7 +2905,7 @@ async def get_district_period_summary(district_code: int, year: int):
             print(f"🔍 Детальный traceback: {traceback.format_exc()}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
     
@@ -2875,7 +2933,7 @@ async def district_period_summary(request: Request, district_code: int, year: in
 
 # API для получения списка предприятий в районе за период (упрощенная версия)
 @app.get("/api/district/districts/{district_code}/periods/{year}/enterprises-list")
-async def get_district_enterprises_list(district_code: int, year: int):
+def get_district_enterprises_list(district_code: int, year: int):
     """Возвращает список предприятий в районе за период для генерации отчетов"""
     conn = get_main_db_connection()
     if conn:
@@ -2920,15 +2978,132 @@ async def get_district_enterprises_list(district_code: int, year: int):
             print(f"❌ Ошибка в get_district_enterprises_list: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
     
 
 
+# Виды услуг в порядке строк бланка формы № ПУ
+FORM_SERVICE_CATEGORIES = (
+    "Услуги транспорта - всего",
+    "Услуги транспорта, в т.ч. в сельской местности",
+    "Услуги связи - всего",
+    "Услуги связи, в т.ч. в сельской местности",
+    "Услуги жилищного хозяйства - всего",
+    "Услуги жилищного хозяйства, в т.ч. в сельской местности",
+    "Услуги культуры - всего",
+    "Услуги культуры, в т.ч. в сельской местности",
+    "Прочие услуги - всего",
+    "Прочие услуги, в т.ч. в сельской местности"
+)
+
+
+def build_district_final_reports(cur, district_code: int, year: int):
+    """
+    Собирает данные бланков формы № ПУ для всех предприятий района за год.
+    Выполняет три запроса независимо от количества предприятий и возвращает
+    (информация о районе, список отчетов) в том же виде, что get_final_report_data,
+    либо (None, []) если район не найден.
+    """
+    # 1. Район и область
+    cur.execute("""
+        SELECT d."Наименование_района", r."Наименование_области"
+        FROM districts d
+        JOIN regions r ON d."Код_области" = r."Код_области"
+        WHERE d."Код_района" = %s
+    """, (district_code,))
+    district_info = cur.fetchone()
+    if not district_info:
+        return None, []
+
+    # 2. Предприятия района за год вместе с ФИО директора
+    cur.execute("""
+        SELECT 
+            e."Регистрационный_номер",
+            e."Наименование_предприятия",
+            e."Код_министерства",
+            e."Код_отрасли",
+            e."Код_области",
+            p."ФИО_директора"
+        FROM enterprises e
+        LEFT JOIN period p ON p."Регистрационный_номер" = e."Регистрационный_номер"
+            AND p."Отчетный_период" = %(year)s
+        WHERE EXISTS (
+            SELECT 1 FROM services s
+            WHERE s."Регистрационный_номер" = e."Регистрационный_номер"
+                AND s."Код_района" = %(district_code)s
+                AND s."Отчетный_период" = %(year)s
+        )
+        ORDER BY e."Наименование_предприятия"
+    """, {"district_code": district_code, "year": year})
+    enterprises_rows = cur.fetchall()
+
+    # 3. План/факт текущего года и факт прошлого года по всем предприятиям района
+    cur.execute("""
+        SELECT 
+            s."Регистрационный_номер",
+            st."Наименование_вида_услуг",
+            s."Код_показателя",
+            COUNT(*) FILTER (WHERE s."Отчетный_период" = %(year)s) as current_rows,
+            COALESCE(SUM(s."План_всего") FILTER (WHERE s."Отчетный_период" = %(year)s), 0) as plan_total,
+            COALESCE(SUM(s."Фактически_выполнено_всего") FILTER (WHERE s."Отчетный_период" = %(year)s), 0) as fact_total,
+            COALESCE(SUM(s."Фактически_выполнено_всего") FILTER (WHERE s."Отчетный_период" = %(prev_year)s), 0) as previous_fact
+        FROM services s
+        JOIN service_types st ON st.id = s."Код_вида_услуг"
+        WHERE s."Код_района" = %(district_code)s
+            AND s."Отчетный_период" IN (%(year)s, %(prev_year)s)
+        GROUP BY s."Регистрационный_номер", st."Наименование_вида_услуг", s."Код_показателя"
+        ORDER BY s."Регистрационный_номер", st."Наименование_вида_услуг", s."Код_показателя"
+    """, {"district_code": district_code, "year": year, "prev_year": year - 1})
+
+    current = {}  # (рег. номер, вид услуги) -> (код показателя, план, факт)
+    previous = {}  # (рег. номер, вид услуги) -> факт прошлого года
+    for reg_number, service_name, indicator_code, current_rows, plan_total, fact_total, previous_fact in cur.fetchall():
+        key = (reg_number, service_name)
+        if current_rows and key not in current:
+            current[key] = (indicator_code, float(plan_total or 0), float(fact_total or 0))
+        previous[key] = previous.get(key, 0.0) + float(previous_fact or 0)
+
+    current_date = datetime.now().strftime("%d.%m.%Y")
+    reports = []
+    for reg_number, name, ministry_code, industry_code, region_code, director_name in enterprises_rows:
+        table_data = []
+        for i, category in enumerate(FORM_SERVICE_CATEGORIES, 1):
+            indicator_code, plan_total, fact_total = current.get((reg_number, category), ("", 0.0, 0.0))
+            table_data.append({
+                "number": i,
+                "service_name": category,
+                "indicator_code": indicator_code or "",
+                "plan_total": plan_total,
+                "fact_total": fact_total,
+                "previous_year": previous.get((reg_number, category), 0.0)
+            })
+
+        reports.append({
+            "reg_number": reg_number,
+            "name": name,
+            "report_data": {
+                "enterprise_name": name,
+                "registration_number": reg_number,
+                "ministry_code": ministry_code,
+                "industry_code": industry_code,
+                "region_code": region_code,
+                "district_code": district_code,
+                "district_name": district_info[0],
+                "report_year": year,
+                "table_data": table_data,
+                "director_name": director_name or "Не указано",
+                "current_date": current_date
+            }
+        })
+
+    return {"district_name": district_info[0], "region_name": district_info[1]}, reports
+
+
 # Новый endpoint для серверного рендеринга всех отчетов
 @app.get("/reports/district/districts/{district_code}/periods/{year}/combined-reports-server")
-async def combined_enterprise_reports_server(request: Request, district_code: int, year: int):
+def combined_enterprise_reports_server(request: Request, district_code: int, year: int):
     """Страница с объединенными отчетами всех предприятий (серверный рендеринг)"""
     user_login = request.query_params.get("user_login")
     user_role = request.query_params.get("user_role")
@@ -2937,33 +3112,20 @@ async def combined_enterprise_reports_server(request: Request, district_code: in
     if not user_login or not user_role:
         return templates.TemplateResponse("auth/check_auth.html", {"request": request})
 
-    # Получаем список предприятий
-    enterprises_response = await get_district_enterprises_list(district_code, year)
-    enterprises_data = enterprises_response.body
-    import json
-    enterprises_json = json.loads(enterprises_data)
-
-    if not enterprises_json["success"]:
-        return templates.TemplateResponse("error.html", {
-            "request": request,
-            "error": enterprises_json["error"]
-        })
+    # Все бланки района строятся пакетно через одно соединение
+    conn = get_main_db_connection()
+    if not conn:
+        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
+    try:
+        district_info, enterprises_with_data = build_district_final_reports(conn.cursor(), district_code, year)
+    except Exception as e:
+        print(f"❌ Ошибка в combined_enterprise_reports_server: {e}")
+        return JSONResponse(content={"success": False, "error": str(e)})
+    finally:
+        release_connection(conn)
 
-    # Получаем данные для всех отчетов
-    enterprises_with_data = []
-    for enterprise in enterprises_json["enterprises"]:
-        report_data_response = await get_final_report_data(
-            enterprise["reg_number"], year, region_code, district_code
-        )
-        
-        if isinstance(report_data_response, JSONResponse):
-            report_data = json.loads(report_data_response.body)
-            if report_data["success"]:
-                enterprises_with_data.append({
-                    "reg_number": enterprise["reg_number"],
-                    "name": enterprise["name"],
-                    "report_data": report_data["report_data"]
-                })
+    if not district_info:
+        return JSONResponse(content={"success": False, "error": "Район не найден"})
 
     return templates.TemplateResponse("reports/district/combined_reports_server.html", {
         "request": request,
@@ -2972,8 +3134,8 @@ async def combined_enterprise_reports_server(request: Request, district_code: in
         "district_code": district_code,
         "year": year,
         "region_code": region_code,
-        "district_name": enterprises_json["district_name"],
-        "region_name": enterprises_json["region_name"],
+        "district_name": district_info["district_name"],
+        "region_name": district_info["region_name"],
         "enterprises": enterprises_with_data
     })
 #-------------------------------------------------------------------------------------------------------
@@ -2982,7 +3144,7 @@ async def combined_enterprise_reports_server(request: Request, district_code: in
 
 # API для формирования сводного отчета по фильтру (район/область + период)
 @app.get("/api/district/filtered-summary")
-async def get_filtered_district_summary(
+def get_filtered_district_summary(
     location_id: str,  # Формат: "region_1" или "district_1"
     location_type: str,  # "region" или "district"
     start_year: int,
@@ -3049,7 +3211,7 @@ async def get_filtered_district_summary(
                 where_conditions.append('s."Код_района" = %s')
                 
             else:  # region
-                where_conditions.append('s."Код_района" IN (SELECT "Код_района" FROM districts WHERE "Код_области" = %s)')
+                where_conditions.append('s."Код_области" = %s')
                 
 
             params.append(region_district_code)
@@ -3083,11 +3245,11 @@ async def get_filtered_district_summary(
                         COALESCE(SUM(s."План_всего"), 0) as total_plan,
                         COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as total_fact,
                         COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                            WHEN s."Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                             THEN s."План_всего" ELSE 0 
                         END), 0) as rural_plan,
                         COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                            WHEN s."Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                             THEN s."Фактически_выполнено_всего" ELSE 0 
                         END), 0) as rural_fact
                     FROM services s
@@ -3100,7 +3262,7 @@ async def get_filtered_district_summary(
                     stats_query += ' AND s."Код_района" = %s'
                     
                 else:  # region
-                    stats_query += ' AND s."Код_района" IN (SELECT "Код_района" FROM districts WHERE "Код_области" = %s)'
+                    stats_query += ' AND s."Код_области" = %s'
                     
                 stats_params.append(region_district_code)
 
@@ -3179,7 +3341,7 @@ async def get_filtered_district_summary(
                     SELECT 
                         COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as prev_total_fact,
                         COALESCE(SUM(CASE 
-                            WHEN s."Наименование_вида_услуг" LIKE '%%в т.ч. в сельской местности%%' 
+                            WHEN s."Код_вида_услуг" = ANY(ARRAY(SELECT id FROM service_types WHERE "Сельская_местность")) 
                             THEN s."Фактически_выполнено_всего" ELSE 0 
                         END), 0) as prev_rural_fact
                     FROM services s
@@ -3190,7 +3352,7 @@ async def get_filtered_district_summary(
                     prev_totals_query += ' WHERE s."Код_района" = %s'
                     
                 else:
-                    prev_totals_query += ' WHERE s."Код_района" IN (SELECT "Код_района" FROM districts WHERE "Код_области" = %s)'
+                    prev_totals_query += ' WHERE s."Код_области" = %s'
                     
                 prev_totals_params.append(region_district_code)
                 prev_totals_query += ' AND s."Отчетный_период" = %s'
@@ -3235,7 +3397,7 @@ async def get_filtered_district_summary(
             print(f"🔍 Детальный traceback: {traceback.format_exc()}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
     
@@ -3262,7 +3424,7 @@ async def filtered_district_summary(request: Request):
 # Добавить в main.py после существующих API для сводного отчета
 
 @app.get("/api/district/filtered-summary/enterprises-list")
-async def get_filtered_enterprises_list(
+def get_filtered_enterprises_list(
     location_id: str,
     location_type: str, 
     start_year: int,
@@ -3322,7 +3484,7 @@ async def get_filtered_enterprises_list(
                 where_conditions.append('s."Код_района" = %s')
                 
             else:  # region
-                where_conditions.append('s."Код_района" IN (SELECT "Код_района" FROM districts WHERE "Код_области" = %s)')
+                where_conditions.append('s."Код_области" = %s')
                 
             params.append(region_district_code)
 
@@ -3359,15 +3521,214 @@ async def get_filtered_enterprises_list(
             print(f"🔍 Детальный traceback: {traceback.format_exc()}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
     
 
 # Добавить в main.py после предыдущего endpoint
 
+def build_filtered_reports(cur, location_id: str, location_type: str, start_year: int, end_year: int):
+    """
+    Собирает отчеты по фильтру для всех предприятий района/области за период и
+    сводный отчет по локации из одного набора агрегатов
+    (предприятие × вид услуги × год). Число запросов не зависит от количества
+    предприятий и лет. Возвращает None, если локация не найдена, иначе словарь
+    с информацией о локации, "enterprises" (report_data как в get_filtered_report)
+    и "summary_data" (как в get_filtered_district_summary).
+    """
+    location_id_clean = int(location_id.split('_')[1])
+    is_single_year = (start_year == end_year)
+    previous_year = start_year - 1
+
+    # 1. Локация
+    if location_type == "region":
+        cur.execute('SELECT "Наименование_области" FROM regions WHERE "Код_области" = %s', (location_id_clean,))
+        region_data = cur.fetchone()
+        if not region_data:
+            return None
+        region_code = location_id_clean
+        region_name = region_data[0]
+        location_name = summary_location_name = region_name
+        location_filter = 's."Код_области" = %(location)s'
+    else:  # district
+        cur.execute("""
+            SELECT d."Наименование_района", r."Наименование_области", d."Код_области"
+            FROM districts d
+            JOIN regions r ON d."Код_области" = r."Код_области"
+            WHERE d."Код_района" = %s
+        """, (location_id_clean,))
+        district_data = cur.fetchone()
+        if not district_data:
+            return None
+        region_code = district_data[2]
+        region_name = district_data[1]
+        location_name = f"{district_data[0]} ({district_data[1]})"
+        summary_location_name = district_data[0]
+        location_filter = 's."Код_района" = %(location)s'
+
+    params = {
+        "location": location_id_clean,
+        "start_year": start_year,
+        "end_year": end_year,
+        # Для одного года нужен ещё предыдущий год (динамика и колонка "за прошлый год")
+        "from_year": previous_year if is_single_year else start_year
+    }
+
+    # 2. Предприятия локации за период с ФИО директора из последнего периода
+    cur.execute(f"""
+        SELECT 
+            e."Регистрационный_номер",
+            e."Наименование_предприятия",
+            e."Код_министерства",
+            e."Код_отрасли",
+            e."Код_области",
+            (
+                SELECT p."ФИО_директора"
+                FROM period p
+                WHERE p."Регистрационный_номер" = e."Регистрационный_номер"
+                ORDER BY p."Отчетный_период" DESC
+                LIMIT 1
+            ) as director_name
+        FROM enterprises e
+        WHERE EXISTS (
+            SELECT 1
+            FROM services_cube s
+            WHERE s."Регистрационный_номер" = e."Регистрационный_номер"
+                AND {location_filter}
+                AND s."Отчетный_период" BETWEEN %(start_year)s AND %(end_year)s
+        )
+        ORDER BY e."Наименование_предприятия"
+    """, params)
+    enterprises_rows = cur.fetchall()
+
+    # 3. Общий набор агрегатов из куба services_cube: предприятие × вид услуги × год
+    cur.execute(f"""
+        SELECT 
+            s."Регистрационный_номер",
+            st."Наименование_вида_услуг",
+            s."Отчетный_период",
+            st."Сельская_местность",
+            COALESCE(SUM(s."План_всего"), 0) as plan_total,
+            COALESCE(SUM(s."Фактически_выполнено_всего"), 0) as fact_total
+        FROM services_cube s
+        JOIN service_types st ON st.id = s."Код_вида_услуг"
+        WHERE {location_filter}
+            AND s."Отчетный_период" BETWEEN %(from_year)s AND %(end_year)s
+        GROUP BY s."Регистрационный_номер", st."Наименование_вида_услуг", s."Отчетный_период", st."Сельская_местность"
+    """, params)
+
+    # (рег. номер, вид услуги) -> [план, факт за период, факт предыдущего года]
+    by_service = {}
+    rural_services = set()
+    for reg_number, service_name, service_year, is_rural, plan_total, fact_total in cur.fetchall():
+        if is_rural:
+            rural_services.add(service_name)
+        values = by_service.setdefault((reg_number, service_name), [0.0, 0.0, 0.0])
+        if service_year == previous_year and is_single_year:
+            values[2] += float(fact_total)
+        else:
+            values[0] += float(plan_total)
+            values[1] += float(fact_total)
+
+    # 4. Коды показателей
+    service_codes = get_indicator_codes(cur)
+
+    # Сводные суммы по предприятиям (все виды услуг, сельские — по признаку вида услуг)
+    stats = {}  # рег. номер -> [план, факт, сельский план, сельский факт, факт пред. года, сельский факт пред. года]
+    for (reg_number, service_name), (plan_total, fact_total, previous_fact) in by_service.items():
+        row = stats.setdefault(reg_number, [0.0] * 6)
+        is_rural = service_name in rural_services
+        row[0] += plan_total
+        row[1] += fact_total
+        row[4] += previous_fact
+        if is_rural:
+            row[2] += plan_total
+            row[3] += fact_total
+            row[5] += previous_fact
+
+    current_date = datetime.now().strftime("%d.%m.%Y")
+    enterprises = []
+    summary_enterprises = []
+    for reg_number, name, ministry_code, industry_code, enterprise_region, director_name in enterprises_rows:
+        services_data = []
+        for service_name in FORM_SERVICE_CATEGORIES:
+            plan_total, fact_total, previous_fact = by_service.get((reg_number, service_name), (0.0, 0.0, 0.0))
+            services_data.append({
+                "service_name": service_name,
+                "indicator_code": service_codes.get(service_name, ""),
+                "plan_total": plan_total,
+                "fact_total": fact_total,
+                "previous_year": previous_fact
+            })
+
+        enterprises.append({
+            "reg_number": reg_number,
+            "name": name,
+            "report_data": {
+                "enterprise_name": name,
+                "registration_number": reg_number,
+                "ministry_code": ministry_code,
+                "industry_code": industry_code,
+                "region_code": enterprise_region,
+                "district_code": location_id_clean,
+                "location_name": location_name,
+                "location_type": location_type,
+                "start_year": start_year,
+                "end_year": end_year,
+                "is_single_year": is_single_year,
+                "director_name": director_name or "Не указано",
+                "services": services_data,
+                "current_date": current_date
+            }
+        })
+
+        total_plan, total_fact, rural_plan, rural_fact, prev_total_fact, prev_rural_fact = stats.get(reg_number, [0.0] * 6)
+        summary_enterprises.append({
+            "reg_number": reg_number,
+            "name": name,
+            "total_plan": total_plan,
+            "rural_plan": rural_plan,
+            "total_fact": total_fact,
+            "rural_fact": rural_fact,
+            "dynamics_total": (total_fact / prev_total_fact * 100) if prev_total_fact > 0 else 0.0,
+            "dynamics_rural": (rural_fact / prev_rural_fact * 100) if prev_rural_fact > 0 else 0.0
+        })
+
+    # Итоги: текущие — по предприятиям отчета, прошлый год — по всей локации
+    totals = [sum(row[k] for row in stats.values()) for k in range(6)]
+    summary_data = {
+        "location_name": summary_location_name,
+        "location_type": location_type,
+        "region_code": region_code,
+        "region_name": region_name,
+        "district_code": location_id_clean,
+        "start_year": start_year,
+        "end_year": end_year,
+        "is_single_year": is_single_year,
+        "enterprises": summary_enterprises,
+        "totals": {
+            "total_plan": totals[0],
+            "rural_plan": totals[2],
+            "total_fact": totals[1],
+            "rural_fact": totals[3],
+            "dynamics_total": (totals[1] / totals[4] * 100) if totals[4] > 0 else 0.0,
+            "dynamics_rural": (totals[3] / totals[5] * 100) if totals[5] > 0 else 0.0
+        }
+    }
+
+    return {
+        "location_name": location_name,
+        "region_code": region_code,
+        "region_name": region_name,
+        "district_code": location_id_clean,
+        "enterprises": enterprises,
+        "summary_data": summary_data
+    }
+
+
 @app.get("/reports/district/filtered-summary/combined-reports-server")
-async def combined_filtered_reports_server(request: Request):
+def combined_filtered_reports_server(request: Request):
     """Страница с объединенными отчетами всех предприятий по фильтру"""
     user_login = request.query_params.get("user_login")
     user_role = request.query_params.get("user_role")
@@ -3379,47 +3740,20 @@ async def combined_filtered_reports_server(request: Request):
     if not user_login or not user_role:
         return templates.TemplateResponse("auth/check_auth.html", {"request": request})
 
-    # Получаем список предприятий
-    enterprises_response = await get_filtered_enterprises_list(
-        location_id, location_type, int(start_year), int(end_year)
-    )
-    
-    import json
-    enterprises_data = enterprises_response.body
-    enterprises_json = json.loads(enterprises_data)
-
-    if not enterprises_json["success"]:
-        return templates.TemplateResponse("error.html", {
-            "request": request,
-            "error": enterprises_json["error"]
-        })
-
-    # Получаем данные для всех отчетов предприятий
-    enterprises_with_data = []
-    for enterprise in enterprises_json["enterprises"]:
-        # Используем существующий API для получения отчета по фильтру
-        report_data_response = await get_filtered_report(
-            enterprise["reg_number"], 
-            int(start_year), 
-            int(end_year),
-            location_id,
-            location_type
-        )
-        
-        if isinstance(report_data_response, JSONResponse):
-            report_data = json.loads(report_data_response.body)
-            if report_data["success"]:
-                enterprises_with_data.append({
-                    "reg_number": enterprise["reg_number"],
-                    "name": enterprise["name"],
-                    "report_data": report_data["report_data"]
-                })
-    summary_response = await get_filtered_district_summary(
-        location_id, location_type, int(start_year), int(end_year)
-    )
-    summary_data = json.loads(summary_response.body) if isinstance(summary_response, JSONResponse) else {}   
+    # Формы предприятий и сводка строятся из одного набора агрегатов через одно соединение
+    conn = get_main_db_connection()
+    if not conn:
+        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
+    try:
+        reports = build_filtered_reports(conn.cursor(), location_id, location_type, int(start_year), int(end_year))
+    except Exception as e:
+        print(f"❌ Ошибка в combined_filtered_reports_server: {e}")
+        return JSONResponse(content={"success": False, "error": str(e)})
+    finally:
+        release_connection(conn)
 
-         
+    if not reports:
+        return JSONResponse(content={"success": False, "error": "Локация не найдена"})
 
     return templates.TemplateResponse("reports/district/combined_filtered_reports_server.html", {
         "request": request,
@@ -3429,18 +3763,19 @@ async def combined_filtered_reports_server(request: Request):
         "location_type": location_type,
         "start_year": start_year,
         "end_year": end_year,
-        "location_name": enterprises_json["location_name"],
-        "region_code": enterprises_json.get("region_code"),
-        "region_name": summary_data.get("summary_data", {}).get("region_name", ""),
-        "district_code": enterprises_json.get("district_code"),
-        "enterprises": enterprises_with_data
+        "location_name": reports["location_name"],
+        "region_code": reports["region_code"],
+        "region_name": reports["region_name"],
+        "district_code": reports["district_code"],
+        "enterprises": reports["enterprises"],
+        "summary_data": reports["summary_data"]
     })
 
 #-------------------------------------------------------------------------------------------------------
 
 # API для справочников
 @app.get("/api/catalogs/enterprises")
-async def get_catalog_enterprises():
+def get_catalog_enterprises():
     """Возвращает список всех предприятий для справочника"""
     conn = get_main_db_connection()
     if conn:
@@ -3477,211 +3812,111 @@ async def get_catalog_enterprises():
             print(f"❌ Ошибка в get_catalog_enterprises: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 @app.get("/api/catalogs/ministries")
-async def get_catalog_ministries():
+def get_catalog_ministries():
     """Возвращает список всех министерств для справочника"""
-    conn = get_main_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor()
-            
-            cur.execute('SELECT "Код_министерства", "Наименование_министерства" FROM ministries ORDER BY "Наименование_министерства"')
-            
-            ministries = []
-            for row in cur.fetchall():
-                ministries.append({
-                    "code": row[0],
-                    "name": row[1]
-                })
-            
-            return JSONResponse(content={"success": True, "ministries": ministries})
-            
-        except Exception as e:
-            print(f"❌ Ошибка в get_catalog_ministries: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
-        finally:
-            conn.close()
-    else:
-        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
+    try:
+        ministries = [{"code": row.code, "name": row.name} for row in get_reference("ministries")]
+        return JSONResponse(content={"success": True, "ministries": ministries})
+    except Exception as e:
+        print(f"❌ Ошибка в get_catalog_ministries: {e}")
+        return JSONResponse(content={"success": False, "error": str(e)})
 
 @app.get("/api/catalogs/industries")
-async def get_catalog_industries():
+def get_catalog_industries():
     """Возвращает список всех отраслей для справочника"""
-    conn = get_main_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor()
-            
-            cur.execute('SELECT "Код_отрасли", "Наименование_отрасли" FROM industries ORDER BY "Наименование_отрасли"')
-            
-            industries = []
-            for row in cur.fetchall():
-                industries.append({
-                    "code": row[0],
-                    "name": row[1]
-                })
-            
-            return JSONResponse(content={"success": True, "industries": industries})
-            
-        except Exception as e:
-            print(f"❌ Ошибка в get_catalog_industries: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
-        finally:
-            conn.close()
-    else:
-        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
+    try:
+        industries = [{"code": row.code, "name": row.name} for row in get_reference("industries")]
+        return JSONResponse(content={"success": True, "industries": industries})
+    except Exception as e:
+        print(f"❌ Ошибка в get_catalog_industries: {e}")
+        return JSONResponse(content={"success": False, "error": str(e)})
 
 @app.get("/api/catalogs/regions")
-async def get_catalog_regions():
+def get_catalog_regions():
     """Возвращает список всех областей для справочника"""
+    try:
+        regions = [{"code": row.code, "name": row.name} for row in get_reference("regions")]
+        return JSONResponse(content={"success": True, "regions": regions})
+    except Exception as e:
+        print(f"❌ Ошибка в get_catalog_regions: {e}")
+        return JSONResponse(content={"success": False, "error": str(e)})
+
+@app.get("/api/catalogs/districts")
+def get_catalog_districts():
+    """Возвращает список всех районов для справочника"""
+    try:
+        districts = [
+            {"code": row.code, "name": row.name, "region_name": row.region_name, "region_code": row.region_code}
+            for row in get_reference("districts")
+        ]
+        return JSONResponse(content={"success": True, "districts": districts})
+    except Exception as e:
+        print(f"❌ Ошибка в get_catalog_districts: {e}")
+        return JSONResponse(content={"success": False, "error": str(e)})
+
+# Добавить после существующих endpoints для справочников
+@app.get("/api/catalogs/services")
+def get_catalog_services():
+    """Возвращает список всех видов услуг для справочника (алиас для service-types)"""
+    try:
+        services = [{"name": row.name} for row in get_reference("service_types")]
+        return JSONResponse(content={"success": True, "services": services})
+    except Exception as e:
+        print(f"❌ Ошибка в get_catalog_services: {e}")
+        return JSONResponse(content={"success": False, "error": str(e)})
+    
+
+# Добавить в main.py (опционально, для улучшения UX)
+@app.get("/api/catalogs/stats")
+def get_catalogs_stats():
+    """Возвращает статистику по справочникам"""
+    # Количество записей в справочниках — из кэша справочников, до взятия соединения:
+    # загрузка справочника берет свое соединение из пула
+    try:
+        stats = {
+            'ministries_count': len(get_reference("ministries")),
+            'industries_count': len(get_reference("industries")),
+            'regions_count': len(get_reference("regions")),
+            'districts_count': len(get_reference("districts")),
+            'services_count': len(get_reference("service_types"))
+        }
+    except Exception as e:
+        print(f"❌ Ошибка в get_catalogs_stats: {e}")
+        return JSONResponse(content={"success": False, "error": str(e)})
+
     conn = get_main_db_connection()
     if conn:
         try:
             cur = conn.cursor()
             
-            cur.execute('SELECT "Код_области", "Наименование_области" FROM regions ORDER BY "Наименование_области"')
-            
-            regions = []
-            for row in cur.fetchall():
-                regions.append({
-                    "code": row[0],
-                    "name": row[1]
-                })
+            # Количество предприятий
+            cur.execute('SELECT COUNT(*) FROM enterprises')
+            stats['enterprises_count'] = cur.fetchone()[0]
             
-            return JSONResponse(content={"success": True, "regions": regions})
+            return JSONResponse(content={"success": True, "stats": stats})
             
         except Exception as e:
-            print(f"❌ Ошибка в get_catalog_regions: {e}")
+            print(f"❌ Ошибка в get_catalogs_stats: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
-
-@app.get("/api/catalogs/districts")
-async def get_catalog_districts():
-    """Возвращает список всех районов для справочника"""
-    conn = get_main_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor()
-            
-            cur.execute("""
-                SELECT 
-                    d."Код_района",
-                    d."Наименование_района",
-                    r."Наименование_области",
-                    r."Код_области"
-                FROM districts d
-                JOIN regions r ON d."Код_области" = r."Код_области"
-                ORDER BY r."Наименование_области", d."Наименование_района"
-            """)
-            
-            districts = []
-            for row in cur.fetchall():
-                districts.append({
-                    "code": row[0],
-                    "name": row[1],
-                    "region_name": row[2],
-                    "region_code": row[3]
-                })
-            
-            return JSONResponse(content={"success": True, "districts": districts})
-            
-        except Exception as e:
-            print(f"❌ Ошибка в get_catalog_districts: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
-        finally:
-            conn.close()
-    else:
-        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
-
-# Добавить после существующих endpoints для справочников
-@app.get("/api/catalogs/services")
-async def get_catalog_services():
-    """Возвращает список всех видов услуг для справочника (алиас для service-types)"""
-    conn = get_main_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor()
-            
-            cur.execute('SELECT "Наименование_вида_услуг" FROM service_types ORDER BY "Наименование_вида_услуг"')
-            
-            services = []
-            for row in cur.fetchall():
-                services.append({
-                    "name": row[0]
-                })
-            
-            return JSONResponse(content={"success": True, "services": services})
-            
-        except Exception as e:
-            print(f"❌ Ошибка в get_catalog_services: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
-        finally:
-            conn.close()
-    else:
-        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
-    
-
-# Добавить в main.py (опционально, для улучшения UX)
-@app.get("/api/catalogs/stats")
-async def get_catalogs_stats():
-    """Возвращает статистику по справочникам"""
-    conn = get_main_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor()
-            
-            stats = {}
-            
-            # Количество предприятий
-            cur.execute('SELECT COUNT(*) FROM enterprises')
-            stats['enterprises_count'] = cur.fetchone()[0]
-            
-            # Количество министерств
-            cur.execute('SELECT COUNT(*) FROM ministries')
-            stats['ministries_count'] = cur.fetchone()[0]
-            
-            # Количество отраслей
-            cur.execute('SELECT COUNT(*) FROM industries')
-            stats['industries_count'] = cur.fetchone()[0]
-            
-            # Количество областей
-            cur.execute('SELECT COUNT(*) FROM regions')
-            stats['regions_count'] = cur.fetchone()[0]
-            
-            # Количество районов
-            cur.execute('SELECT COUNT(*) FROM districts')
-            stats['districts_count'] = cur.fetchone()[0]
-            
-            # Количество видов услуг
-            cur.execute('SELECT COUNT(*) FROM service_types')
-            stats['services_count'] = cur.fetchone()[0]
-            
-            return JSONResponse(content={"success": True, "stats": stats})
-            
-        except Exception as e:
-            print(f"❌ Ошибка в get_catalogs_stats: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
-        finally:
-            conn.close()
-    else:
-        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
-    
- #-------------------------------------------------------------------------------------------------------
- # админ дальше
- # -------------------------------------------------------------------------------------------------------
+    
+ #-------------------------------------------------------------------------------------------------------
+ # админ дальше
+ # -------------------------------------------------------------------------------------------------------
 
  # Добавить в main.py после существующих endpoints
 
 # API для проверки статуса БД
 @app.get("/api/admin/db-status")
-async def get_admin_db_status():
+def get_admin_db_status():
     """Проверяет статус подключения к базам данных"""
     main_conn = None
     users_conn = None
@@ -3693,7 +3928,12 @@ async def get_admin_db_status():
         return JSONResponse(content={
             "success": True,
             "main_db": main_conn is not None,
-            "users_db": users_conn is not None
+            "users_db": users_conn is not None,
+            "pools": get_pool_stats(),
+            "reference_cache": get_reference_cache_stats(),
+            "cache_events": get_cache_listener_stats(),
+            "cube_refresh": get_cube_refresher_stats(),
+            "single_flight": get_single_flight_stats()
         })
     except Exception as e:
         print(f"❌ Ошибка проверки статуса БД: {e}")
@@ -3704,18 +3944,20 @@ async def get_admin_db_status():
         })
     finally:
         if main_conn:
-            main_conn.close()
+            release_connection(main_conn)
         if users_conn:
-            users_conn.close()
+            release_connection(users_conn)
 
 # API для статистики дашборда
 @app.get("/api/admin/dashboard-stats")
-async def get_admin_dashboard_stats():
+def get_admin_dashboard_stats():
     """Возвращает статистику для дашборда администратора"""
     conn = get_main_db_connection()
     users_conn = get_users_db_connection()
     
     if not conn or not users_conn:
+        release_connection(conn)
+        release_connection(users_conn)
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
     
     try:
@@ -3726,8 +3968,8 @@ async def get_admin_dashboard_stats():
         cur.execute('SELECT COUNT(*) FROM enterprises')
         enterprises_count = cur.fetchone()[0]
         
-        # Количество услуг
-        cur.execute('SELECT COUNT(*) FROM services')
+        # Количество услуг (из сводных итогов services_summary)
+        cur.execute("""SELECT COALESCE(SUM("Количество_записей"), 0) FROM services_summary WHERE "Срез" = 'global' AND "Ключ" = ''""")
         services_count = cur.fetchone()[0]
         
         # Количество отчетных периодов
@@ -3762,8 +4004,8 @@ async def get_admin_dashboard_stats():
         print(f"❌ Ошибка в get_admin_dashboard_stats: {e}")
         return JSONResponse(content={"success": False, "error": str(e)})
     finally:
-        conn.close()
-        users_conn.close()
+        release_connection(conn)
+        release_connection(users_conn)
 
 # Маршруты админ-панели
 @app.get("/admin/dashboard")
@@ -3844,7 +4086,7 @@ async def admin_users(request: Request):
 
 # API для управления предприятиями в админ-панели
 @app.get("/api/admin/enterprises")
-async def get_admin_enterprises():
+def get_admin_enterprises():
     """Возвращает список всех предприятий для админ-панели"""
     conn = get_main_db_connection()
     if conn:
@@ -3878,34 +4120,30 @@ async def get_admin_enterprises():
             print(f"❌ Ошибка в get_admin_enterprises: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 @app.post("/api/admin/enterprises")
-async def create_enterprise(request: Request):
+def create_enterprise(data: dict = Body(...)):
     """Создает новое предприятие"""
     conn = get_main_db_connection()
     if conn:
         try:
-            data = await request.json()
-            
             # Валидация обязательных полей
             if not data.get('name') or not data.get('reg_number'):
                 return JSONResponse(content={"success": False, "error": "Обязательные поля: name и reg_number"})
             
             cur = conn.cursor()
             
-            # Проверяем уникальность регистрационного номера
-            cur.execute('SELECT COUNT(*) FROM enterprises WHERE "Регистрационный_номер" = %s', (data['reg_number'],))
-            if cur.fetchone()[0] > 0:
-                return JSONResponse(content={"success": False, "error": "Предприятие с таким регистрационным номером уже существует"})
-            
-            # Вставляем новое предприятие
+            # Вставляем новое предприятие; повтор регистрационного номера и несуществующие
+            # министерство/отрасль/область отклоняет сама БД (ограничения enterprises)
             cur.execute("""
                 INSERT INTO enterprises 
                 ("Наименование_предприятия", "Регистрационный_номер", "Код_министерства", "Код_отрасли", "Код_области")
                 VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT ("Регистрационный_номер") DO NOTHING
+                RETURNING id
             """, (
                 data['name'],
                 data['reg_number'],
@@ -3913,6 +4151,10 @@ async def create_enterprise(request: Request):
                 data.get('industry_code'), 
                 data.get('region_code')
             ))
+            if cur.fetchone() is None:
+                conn.rollback()
+                return JSONResponse(content={"success": False, "error": "Предприятие с таким регистрационным номером уже существует",
+                                             "code": "duplicate"})
             
             conn.commit()
             return JSONResponse(content={"success": True, "message": "Предприятие успешно создано"})
@@ -3920,32 +4162,25 @@ async def create_enterprise(request: Request):
         except Exception as e:
             conn.rollback()
             print(f"❌ Ошибка в create_enterprise: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
+            return write_error_response(e)
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 @app.put("/api/admin/enterprises/{reg_number}")
-async def update_enterprise(reg_number: int, request: Request):
+def update_enterprise(reg_number: int, data: dict = Body(...)):
     """Обновляет данные предприятия"""
     conn = get_main_db_connection()
     if conn:
         try:
-            data = await request.json()
-            
             # Валидация
             if not data.get('name'):
                 return JSONResponse(content={"success": False, "error": "Поле name обязательно"})
             
             cur = conn.cursor()
             
-            # Проверяем существование предприятия
-            cur.execute('SELECT COUNT(*) FROM enterprises WHERE "Регистрационный_номер" = %s', (reg_number,))
-            if cur.fetchone()[0] == 0:
-                return JSONResponse(content={"success": False, "error": "Предприятие не найдено"})
-            
-            # Обновляем данные
+            # Обновляем данные; несуществующее предприятие — ни одной обновленной строки
             cur.execute("""
                 UPDATE enterprises 
                 SET "Наименование_предприятия" = %s,
@@ -3960,6 +4195,9 @@ async def update_enterprise(reg_number: int, request: Request):
                 data.get('region_code'),
                 reg_number
             ))
+            if cur.rowcount == 0:
+                conn.rollback()
+                return JSONResponse(content={"success": False, "error": "Предприятие не найдено", "code": "not_found"})
             
             conn.commit()
             return JSONResponse(content={"success": True, "message": "Предприятие успешно обновлено"})
@@ -3967,124 +4205,70 @@ async def update_enterprise(reg_number: int, request: Request):
         except Exception as e:
             conn.rollback()
             print(f"❌ Ошибка в update_enterprise: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
+            return write_error_response(e)
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 @app.delete("/api/admin/enterprises/{reg_number}")
-async def delete_enterprise(reg_number: int):
+def delete_enterprise(reg_number: int):
     """Удаляет предприятие"""
     conn = get_main_db_connection()
     if conn:
         try:
             cur = conn.cursor()
             
-            # Проверяем существование предприятия
-            cur.execute('SELECT COUNT(*) FROM enterprises WHERE "Регистрационный_номер" = %s', (reg_number,))
-            if cur.fetchone()[0] == 0:
-                return JSONResponse(content={"success": False, "error": "Предприятие не найдено"})
-            
-            # Удаляем предприятие
+            # Удаляем предприятие (периоды и услуги удаляются каскадно)
             cur.execute('DELETE FROM enterprises WHERE "Регистрационный_номер" = %s', (reg_number,))
+            if cur.rowcount == 0:
+                conn.rollback()
+                return JSONResponse(content={"success": False, "error": "Предприятие не найдено", "code": "not_found"})
             
             conn.commit()
+            invalidate_indicator_codes()
+            request_cube_refresh()
             return JSONResponse(content={"success": True, "message": "Предприятие успешно удалено"})
             
         except Exception as e:
             conn.rollback()
             print(f"❌ Ошибка в delete_enterprise: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
+            return write_error_response(e)
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 # API для справочников
 @app.get("/api/admin/reference/ministries")
-async def get_ministries_reference():
+def get_ministries_reference():
     """Возвращает справочник министерств"""
-    conn = get_main_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor()
-            
-            cur.execute('SELECT id, "Код_министерства" as code, "Наименование_министерства" as name FROM ministries ORDER BY "Наименование_министерства"')
-            
-            ministries = []
-            for row in cur.fetchall():
-                ministries.append({
-                    "id": row[0],
-                    "code": row[1],
-                    "name": row[2]
-                })
-            
-            return JSONResponse(content={"success": True, "data": ministries})
-            
-        except Exception as e:
-            print(f"❌ Ошибка в get_ministries_reference: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
-        finally:
-            conn.close()
-    else:
-        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
+    try:
+        ministries = [{"id": row.id, "code": row.code, "name": row.name} for row in get_reference("ministries")]
+        return JSONResponse(content={"success": True, "data": ministries})
+    except Exception as e:
+        print(f"❌ Ошибка в get_ministries_reference: {e}")
+        return JSONResponse(content={"success": False, "error": str(e)})
 
 @app.get("/api/admin/reference/industries")
-async def get_industries_reference():
+def get_industries_reference():
     """Возвращает справочник отраслей"""
-    conn = get_main_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor()
-            
-            cur.execute('SELECT id, "Код_отрасли" as code, "Наименование_отрасли" as name FROM industries ORDER BY "Наименование_отрасли"')
-            
-            industries = []
-            for row in cur.fetchall():
-                industries.append({
-                    "id": row[0],
-                    "code": row[1],
-                    "name": row[2]
-                })
-            
-            return JSONResponse(content={"success": True, "data": industries})
-            
-        except Exception as e:
-            print(f"❌ Ошибка в get_industries_reference: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
-        finally:
-            conn.close()
-    else:
-        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
+    try:
+        industries = [{"id": row.id, "code": row.code, "name": row.name} for row in get_reference("industries")]
+        return JSONResponse(content={"success": True, "data": industries})
+    except Exception as e:
+        print(f"❌ Ошибка в get_industries_reference: {e}")
+        return JSONResponse(content={"success": False, "error": str(e)})
 
 @app.get("/api/admin/reference/regions")
-async def get_regions_reference():
+def get_regions_reference():
     """Возвращает справочник областей"""
-    conn = get_main_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor()
-            
-            cur.execute('SELECT id, "Код_области" as code, "Наименование_области" as name FROM regions ORDER BY "Наименование_области"')
-            
-            regions = []
-            for row in cur.fetchall():
-                regions.append({
-                    "id": row[0],
-                    "code": row[1],
-                    "name": row[2]
-                })
-            
-            return JSONResponse(content={"success": True, "data": regions})
-            
-        except Exception as e:
-            print(f"❌ Ошибка в get_regions_reference: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
-        finally:
-            conn.close()
-    else:
-        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
+    try:
+        regions = [{"id": row.id, "code": row.code, "name": row.name} for row in get_reference("regions")]
+        return JSONResponse(content={"success": True, "data": regions})
+    except Exception as e:
+        print(f"❌ Ошибка в get_regions_reference: {e}")
+        return JSONResponse(content={"success": False, "error": str(e)})
     
 #-------------------------------------------------------------------------------------------------------
 
@@ -4092,7 +4276,7 @@ async def get_regions_reference():
 
 # API для управления отчётными периодами в админ-панели
 @app.get("/api/admin/periods")
-async def get_admin_periods():
+def get_admin_periods():
     """Возвращает список всех отчётных периодов для админ-панели"""
     conn = get_main_db_connection()
     if conn:
@@ -4104,9 +4288,11 @@ async def get_admin_periods():
                     p."Регистрационный_номер" as reg_number,
                     p."Отчетный_период" as year,
                     p."ФИО_директора" as director_name,
-                    e."Наименование_предприятия" as enterprise_name
+                    e."Наименование_предприятия" as enterprise_name,
+                    c."Отчетный_период" IS NOT NULL as closed
                 FROM period p
                 JOIN enterprises e ON p."Регистрационный_номер" = e."Регистрационный_номер"
+                LEFT JOIN closed_years c ON c."Отчетный_период" = p."Отчетный_период"
                 ORDER BY e."Наименование_предприятия", p."Отчетный_период" DESC
             """)
             
@@ -4116,7 +4302,8 @@ async def get_admin_periods():
                     "reg_number": row[0],
                     "year": row[1],
                     "director_name": row[2],
-                    "enterprise_name": row[3]
+                    "enterprise_name": row[3],
+                    "closed": row[4]
                 })
             
             return JSONResponse(content={"success": True, "periods": periods})
@@ -4125,45 +4312,39 @@ async def get_admin_periods():
             print(f"❌ Ошибка в get_admin_periods: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 @app.post("/api/admin/periods")
-async def create_period(request: Request):
+def create_period(data: dict = Body(...)):
     """Создает новый отчётный период"""
     conn = get_main_db_connection()
     if conn:
         try:
-            data = await request.json()
-            
             # Валидация обязательных полей
             if not data.get('reg_number') or not data.get('year'):
                 return JSONResponse(content={"success": False, "error": "Обязательные поля: reg_number и year"})
             
             cur = conn.cursor()
             
-            # Проверяем существование предприятия
-            cur.execute('SELECT COUNT(*) FROM enterprises WHERE "Регистрационный_номер" = %s', (data['reg_number'],))
-            if cur.fetchone()[0] == 0:
-                return JSONResponse(content={"success": False, "error": "Предприятие с указанным регистрационным номером не найдено"})
-            
-            # Проверяем уникальность комбинации (предприятие + год)
-            cur.execute('SELECT COUNT(*) FROM period WHERE "Регистрационный_номер" = %s AND "Отчетный_период" = %s', 
-                       (data['reg_number'], data['year']))
-            if cur.fetchone()[0] > 0:
-                return JSONResponse(content={"success": False, "error": "Отчётный период для этого предприятия уже существует"})
-            
-            # Вставляем новый период
+            # Вставляем новый период; несуществующее предприятие отклоняет внешний ключ
+            # fk_period_enterprise, повтор (предприятие + год) — ограничение unique_reg_period
             cur.execute("""
                 INSERT INTO period 
                 ("Регистрационный_номер", "Отчетный_период", "ФИО_директора")
                 VALUES (%s, %s, %s)
+                ON CONFLICT ("Регистрационный_номер", "Отчетный_период") DO NOTHING
+                RETURNING id
             """, (
                 data['reg_number'],
                 data['year'],
                 data.get('director_name')
             ))
+            if cur.fetchone() is None:
+                conn.rollback()
+                return JSONResponse(content={"success": False, "error": "Отчётный период для этого предприятия уже существует",
+                                             "code": "duplicate"})
             
             conn.commit()
             return JSONResponse(content={"success": True, "message": "Отчётный период успешно создан"})
@@ -4171,28 +4352,20 @@ async def create_period(request: Request):
         except Exception as e:
             conn.rollback()
             print(f"❌ Ошибка в create_period: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
+            return write_error_response(e)
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 @app.put("/api/admin/periods/{reg_number}/{year}")
-async def update_period(reg_number: int, year: int, request: Request):
+def update_period(reg_number: int, year: int, data: dict = Body(...)):
     """Обновляет данные отчётного периода"""
     conn = get_main_db_connection()
     if conn:
         try:
-            data = await request.json()
-            
             cur = conn.cursor()
             
-            # Проверяем существование периода
-            cur.execute('SELECT COUNT(*) FROM period WHERE "Регистрационный_номер" = %s AND "Отчетный_период" = %s', 
-                       (reg_number, year))
-            if cur.fetchone()[0] == 0:
-                return JSONResponse(content={"success": False, "error": "Отчётный период не найден"})
-            
             # Обновляем данные (только ФИО директора, так как предприятие и год менять нельзя)
             cur.execute("""
                 UPDATE period 
@@ -4203,6 +4376,9 @@ async def update_period(reg_number: int, year: int, request: Request):
                 reg_number,
                 year
             ))
+            if cur.rowcount == 0:
+                conn.rollback()
+                return JSONResponse(content={"success": False, "error": "Отчётный период не найден", "code": "not_found"})
             
             conn.commit()
             return JSONResponse(content={"success": True, "message": "Отчётный период успешно обновлен"})
@@ -4210,29 +4386,26 @@ async def update_period(reg_number: int, year: int, request: Request):
         except Exception as e:
             conn.rollback()
             print(f"❌ Ошибка в update_period: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
+            return write_error_response(e)
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 @app.delete("/api/admin/periods/{reg_number}/{year}")
-async def delete_period(reg_number: int, year: int):
+def delete_period(reg_number: int, year: int):
     """Удаляет отчётный период"""
     conn = get_main_db_connection()
     if conn:
         try:
             cur = conn.cursor()
             
-            # Проверяем существование периода
-            cur.execute('SELECT COUNT(*) FROM period WHERE "Регистрационный_номер" = %s AND "Отчетный_период" = %s', 
-                       (reg_number, year))
-            if cur.fetchone()[0] == 0:
-                return JSONResponse(content={"success": False, "error": "Отчётный период не найден"})
-            
-            # Удаляем период
+            # Удаляем период; период с услугами не удаляется (внешний ключ fk_service_period)
             cur.execute('DELETE FROM period WHERE "Регистрационный_номер" = %s AND "Отчетный_период" = %s', 
                        (reg_number, year))
+            if cur.rowcount == 0:
+                conn.rollback()
+                return JSONResponse(content={"success": False, "error": "Отчётный период не найден", "code": "not_found"})
             
             conn.commit()
             return JSONResponse(content={"success": True, "message": "Отчётный период успешно удален"})
@@ -4240,15 +4413,183 @@ async def delete_period(reg_number: int, year: int):
         except Exception as e:
             conn.rollback()
             print(f"❌ Ошибка в delete_period: {e}")
+            return write_error_response(e)
+        finally:
+            release_connection(conn)
+    else:
+        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
+
+# Фильтры предприятий для массового открытия года: поле запроса -> колонка enterprises
+OPEN_YEAR_FILTERS = {
+    "ministry_code": 'e."Код_министерства"',
+    "industry_code": 'e."Код_отрасли"',
+    "region_code": 'e."Код_области"',
+}
+
+@app.post("/api/admin/periods/open-year")
+def open_reporting_year(data: dict = Body(...)):
+    """
+    Открывает отчетный год: создает периоды года для всех предприятий (или выбранных
+    фильтрами) одним INSERT ... SELECT; уже существующие периоды пропускаются.
+    При carry_over_director ФИО директора переносится из периода предыдущего года.
+    Периоды закрытого года не создаются (триггер trg_period_closed_year).
+    """
+    conn = get_main_db_connection()
+    if conn:
+        try:
+            try:
+                year = int(data.get('year'))
+            except (TypeError, ValueError):
+                return JSONResponse(content={"success": False, "error": "Обязательное поле: year"})
+
+            conditions = []
+            params = {"year": year, "carry_over": bool(data.get('carry_over_director'))}
+            for field, column in OPEN_YEAR_FILTERS.items():
+                if data.get(field) is not None:
+                    conditions.append(f"{column} = %({field})s")
+                    params[field] = data[field]
+            if data.get('reg_numbers'):
+                conditions.append('e."Регистрационный_номер" = ANY(%(reg_numbers)s)')
+                params["reg_numbers"] = [int(reg_number) for reg_number in data['reg_numbers']]
+            where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
+
+            cur = conn.cursor()
+
+            # Одним обращением к БД: секция услуг года (создается сразу, чтобы первая вставка
+            # услуг не ждала DDL) и вставка периодов; выбранные предприятия и созданные периоды
+            # считаются в том же запросе, поэтому «уже существовало» = выбранные − созданные
+            cur.execute(f"""
+                SELECT ensure_services_partition(%(year)s);
+                WITH targets AS MATERIALIZED (
+                    SELECT e."Регистрационный_номер",
+                           CASE WHEN %(carry_over)s THEN prev."ФИО_директора" END AS director_name
+                    FROM enterprises e
+                    LEFT JOIN period prev ON prev."Регистрационный_номер" = e."Регистрационный_номер"
+                        AND prev."Отчетный_период" = %(year)s - 1
+                    {where_clause}
+                ), created AS (
+                    INSERT INTO period ("Регистрационный_номер", "Отчетный_период", "ФИО_директора")
+                    SELECT "Регистрационный_номер", %(year)s, director_name FROM targets
+                    ON CONFLICT ("Регистрационный_номер", "Отчетный_период") DO NOTHING
+                    RETURNING 1
+                )
+                SELECT (SELECT COUNT(*) FROM created), (SELECT COUNT(*) FROM targets)
+            """, params)
+            created, targets_count = cur.fetchone()
+
+            conn.commit()
+            return JSONResponse(content={
+                "success": True,
+                "message": f"Отчетный период {year}: создано периодов {created}, уже существовало {targets_count - created}",
+                "created": created,
+                "skipped": targets_count - created
+            })
+
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Ошибка в open_reporting_year: {e}")
+            return write_error_response(e)
+        finally:
+            release_connection(conn)
+    else:
+        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
+
+# API для закрытия отчетных годов
+@app.get("/api/admin/closed-years")
+def get_admin_closed_years():
+    """Возвращает список закрытых отчетных годов"""
+    conn = get_main_db_connection()
+    if conn:
+        try:
+            cur = conn.cursor()
+            
+            cur.execute('SELECT "Отчетный_период", "Дата_закрытия" FROM closed_years ORDER BY "Отчетный_период" DESC')
+            
+            closed_years = []
+            for row in cur.fetchall():
+                closed_years.append({
+                    "year": row[0],
+                    "closed_at": row[1].isoformat() if row[1] else None
+                })
+            
+            return JSONResponse(content={"success": True, "closed_years": closed_years})
+            
+        except Exception as e:
+            print(f"❌ Ошибка в get_admin_closed_years: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
+    else:
+        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
+
+@app.post("/api/admin/closed-years")
+def close_year(data: dict = Body(...)):
+    """Закрывает отчетный год: данные года больше не меняются, отчеты за него сохраняются на диске"""
+    conn = get_main_db_connection()
+    if conn:
+        try:
+            if not data.get('year'):
+                return JSONResponse(content={"success": False, "error": "Обязательное поле: year"})
+            
+            cur = conn.cursor()
+            
+            cur.execute("""
+                INSERT INTO closed_years ("Отчетный_период") VALUES (%s)
+                ON CONFLICT ("Отчетный_период") DO NOTHING
+            """, (data['year'],))
+            
+            # Куб пересчитывается в той же транзакции, не дожидаясь фонового обновления:
+            # отчеты закрытого года сохраняются на диск и должны включать последние правки услуг.
+            # Если пересчет не удался, год не закрывается (refresh_services_cube откатывает транзакцию)
+            if not refresh_services_cube(conn):
+                return JSONResponse(content={
+                    "success": False,
+                    "error": "Не удалось обновить данные отчетов — отчетный период не закрыт"
+                })
+            invalidate_closed_years()
+            invalidate_data_versions()
+            # Отчеты прошлого закрытия этого года уже не читаются (другая отметка закрытия)
+            purge_reports(int(data['year']))
+            return JSONResponse(content={"success": True, "message": f"Отчетный период {data['year']} закрыт"})
+            
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Ошибка в close_year: {e}")
+            return JSONResponse(content={"success": False, "error": str(e)})
+        finally:
+            release_connection(conn)
+    else:
+        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
+
+@app.delete("/api/admin/closed-years/{year}")
+def reopen_year(year: int):
+    """Открывает отчетный год для изменений и удаляет сохраненные отчеты за него"""
+    conn = get_main_db_connection()
+    if conn:
+        try:
+            cur = conn.cursor()
+            
+            cur.execute('DELETE FROM closed_years WHERE "Отчетный_период" = %s', (year,))
+            if cur.rowcount == 0:
+                return JSONResponse(content={"success": False, "error": "Отчетный период не закрыт"})
+            
+            conn.commit()
+            invalidate_closed_years()
+            purge_reports(year)
+            return JSONResponse(content={"success": True, "message": f"Отчетный период {year} открыт для изменений"})
+            
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Ошибка в reopen_year: {e}")
+            return JSONResponse(content={"success": False, "error": str(e)})
+        finally:
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 # API для справочника предприятий (упрощенная версия)
 @app.get("/api/admin/reference/enterprises")
-async def get_enterprises_reference():
+def get_enterprises_reference():
     """Возвращает справочник предприятий для выпадающих списков"""
     conn = get_main_db_connection()
     if conn:
@@ -4276,7 +4617,7 @@ async def get_enterprises_reference():
             print(f"❌ Ошибка в get_enterprises_reference: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
     
@@ -4285,36 +4626,142 @@ async def get_enterprises_reference():
 # Добавить в main.py после существующих API endpoints для периодов
 
 # API для управления услугами в админ-панели
+# Сортировки списка услуг в админке: ключ keyset-пагинации (последний столбец — id),
+# под каждую есть индекс idx_services_admin_* с теми же столбцами
+ADMIN_SERVICES_SORTS = {
+    "enterprise": ('"Регистрационный_номер"', '"Отчетный_период"', '"Код_вида_услуг"', "id"),
+    "year": ('"Отчетный_период"', '"Регистрационный_номер"', '"Код_вида_услуг"', "id"),
+    "service_type": ('"Код_вида_услуг"', '"Отчетный_период"', '"Регистрационный_номер"', "id"),
+}
+ADMIN_SERVICES_PAGE_SIZE = 50
+ADMIN_SERVICES_MAX_PAGE_SIZE = 500
+
+
+def build_admin_services_filters(reg_number: int = None, district_code: int = None,
+                                 year: int = None, service_type: str = None):
+    """
+    Условия WHERE и параметры фильтров услуг (список и выгрузка в админке).
+    Возвращает None, если вид услуги не найден — тогда и услуг нет.
+    """
+    conditions = []
+    params = {}
+    if reg_number is not None:
+        conditions.append('s."Регистрационный_номер" = %(reg_number)s')
+        params["reg_number"] = reg_number
+    if district_code is not None:
+        conditions.append('s."Код_района" = %(district_code)s')
+        params["district_code"] = district_code
+    if year is not None:
+        conditions.append('s."Отчетный_период" = %(year)s')
+        params["year"] = year
+    if service_type:
+        service_type_ids = [row.id for row in get_reference("service_types") if row.name == service_type]
+        if not service_type_ids:
+            return None
+        conditions.append('s."Код_вида_услуг" = %(service_type_id)s')
+        params["service_type_id"] = service_type_ids[0]
+    return conditions, params
+
+
+def encode_cursor(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+
+
 @app.get("/api/admin/services")
-async def get_admin_services():
-    """Возвращает список всех услуг для админ-панели"""
+def get_admin_services(
+        reg_number: int = None,
+        district_code: int = None,
+        year: int = None,
+        service_type: str = None,
+        sort: str = "year",
+        order: str = "desc",
+        limit: int = ADMIN_SERVICES_PAGE_SIZE,
+        cursor: str = None
+):
+    """
+    Возвращает страницу услуг для админ-панели с фильтрами и сортировкой.
+    Следующая страница запрашивается с cursor=next_cursor (keyset-пагинация).
+    """
+    if sort not in ADMIN_SERVICES_SORTS or order not in ("asc", "desc"):
+        return JSONResponse(content={"success": False, "error": "Неверные параметры сортировки"})
+    limit = max(1, min(limit, ADMIN_SERVICES_MAX_PAGE_SIZE))
+    # Фильтры (вид услуги — из кэша справочников) — до взятия соединения, как и в выгрузке
+    try:
+        filters = build_admin_services_filters(reg_number, district_code, year, service_type)
+    except Exception as e:
+        print(f"❌ Ошибка в get_admin_services: {e}")
+        return JSONResponse(content={"success": False, "error": str(e)})
+    if filters is None:
+        return JSONResponse(content={"success": True, "services": [], "next_cursor": None})
+    conditions, params = filters
+    params["limit"] = limit + 1
+
     conn = get_main_db_connection()
     if conn:
         try:
             cur = conn.cursor()
             
-            cur.execute("""
+            sort_columns = ADMIN_SERVICES_SORTS[sort]
+            
+            if cursor:
+                # Строки строго после последней строки предыдущей страницы (в порядке сортировки)
+                cursor_values = decode_cursor(cursor)
+                if len(cursor_values) != len(sort_columns):
+                    return JSONResponse(content={"success": False, "error": "Неверный курсор страницы"})
+                placeholders = []
+                for i, value in enumerate(cursor_values):
+                    params[f"cursor_{i}"] = value
+                    placeholders.append(f"%(cursor_{i})s")
+                operator = "<" if order == "desc" else ">"
+                conditions.append(
+                    f"({', '.join('s.' + column for column in sort_columns)}) {operator} ({', '.join(placeholders)})"
+                )
+            
+            where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            order_clause = ", ".join(f"s.{column} {order.upper()}" for column in sort_columns)
+            
+            # Сначала страница из services по индексу, затем названия только для её строк
+            cur.execute(f"""
                 SELECT 
                     s.id,
                     s."Регистрационный_номер" as reg_number,
                     s."Код_района" as district_code,
                     s."Отчетный_период" as year,
-                    s."Наименование_вида_услуг" as service_type,
+                    st."Наименование_вида_услуг" as service_type,
                     s."Код_показателя" as indicator_code,
                     s."План_всего" as plan_total,
                     s."Фактически_выполнено_всего" as fact_total,
                     e."Наименование_предприятия" as enterprise_name,
                     d."Наименование_района" as district_name,
-                    r."Наименование_области" as region_name
-                FROM services s
+                    r."Наименование_области" as region_name,
+                    s."Код_вида_услуг" as service_type_id
+                FROM (
+                    SELECT s.id, s."Регистрационный_номер", s."Код_района", s."Отчетный_период",
+                           s."Код_вида_услуг", s."Код_показателя", s."План_всего", s."Фактически_выполнено_всего"
+                    FROM services s
+                    {where_clause}
+                    ORDER BY {order_clause}
+                    LIMIT %(limit)s
+                ) s
+                JOIN service_types st ON st.id = s."Код_вида_услуг"
                 JOIN enterprises e ON s."Регистрационный_номер" = e."Регистрационный_номер"
-                JOIN districts d ON s."Код_района" = d."Код_района"
-                JOIN regions r ON d."Код_области" = r."Код_области"
-                ORDER BY e."Наименование_предприятия", s."Отчетный_период" DESC, s."Наименование_вида_услуг"
-            """)
+                -- Район услуги и область района могут быть не указаны: LEFT JOIN не теряет строки
+                -- уже отобранной страницы (иначе страница короче limit и листание обрывается)
+                LEFT JOIN districts d ON s."Код_района" = d."Код_района"
+                LEFT JOIN regions r ON d."Код_области" = r."Код_области"
+                ORDER BY {order_clause}
+            """, params)
+            
+            rows = cur.fetchall()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
             
             services = []
-            for row in cur.fetchall():
+            for row in rows:
                 services.append({
                     "id": row[0],
                     "reg_number": row[1],
@@ -4329,24 +4776,139 @@ async def get_admin_services():
                     "region_name": row[10]
                 })
             
-            return JSONResponse(content={"success": True, "services": services})
+            next_cursor = None
+            if has_more:
+                last = rows[-1]
+                sort_values = {
+                    '"Регистрационный_номер"': last[1],
+                    '"Отчетный_период"': last[3],
+                    '"Код_вида_услуг"': last[11],
+                    "id": last[0]
+                }
+                next_cursor = encode_cursor(sort_values[column] for column in sort_columns)
+            
+            return JSONResponse(content={"success": True, "services": services, "next_cursor": next_cursor})
             
         except Exception as e:
             print(f"❌ Ошибка в get_admin_services: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
+    else:
+        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
+
+@app.get("/api/admin/services/years")
+def get_admin_services_years():
+    """Возвращает отчетные годы для фильтра услуг (годы услуг — подмножество годов периодов)"""
+    conn = get_main_db_connection()
+    if conn:
+        try:
+            cur = conn.cursor()
+            
+            cur.execute('SELECT DISTINCT "Отчетный_период" FROM period ORDER BY "Отчетный_период" DESC')
+            
+            return JSONResponse(content={"success": True, "years": [row[0] for row in cur.fetchall()]})
+            
+        except Exception as e:
+            print(f"❌ Ошибка в get_admin_services_years: {e}")
+            return JSONResponse(content={"success": False, "error": str(e)})
+        finally:
+            release_connection(conn)
+    else:
+        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
+
+# Выгрузка услуг: строки читаются именованным (серверным) курсором пачками по
+# EXPORT_BATCH_SIZE и сразу отправляются клиенту — память не растёт с размером таблицы
+EXPORT_BATCH_SIZE = 2000
+EXPORT_COLUMNS = ("id", "reg_number", "enterprise_name", "district_code", "district_name", "region_name",
+                  "year", "service_type", "indicator_code", "plan_total", "fact_total")
+
+
+def stream_services_export(conn, export_format: str, where_clause: str, params: dict):
+    """Генератор выгрузки: NDJSON (строка JSON на услугу) или CSV с заголовком"""
+    try:
+        cur = conn.cursor(name="services_export")
+        cur.execute(f"""
+            SELECT 
+                s.id,
+                s."Регистрационный_номер",
+                e."Наименование_предприятия",
+                s."Код_района",
+                d."Наименование_района",
+                r."Наименование_области",
+                s."Отчетный_период",
+                st."Наименование_вида_услуг",
+                s."Код_показателя",
+                s."План_всего",
+                s."Фактически_выполнено_всего"
+            FROM services s
+            JOIN service_types st ON st.id = s."Код_вида_услуг"
+            JOIN enterprises e ON s."Регистрационный_номер" = e."Регистрационный_номер"
+            LEFT JOIN districts d ON s."Код_района" = d."Код_района"
+            LEFT JOIN regions r ON d."Код_области" = r."Код_области"
+            {where_clause}
+            ORDER BY s."Отчетный_период", s."Регистрационный_номер", s."Код_вида_услуг", s.id
+        """, params)
+
+        if export_format == "csv":
+            # BOM — чтобы Excel открыл файл в UTF-8
+            yield "\ufeff" + ";".join(EXPORT_COLUMNS) + "\r\n"
+
+        while True:
+            rows = cur.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            if export_format == "csv":
+                buffer = io.StringIO()
+                csv.writer(buffer, delimiter=";").writerows(rows)
+                yield buffer.getvalue()
+            else:
+                yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n" for row in rows)
+        cur.close()
+    except Exception as e:
+        # Заголовки уже отправлены — ошибку можно только записать в лог и оборвать выгрузку
+        print(f"❌ Ошибка выгрузки услуг: {e}")
+        raise
+    finally:
+        release_connection(conn)
+
+
+@app.get("/api/admin/services/export")
+def export_admin_services(
+        format: str = "ndjson",
+        reg_number: int = None,
+        district_code: int = None,
+        year: int = None,
+        service_type: str = None
+):
+    """Выгружает услуги (с названиями предприятия, района и области) потоком в NDJSON или CSV"""
+    if format not in ("ndjson", "csv"):
+        return JSONResponse(content={"success": False, "error": "Формат выгрузки: ndjson или csv"})
+    filters = build_admin_services_filters(reg_number, district_code, year, service_type)
+    if filters is None:
+        return JSONResponse(content={"success": False, "error": "Вид услуги не найден"})
+    conditions, params = filters
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    conn = get_main_db_connection()
+    if conn:
+        # Соединение возвращается в пул генератором, когда выгрузка закончится
+        media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+        filename = f"services_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{format}"
+        return StreamingResponse(
+            stream_services_export(conn, format, where_clause, params),
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 @app.post("/api/admin/services")
-async def create_service(request: Request):
+def create_service(data: dict = Body(...)):
     """Создает новую услугу"""
     conn = get_main_db_connection()
     if conn:
         try:
-            data = await request.json()
-            
             # Валидация обязательных полей
             required_fields = ['reg_number', 'district_code', 'year', 'service_type']
             for field in required_fields:
@@ -4355,82 +4917,112 @@ async def create_service(request: Request):
             
             cur = conn.cursor()
             
-            # Проверяем существование предприятия
-            cur.execute('SELECT COUNT(*) FROM enterprises WHERE "Регистрационный_номер" = %s', (data['reg_number'],))
-            if cur.fetchone()[0] == 0:
-                return JSONResponse(content={"success": False, "error": "Предприятие не найдено"})
-            
-            # Проверяем существование района
-            cur.execute('SELECT COUNT(*) FROM districts WHERE "Код_района" = %s', (data['district_code'],))
-            if cur.fetchone()[0] == 0:
-                return JSONResponse(content={"success": False, "error": "Район не найден"})
-            
-            # Проверяем существование вида услуги
-            cur.execute('SELECT COUNT(*) FROM service_types WHERE "Наименование_вида_услуг" = %s', (data['service_type'],))
-            if cur.fetchone()[0] == 0:
-                return JSONResponse(content={"success": False, "error": "Вид услуги не найден"})
-            
-            # Проверяем уникальность комбинации (предприятие + район + год + вид услуги)
-            cur.execute("""
-                SELECT COUNT(*) FROM services 
-                WHERE "Регистрационный_номер" = %s 
-                AND "Код_района" = %s 
-                AND "Отчетный_период" = %s 
-                AND "Наименование_вида_услуг" = %s
-            """, (data['reg_number'], data['district_code'], data['year'], data['service_type']))
-            
-            if cur.fetchone()[0] > 0:
-                return JSONResponse(content={"success": False, "error": "Услуга с такими параметрами уже существует"})
-            
-            # Вставляем новую услугу
+            # Одним обращением к БД: секция services за год (создаётся при первой услуге года)
+            # и вставка, в которой код области и код вида услуги берутся из справочников.
+            # Несуществующие предприятие и отчетный период отклоняют внешние ключи services
             cur.execute("""
+                SELECT ensure_services_partition(%(year)s);
                 INSERT INTO services 
-                ("Регистрационный_номер", "Код_района", "Отчетный_период", 
-                 "Наименование_вида_услуг", "Код_показателя", "План_всего", "Фактически_выполнено_всего")
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (
-                data['reg_number'],
-                data['district_code'],
-                data['year'],
-                data['service_type'],
-                data.get('indicator_code'),
-                data.get('plan_total'),
-                data.get('fact_total')
-            ))
+                ("Регистрационный_номер", "Код_района", "Код_области", "Отчетный_период", 
+                 "Код_вида_услуг", "Код_показателя", "План_всего", "Фактически_выполнено_всего")
+                SELECT %(reg_number)s, d."Код_района", d."Код_области", %(year)s,
+                       st.id, %(indicator_code)s, %(plan_total)s, %(fact_total)s
+                FROM districts d
+                CROSS JOIN service_types st
+                WHERE d."Код_района" = %(district_code)s AND st."Наименование_вида_услуг" = %(service_type)s
+                ON CONFLICT ("Регистрационный_номер", "Код_района", "Отчетный_период", "Код_вида_услуг") DO NOTHING
+                RETURNING id
+            """, {
+                "reg_number": data['reg_number'],
+                "district_code": data['district_code'],
+                "year": data['year'],
+                "service_type": data['service_type'],
+                "indicator_code": data.get('indicator_code'),
+                "plan_total": data.get('plan_total'),
+                "fact_total": data.get('fact_total')
+            })
+            if cur.fetchone() is None:
+                conn.rollback()
+                # Строка не вставлена: нет района или вида услуги либо повтор. Проверяем тем же
+                # соединением, а не через кэш справочников: его загрузка заняла бы второе соединение пула
+                cur.execute("""
+                    SELECT
+                        EXISTS (SELECT 1 FROM districts WHERE "Код_района" = %(district_code)s),
+                        EXISTS (SELECT 1 FROM service_types WHERE "Наименование_вида_услуг" = %(service_type)s)
+                """, {"district_code": data['district_code'], "service_type": data['service_type']})
+                district_exists, service_type_exists = cur.fetchone()
+                conn.rollback()
+                if not district_exists:
+                    error, code = "Район не найден", "not_found"
+                elif not service_type_exists:
+                    error, code = "Вид услуги не найден", "not_found"
+                else:
+                    error, code = "Услуга с такими параметрами уже существует", "duplicate"
+                return JSONResponse(content={"success": False, "error": error, "code": code})
             
             conn.commit()
+            invalidate_indicator_codes()
+            request_cube_refresh()
             return JSONResponse(content={"success": True, "message": "Услуга успешно создана"})
             
         except Exception as e:
             conn.rollback()
             print(f"❌ Ошибка в create_service: {e}")
+            return write_error_response(e)
+        finally:
+            release_connection(conn)
+    else:
+        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
+
+@app.post("/api/admin/services/import")
+def import_admin_services(file: UploadFile = File(...), dry_run: bool = Form(False)):
+    """
+    Массовый импорт услуг из CSV/XLSX: все строки проверяются в БД одним запросом,
+    при ошибках ничего не записывается и возвращаются ошибки по строкам
+    """
+    try:
+        rows = read_import_file(file.filename or "", file.file.read())
+    except ImportFileError as e:
+        return JSONResponse(content={"success": False, "error": str(e)})
+    except Exception as e:
+        print(f"❌ Ошибка чтения файла импорта: {e}")
+        return JSONResponse(content={"success": False, "error": f"Не удалось прочитать файл: {e}"})
+
+    conn = get_main_db_connection()
+    if conn:
+        try:
+            result = import_services(conn, rows, dry_run=dry_run)
+            if result["inserted"] or result["updated"]:
+                invalidate_indicator_codes()
+                request_cube_refresh()
+            return JSONResponse(content={"success": result["error_count"] == 0, **result})
+            
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Ошибка в import_admin_services: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 @app.put("/api/admin/services/{service_id}")
-async def update_service(service_id: int, request: Request):
+def update_service(service_id: int, data: dict = Body(...)):
     """Обновляет данные услуги"""
     conn = get_main_db_connection()
     if conn:
         try:
-            data = await request.json()
-            
             cur = conn.cursor()
             
-            # Проверяем существование услуги
-            cur.execute('SELECT COUNT(*) FROM services WHERE id = %s', (service_id,))
-            if cur.fetchone()[0] == 0:
-                return JSONResponse(content={"success": False, "error": "Услуга не найдена"})
-            
-            # Обновляем данные (можно менять только код показателя, план и факт)
+            # Обновляем данные (можно менять только код показателя, план и факт);
+            # код области сверяется с районом услуги
             cur.execute("""
                 UPDATE services 
                 SET "Код_показателя" = %s,
                     "План_всего" = %s,
-                    "Фактически_выполнено_всего" = %s
+                    "Фактически_выполнено_всего" = %s,
+                    "Код_области" = (SELECT d."Код_области" FROM districts d
+                                     WHERE d."Код_района" = services."Код_района")
                 WHERE id = %s
             """, (
                 data.get('indicator_code'),
@@ -4438,110 +5030,89 @@ async def update_service(service_id: int, request: Request):
                 data.get('fact_total'),
                 service_id
             ))
+            if cur.rowcount == 0:
+                conn.rollback()
+                return JSONResponse(content={"success": False, "error": "Услуга не найдена", "code": "not_found"})
             
             conn.commit()
+            invalidate_indicator_codes()
+            request_cube_refresh()
             return JSONResponse(content={"success": True, "message": "Услуга успешно обновлена"})
             
         except Exception as e:
             conn.rollback()
             print(f"❌ Ошибка в update_service: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
+            return write_error_response(e)
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 @app.delete("/api/admin/services/{service_id}")
-async def delete_service(service_id: int):
+def delete_service(service_id: int):
     """Удаляет услугу"""
     conn = get_main_db_connection()
     if conn:
         try:
             cur = conn.cursor()
             
-            # Проверяем существование услуги
-            cur.execute('SELECT COUNT(*) FROM services WHERE id = %s', (service_id,))
-            if cur.fetchone()[0] == 0:
-                return JSONResponse(content={"success": False, "error": "Услуга не найдена"})
-            
             # Удаляем услугу
             cur.execute('DELETE FROM services WHERE id = %s', (service_id,))
+            if cur.rowcount == 0:
+                conn.rollback()
+                return JSONResponse(content={"success": False, "error": "Услуга не найдена", "code": "not_found"})
             
             conn.commit()
+            invalidate_indicator_codes()
+            request_cube_refresh()
             return JSONResponse(content={"success": True, "message": "Услуга успешно удалена"})
             
         except Exception as e:
             conn.rollback()
             print(f"❌ Ошибка в delete_service: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
+            return write_error_response(e)
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
 
 # API для справочника районов
 @app.get("/api/admin/reference/districts")
-async def get_districts_reference():
+def get_districts_reference():
     """Возвращает справочник районов для выпадающих списков"""
-    conn = get_main_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor()
-            
-            cur.execute("""
-                SELECT 
-                    d."Код_района" as code,
-                    d."Наименование_района" as name,
-                    r."Наименование_области" as region_name
-                FROM districts d
-                JOIN regions r ON d."Код_области" = r."Код_области"
-                ORDER BY r."Наименование_области", d."Наименование_района"
-            """)
-            
-            districts = []
-            for row in cur.fetchall():
-                districts.append({
-                    "code": row[0],
-                    "name": row[1],
-                    "region_name": row[2]
-                })
-            
-            return JSONResponse(content={"success": True, "data": districts})
-            
-        except Exception as e:
-            print(f"❌ Ошибка в get_districts_reference: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
-        finally:
-            conn.close()
-    else:
-        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
+    try:
+        districts = [{"code": row.code, "name": row.name, "region_name": row.region_name} for row in get_reference("districts")]
+        return JSONResponse(content={"success": True, "data": districts})
+    except Exception as e:
+        print(f"❌ Ошибка в get_districts_reference: {e}")
+        return JSONResponse(content={"success": False, "error": str(e)})
 
 # API для справочника видов услуг
 @app.get("/api/admin/reference/service-types")
-async def get_service_types_reference():
+def get_service_types_reference():
     """Возвращает справочник видов услуг для выпадающих списков"""
-    conn = get_main_db_connection()
-    if conn:
-        try:
-            cur = conn.cursor()
-            
-            cur.execute('SELECT "Наименование_вида_услуг" as name FROM service_types ORDER BY "Наименование_вида_услуг"')
-            
-            service_types = []
-            for row in cur.fetchall():
-                service_types.append({
-                    "name": row[0]
-                })
-            
-            return JSONResponse(content={"success": True, "data": service_types})
-            
-        except Exception as e:
-            print(f"❌ Ошибка в get_service_types_reference: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
-        finally:
-            conn.close()
-    else:
-        return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД"})
+    try:
+        service_types = [{"name": row.name} for row in get_reference("service_types")]
+        return JSONResponse(content={"success": True, "data": service_types})
+    except Exception as e:
+        print(f"❌ Ошибка в get_service_types_reference: {e}")
+        return JSONResponse(content={"success": False, "error": str(e)})
+
+# Сброс кэша справочников (после правки справочных таблиц напрямую в БД)
+@app.post("/api/admin/reference/cache/reset")
+def reset_reference_cache(data: dict = Body(default={})):
+    """Сбрасывает кэш справочников: указанные таблицы (tables) или все"""
+    tables = data.get('tables') or []
+    if not isinstance(tables, list) or not all(isinstance(table, str) for table in tables):
+        return JSONResponse(content={"success": False, "error": "tables должен быть списком имен таблиц"})
+    unknown = [table for table in tables if table not in REFERENCE_QUERIES]
+    if unknown:
+        return JSONResponse(content={
+            "success": False,
+            "error": f"Нет в кэше справочников: {', '.join(unknown)}. Допустимые таблицы: {', '.join(REFERENCE_QUERIES)}"
+        })
+    invalidate_reference(*tables)
+    return JSONResponse(content={"success": True, "stats": get_reference_cache_stats()})
     
 #-----------------------------------------------------------------------------------------------
 
@@ -4549,7 +5120,7 @@ async def get_service_types_reference():
 
 # API для управления пользователями в админ-панели
 @app.get("/api/admin/users")
-async def get_admin_users():
+def get_admin_users():
     """Возвращает список всех пользователей для админ-панели"""
     conn = get_users_db_connection()
     if conn:
@@ -4597,18 +5168,48 @@ async def get_admin_users():
             print(f"❌ Ошибка в get_admin_users: {e}")
             return JSONResponse(content={"success": False, "error": str(e)})
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД пользователей"})
 
+# Условие WHERE для изменения пользователя: запись проходит, если после неё останется
+# активный администратор — пользователь не админ, остаётся админом ({keeps_admin})
+# или есть другой активный администратор
+LAST_ADMIN_GUARD = """(
+    "роль" <> 'admin' OR ({keeps_admin})
+    OR EXISTS (SELECT 1 FROM users a WHERE a."роль" = 'admin' AND a."статус" = 'active' AND a.id <> users.id)
+)"""
+
+
+def lock_active_admins(cur):
+    """
+    Блокирует строки активных администраторов до конца транзакции (перед записью с LAST_ADMIN_GUARD).
+    Без блокировки две одновременные правки двух последних администраторов видят друг друга
+    активными и обе проходят. С ней вторая ждет первую, и ее условие (новый снимок следующего
+    оператора) видит уже зафиксированное изменение. Порядок по id — одинаковый во всех транзакциях
+    """
+    cur.execute("""
+        SELECT id FROM users
+        WHERE "роль" = 'admin' AND "статус" = 'active'
+        ORDER BY id
+        FOR UPDATE
+    """)
+
+
+def user_write_rejected(cur, user_id: int, last_admin_error: str):
+    """Ответ, когда изменение пользователя не затронуло ни одной строки: нет пользователя или он последний администратор"""
+    cur.execute('SELECT 1 FROM users WHERE id = %s', (user_id,))
+    if cur.fetchone() is None:
+        return JSONResponse(content={"success": False, "error": "Пользователь не найден", "code": "not_found"})
+    return JSONResponse(content={"success": False, "error": last_admin_error, "code": "last_admin"})
+
+
 @app.post("/api/admin/users")
-async def create_admin_user(request: Request):
+def create_admin_user(data: dict = Body(...)):
     """Создает нового пользователя"""
     conn = get_users_db_connection()
     if conn:
         try:
-            data = await request.json()
-            
             # Валидация обязательных полей
             required_fields = ['full_name', 'email', 'login', 'password', 'role', 'status']
             for field in required_fields:
@@ -4621,21 +5222,12 @@ async def create_admin_user(request: Request):
             
             cur = conn.cursor()
             
-            # Проверяем уникальность email
-            cur.execute('SELECT COUNT(*) FROM users WHERE email = %s', (data['email'],))
-            if cur.fetchone()[0] > 0:
-                return JSONResponse(content={"success": False, "error": "Пользователь с таким email уже существует"})
-            
-            # Проверяем уникальность логина
-            cur.execute('SELECT COUNT(*) FROM users WHERE "логин" = %s', (data['login'],))
-            if cur.fetchone()[0] > 0:
-                return JSONResponse(content={"success": False, "error": "Пользователь с таким логином уже существует"})
-            
             # Хэшируем пароль
             from app.auth.utils import hash_password
             password_hash = hash_password(data['password'])
             
-            # Вставляем нового пользователя
+            # Вставляем нового пользователя; повтор email или логина отклоняют
+            # ограничения unique_user_email / unique_user_login
             cur.execute("""
                 INSERT INTO users 
                 ("ФИО", email, "логин", "пароль_хэш", "роль", "статус")
@@ -4655,20 +5247,18 @@ async def create_admin_user(request: Request):
         except Exception as e:
             conn.rollback()
             print(f"❌ Ошибка в create_admin_user: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
+            return write_error_response(e)
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД пользователей"})
 
 @app.put("/api/admin/users/{user_id}")
-async def update_admin_user(user_id: int, request: Request):
+def update_admin_user(user_id: int, data: dict = Body(...)):
     """Обновляет данные пользователя"""
     conn = get_users_db_connection()
     if conn:
         try:
-            data = await request.json()
-            
             # Валидация обязательных полей
             required_fields = ['full_name', 'email', 'login', 'role', 'status']
             for field in required_fields:
@@ -4677,31 +5267,6 @@ async def update_admin_user(user_id: int, request: Request):
             
             cur = conn.cursor()
             
-            # Проверяем существование пользователя
-            cur.execute('SELECT "роль" FROM users WHERE id = %s', (user_id,))
-            user_result = cur.fetchone()
-            if not user_result:
-                return JSONResponse(content={"success": False, "error": "Пользователь не найден"})
-            
-            current_role = user_result[0]
-            
-            # Проверяем, не пытаемся ли изменить роль последнего активного администратора
-            if current_role == 'admin' and data['role'] != 'admin':
-                cur.execute('SELECT COUNT(*) FROM users WHERE "роль" = %s AND "статус" = %s AND id != %s', 
-                           ('admin', 'active', user_id))
-                if cur.fetchone()[0] == 0:
-                    return JSONResponse(content={"success": False, "error": "Нельзя изменить роль последнего активного администратора"})
-            
-            # Проверяем уникальность email (исключая текущего пользователя)
-            cur.execute('SELECT COUNT(*) FROM users WHERE email = %s AND id != %s', (data['email'], user_id))
-            if cur.fetchone()[0] > 0:
-                return JSONResponse(content={"success": False, "error": "Пользователь с таким email уже существует"})
-            
-            # Проверяем уникальность логина (исключая текущего пользователя)
-            cur.execute('SELECT COUNT(*) FROM users WHERE "логин" = %s AND id != %s', (data['login'], user_id))
-            if cur.fetchone()[0] > 0:
-                return JSONResponse(content={"success": False, "error": "Пользователь с таким логином уже существует"})
-            
             # Формируем запрос обновления
             update_fields = []
             update_values = []
@@ -4730,11 +5295,19 @@ async def update_admin_user(user_id: int, request: Request):
                 update_fields.append('"пароль_хэш" = %s')
                 update_values.append(password_hash)
             
-            update_values.append(user_id)
+            update_values.extend([user_id, data['role'], data['status']])
             
-            # Выполняем обновление
-            query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = %s"
+            # Выполняем обновление; последний активный администратор остается активным администратором,
+            # повтор email или логина отклоняют уникальные ограничения users
+            lock_active_admins(cur)
+            query = f"""
+                UPDATE users SET {', '.join(update_fields)}
+                WHERE id = %s AND {LAST_ADMIN_GUARD.format(keeps_admin="%s = 'admin' AND %s = 'active'")}
+            """
             cur.execute(query, update_values)
+            if cur.rowcount == 0:
+                conn.rollback()
+                return user_write_rejected(cur, user_id, "Нельзя изменить роль или статус последнего активного администратора")
             
             conn.commit()
             return JSONResponse(content={"success": True, "message": "Пользователь успешно обновлен"})
@@ -4742,35 +5315,27 @@ async def update_admin_user(user_id: int, request: Request):
         except Exception as e:
             conn.rollback()
             print(f"❌ Ошибка в update_admin_user: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
+            return write_error_response(e)
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД пользователей"})
 
 @app.delete("/api/admin/users/{user_id}")
-async def delete_admin_user(user_id: int):
+def delete_admin_user(user_id: int):
     """Удаляет пользователя"""
     conn = get_users_db_connection()
     if conn:
         try:
             cur = conn.cursor()
             
-            # Проверяем существование пользователя
-            cur.execute('SELECT "роль" FROM users WHERE id = %s', (user_id,))
-            user_result = cur.fetchone()
-            if not user_result:
-                return JSONResponse(content={"success": False, "error": "Пользователь не найден"})
-            
-            # Проверяем, не пытаемся ли удалить последнего активного администратора
-            if user_result[0] == 'admin':
-                cur.execute('SELECT COUNT(*) FROM users WHERE "роль" = %s AND "статус" = %s AND id != %s', 
-                           ('admin', 'active', user_id))
-                if cur.fetchone()[0] == 0:
-                    return JSONResponse(content={"success": False, "error": "Нельзя удалить последнего активного администратора"})
-            
-            # Удаляем пользователя
-            cur.execute('DELETE FROM users WHERE id = %s', (user_id,))
+            # Удаляем пользователя, если это не последний активный администратор
+            lock_active_admins(cur)
+            cur.execute(f"DELETE FROM users WHERE id = %s AND {LAST_ADMIN_GUARD.format(keeps_admin='FALSE')}",
+                        (user_id,))
+            if cur.rowcount == 0:
+                conn.rollback()
+                return user_write_rejected(cur, user_id, "Нельзя удалить последнего активного администратора")
             
             conn.commit()
             return JSONResponse(content={"success": True, "message": "Пользователь успешно удален"})
@@ -4778,19 +5343,18 @@ async def delete_admin_user(user_id: int):
         except Exception as e:
             conn.rollback()
             print(f"❌ Ошибка в delete_admin_user: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
+            return write_error_response(e)
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД пользователей"})
 
 @app.put("/api/admin/users/{user_id}/status")
-async def update_user_status(user_id: int, request: Request):
+def update_user_status(user_id: int, data: dict = Body(...)):
     """Изменяет статус пользователя (активен/заблокирован)"""
     conn = get_users_db_connection()
     if conn:
         try:
-            data = await request.json()
             new_status = data.get('status')
             
             if new_status not in ['active', 'blocked']:
@@ -4798,21 +5362,15 @@ async def update_user_status(user_id: int, request: Request):
             
             cur = conn.cursor()
             
-            # Проверяем существование пользователя
-            cur.execute('SELECT "роль" FROM users WHERE id = %s', (user_id,))
-            user_result = cur.fetchone()
-            if not user_result:
-                return JSONResponse(content={"success": False, "error": "Пользователь не найден"})
-            
-            # Проверяем, не пытаемся ли заблокировать последнего активного администратора
-            if user_result[0] == 'admin' and new_status == 'blocked':
-                cur.execute('SELECT COUNT(*) FROM users WHERE "роль" = %s AND "статус" = %s AND id != %s', 
-                           ('admin', 'active', user_id))
-                if cur.fetchone()[0] == 0:
-                    return JSONResponse(content={"success": False, "error": "Нельзя заблокировать последнего активного администратора"})
-            
-            # Обновляем статус
-            cur.execute('UPDATE users SET "статус" = %s WHERE id = %s', (new_status, user_id))
+            # Обновляем статус; последний активный администратор не блокируется
+            lock_active_admins(cur)
+            cur.execute(f"""
+                UPDATE users SET "статус" = %s
+                WHERE id = %s AND {LAST_ADMIN_GUARD.format(keeps_admin="%s <> 'blocked'")}
+            """, (new_status, user_id, new_status))
+            if cur.rowcount == 0:
+                conn.rollback()
+                return user_write_rejected(cur, user_id, "Нельзя заблокировать последнего активного администратора")
             
             conn.commit()
             return JSONResponse(content={"success": True, "message": f"Статус пользователя успешно изменен на {new_status}"})
@@ -4820,9 +5378,9 @@ async def update_user_status(user_id: int, request: Request):
         except Exception as e:
             conn.rollback()
             print(f"❌ Ошибка в update_user_status: {e}")
-            return JSONResponse(content={"success": False, "error": str(e)})
+            return write_error_response(e)
         finally:
-            conn.close()
+            release_connection(conn)
     else:
         return JSONResponse(content={"success": False, "error": "Ошибка подключения к БД пользователей"})
 
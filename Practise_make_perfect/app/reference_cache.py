@@ -0,0 +1,136 @@
+import threading
+from collections import namedtuple
+
+from app.database import main_db_connection
+
+# Строки справочников: неизменяемые кортежи, общие для всех запросов
+Ministry = namedtuple("Ministry", "id code name")
+Industry = namedtuple("Industry", "id code name")
+Region = namedtuple("Region", "id code name")
+District = namedtuple("District", "code name region_code region_name")
+ServiceType = namedtuple("ServiceType", "id name is_rural order")
+
+# Запросы загрузки справочников (порядок строк — как в выдаче API)
+REFERENCE_QUERIES = {
+    "ministries": (Ministry, """
+        SELECT id, "Код_министерства", "Наименование_министерства"
+        FROM ministries ORDER BY "Наименование_министерства"
+    """),
+    "industries": (Industry, """
+        SELECT id, "Код_отрасли", "Наименование_отрасли"
+        FROM industries ORDER BY "Наименование_отрасли"
+    """),
+    "regions": (Region, """
+        SELECT id, "Код_области", "Наименование_области"
+        FROM regions ORDER BY "Наименование_области"
+    """),
+    "districts": (District, """
+        SELECT d."Код_района", d."Наименование_района", r."Код_области", r."Наименование_области"
+        FROM districts d
+        JOIN regions r ON d."Код_области" = r."Код_области"
+        ORDER BY r."Наименование_области", d."Наименование_района"
+    """),
+    "service_types": (ServiceType, """
+        SELECT id, "Наименование_вида_услуг", "Сельская_местность", "Порядок"
+        FROM service_types ORDER BY "Порядок", "Наименование_вида_услуг"
+    """)
+}
+
+# Справочники, содержащие данные других таблиц (районы хранят название области)
+DEPENDENT_TABLES = {
+    "regions": ("districts",)
+}
+
+
+class ReferenceCache:
+    """
+    Кэш маленьких, редко меняющихся справочников основной БД в памяти процесса.
+    Справочник загружается целиком при первом обращении (или при старте) и
+    сбрасывается через invalidate() после изменения таблицы.
+    """
+
+    def __init__(self, queries: dict):
+        self.queries = queries
+        self._lock = threading.Lock()
+        self._data = {}  # {таблица: tuple строк}
+        self._generation = {table: 0 for table in queries}  # растёт при каждом сбросе
+        self.stats = {"hits": 0, "misses": 0, "loads": 0, "invalidations": 0}
+
+    def _load(self, table: str) -> tuple:
+        row_type, query = self.queries[table]
+        with main_db_connection() as conn:
+            if conn is None:
+                raise ConnectionError("Ошибка подключения к БД")
+            cur = conn.cursor()
+            cur.execute(query)
+            return tuple(row_type(*row) for row in cur.fetchall())
+
+    def get(self, table: str) -> tuple:
+        """Возвращает все строки справочника (из кэша или из БД)"""
+        with self._lock:
+            rows = self._data.get(table)
+            if rows is not None:
+                self.stats["hits"] += 1
+                return rows
+            self.stats["misses"] += 1
+            generation = self._generation[table]
+
+        # Запрос к БД выполняется вне блокировки
+        rows = self._load(table)
+        with self._lock:
+            self.stats["loads"] += 1
+            # Если справочник сбросили во время загрузки — данные могли устареть, не сохраняем
+            if self._generation[table] == generation:
+                self._data[table] = rows
+        return rows
+
+    def invalidate(self, *tables: str):
+        """Сбрасывает справочники (без аргументов — все) вместе с зависимыми от них"""
+        tables = tables or tuple(self.queries)
+        with self._lock:
+            for table in tables:
+                for name in (table, *DEPENDENT_TABLES.get(table, ())):
+                    if name in self._generation:
+                        self._generation[name] += 1
+                        self._data.pop(name, None)
+            self.stats["invalidations"] += 1
+
+    def load_all(self):
+        """Загружает все справочники заранее (вызывается при старте)"""
+        for table in self.queries:
+            self.get(table)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded": {table: len(rows) for table, rows in self._data.items()},
+                **self.stats
+            }
+
+
+reference_cache = ReferenceCache(REFERENCE_QUERIES)
+
+
+def get_reference(table: str) -> tuple:
+    """
+    Строки справочника. Не вызывать, держа соединение из пула: незагруженный справочник
+    берет второе соединение, и одновременные запросы могут занять весь пул
+    """
+    return reference_cache.get(table)
+
+
+def invalidate_reference(*tables: str):
+    reference_cache.invalidate(*tables)
+
+
+def get_reference_cache_stats() -> dict:
+    return reference_cache.get_stats()
+
+
+def warm_up_reference_cache():
+    print("📚 Загружаем справочники в кэш...")
+    try:
+        reference_cache.load_all()
+        print(f"✅ Справочники загружены: {reference_cache.get_stats()['loaded']}")
+    except Exception as error:
+        print(f"⚠️ Не удалось загрузить справочники: {error}")
@@ -0,0 +1,115 @@
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+from app.database import main_db_connection
+
+# Каталог с готовыми отчетами закрытых годов:
+# <каталог>/<первый год>-<последний год>/<отметка>/<ключ>.json.gz
+# Отметка строится из дат закрытия годов диапазона (для отчета за один год — и предыдущего)
+# и версий таблиц, из которых строятся отчеты: после повторного закрытия года (в т.ч. если
+# отчет сохранил воркер, ещё не узнавший об открытии), правки справочника или пересчета куба
+# сохраненные отчеты не читаются
+REPORT_STORE_DIR = Path(__file__).resolve().parent.parent / "report_store"
+
+# Закрытые отчетные годы (таблица closed_years) в памяти процесса: {год: дата закрытия};
+# сбрасываются по событию cache_events таблицы closed_years
+_closed_years = None
+_closed_years_lock = threading.Lock()
+_generation = 0
+
+
+def peek_closed_years():
+    """Закрытые годы из памяти процесса или None, если их нужно загрузить из БД"""
+    return _closed_years
+
+
+def get_closed_years() -> dict:
+    global _closed_years
+    with _closed_years_lock:
+        if _closed_years is not None:
+            return _closed_years
+        generation = _generation
+
+    with main_db_connection() as conn:
+        if conn is None:
+            raise ConnectionError("Ошибка подключения к БД")
+        cur = conn.cursor()
+        cur.execute('SELECT "Отчетный_период", "Дата_закрытия" FROM closed_years')
+        years = {year: closed_at.isoformat() for year, closed_at in cur.fetchall()}
+
+    with _closed_years_lock:
+        if _generation == generation:
+            _closed_years = years
+    return years
+
+
+def invalidate_closed_years():
+    global _closed_years, _generation
+    with _closed_years_lock:
+        _closed_years = None
+        _generation += 1
+
+
+def report_stamp(closed_years: dict, start_year: int, end_year: int, versions: dict, tables: tuple) -> str:
+    """
+    Отметка сохраненных отчетов за годы start_year..end_year (все годы должны быть закрыты):
+    даты закрытия годов и версии таблиц tables
+    """
+    dates = ",".join(closed_years[year] for year in range(start_year, end_year + 1))
+    tables_versions = ",".join(f"{table}:{versions.get(table, 0)}" for table in tables)
+    return hashlib.sha1(f"{dates}|{tables_versions}".encode("utf-8")).hexdigest()[:16]
+
+
+def report_etag(stamp: str, key: str) -> str:
+    return '"' + stamp + "-" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16] + '"'
+
+
+def _report_path(start_year: int, end_year: int, stamp: str, key: str) -> Path:
+    name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return REPORT_STORE_DIR / f"{start_year}-{end_year}" / stamp / f"{name}.json.gz"
+
+
+def load_report(start_year: int, end_year: int, stamp: str, key: str):
+    """Возвращает сжатый (gzip) JSON отчета за годы start_year..end_year или None, если его ещё нет"""
+    try:
+        return _report_path(start_year, end_year, stamp, key).read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def save_report(start_year: int, end_year: int, stamp: str, key: str, body: bytes) -> bytes:
+    """Сохраняет JSON отчета в сжатом виде и возвращает сжатые данные"""
+    compressed = gzip.compress(body)
+    path = _report_path(start_year, end_year, stamp, key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Запись через временный файл: параллельный читатель не увидит недописанный отчет
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(compressed)
+        os.replace(tmp_name, path)
+    except Exception:
+        os.unlink(tmp_name)
+        raise
+    return compressed
+
+
+def purge_reports(year: int):
+    """
+    Удаляет сохраненные отчеты, в которые входит год (при открытии и закрытии года),
+    в т.ч. отчеты за следующий год — они показывают факт этого года как прошлогодний
+    """
+    if not REPORT_STORE_DIR.is_dir():
+        return
+    for directory in REPORT_STORE_DIR.iterdir():
+        start_year, _, end_year = directory.name.partition("-")
+        if not (start_year.isdigit() and end_year.isdigit()):
+            continue
+        first_year = int(start_year) - 1 if start_year == end_year else int(start_year)
+        if first_year <= year <= int(end_year):
+            shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,266 @@
+"""
+Массовый импорт услуг из CSV/XLSX.
+
+Строки файла загружаются во временную таблицу через COPY FROM STDIN, проверяются
+одним запросом (типы, предприятие, район, вид услуги, отчетный период, закрытый год,
+повторы внутри файла) и при отсутствии ошибок вставляются одним INSERT ... ON CONFLICT:
+существующая услуга (предприятие + район + год + вид услуги) обновляется.
+
+Запуск из каталога Practise_make_perfect (нужна доступная основная БД):
+    python -m app.services_import services.csv
+    python -m app.services_import services.xlsx --dry-run
+"""
+import argparse
+import csv
+import io
+import sys
+
+# Колонки файла: имя в выгрузке /api/admin/services/export или имя колонки services
+IMPORT_COLUMNS = {
+    "reg_number": ("reg_number", "Регистрационный_номер"),
+    "district_code": ("district_code", "Код_района"),
+    "year": ("year", "Отчетный_период"),
+    "service_type": ("service_type", "Наименование_вида_услуг"),
+    "indicator_code": ("indicator_code", "Код_показателя"),
+    "plan_total": ("plan_total", "План_всего"),
+    "fact_total": ("fact_total", "Фактически_выполнено_всего"),
+}
+REQUIRED_COLUMNS = ("reg_number", "district_code", "year", "service_type")
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportFileError(ValueError):
+    """Файл не удалось прочитать (формат, заголовок)"""
+
+
+def _cell(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip()
+    return value or None
+
+
+def _map_header(header) -> dict:
+    """{колонка импорта: индекс в строке файла}"""
+    names = [_cell(name) for name in header]
+    positions = {}
+    for column, aliases in IMPORT_COLUMNS.items():
+        for alias in aliases:
+            if alias in names:
+                positions[column] = names.index(alias)
+                break
+    missing = [column for column in REQUIRED_COLUMNS if column not in positions]
+    if missing:
+        raise ImportFileError(f"В файле нет колонок: {', '.join(missing)}")
+    return positions
+
+
+def _read_table(rows):
+    """Строки файла -> [(номер строки, значения в порядке IMPORT_COLUMNS)]"""
+    rows = iter(rows)
+    try:
+        positions = _map_header(next(rows))
+    except StopIteration:
+        raise ImportFileError("Файл пуст")
+    result = []
+    for row_no, row in enumerate(rows, start=2):
+        values = [_cell(row[positions[column]]) if column in positions and positions[column] < len(row) else None
+                  for column in IMPORT_COLUMNS]
+        if any(values):
+            result.append((row_no, *values))
+    return result
+
+
+def read_csv(content: bytes):
+    text = content.decode("utf-8-sig")
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=";,\t")
+    except csv.Error:
+        dialect = csv.excel
+    return _read_table(csv.reader(io.StringIO(text), dialect))
+
+
+def read_xlsx(content: bytes):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportFileError("Для импорта XLSX установите пакет openpyxl")
+    workbook = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    try:
+        return _read_table(workbook.active.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+
+def read_import_file(filename: str, content: bytes):
+    if filename.lower().endswith(".xlsx"):
+        return read_xlsx(content)
+    if filename.lower().endswith((".csv", ".txt")):
+        return read_csv(content)
+    raise ImportFileError("Поддерживаются файлы .csv и .xlsx")
+
+
+def _copy_rows(cur, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cur.copy_expert("""
+        COPY services_import (row_no, reg_number, district_code, report_year, service_type,
+                              indicator_code, plan_total, fact_total)
+        FROM STDIN WITH (FORMAT csv)
+    """, buffer)
+
+
+def import_services(conn, rows, dry_run: bool = False) -> dict:
+    """
+    Проверяет и загружает строки в services одной транзакцией.
+    При ошибках в любой строке ничего не записывается, ошибки возвращаются по строкам.
+    """
+    cur = conn.cursor()
+
+    cur.execute("""
+        CREATE TEMP TABLE services_import (
+            row_no INTEGER, reg_number TEXT, district_code TEXT, report_year TEXT, service_type TEXT,
+            indicator_code TEXT, plan_total TEXT, fact_total TEXT
+        ) ON COMMIT DROP
+    """)
+    _copy_rows(cur, rows)
+
+    # Приведение типов (CASE — чтобы неверное число не обрывало запрос) и поиск ссылок
+    cur.execute(r"""
+        CREATE TEMP TABLE services_import_typed ON COMMIT DROP AS
+        SELECT t.*,
+               st.id AS service_type_id,
+               e."Регистрационный_номер" IS NOT NULL AS enterprise_found,
+               d."Код_области" AS region_code,
+               d."Код_района" IS NOT NULL AS district_found,
+               p.id IS NOT NULL AS period_found,
+               c."Отчетный_период" IS NOT NULL AS year_closed,
+               min(t.row_no) OVER (
+                   PARTITION BY t.reg_number, t.district_code, t.report_year, st.id
+               ) AS first_row_no
+        FROM (
+            SELECT i.row_no, i.service_type,
+                   CASE WHEN i.reg_number ~ '^\d{1,18}$' THEN i.reg_number::BIGINT END AS reg_number,
+                   CASE WHEN i.district_code ~ '^\d{1,9}$' THEN i.district_code::INTEGER END AS district_code,
+                   CASE WHEN i.report_year ~ '^\d{4}$' THEN i.report_year::INTEGER END AS report_year,
+                   CASE WHEN i.indicator_code ~ '^-?\d{1,9}$' THEN i.indicator_code::INTEGER END AS indicator_code,
+                   CASE WHEN i.plan_total ~ '^-?\d{1,18}$' THEN i.plan_total::BIGINT END AS plan_total,
+                   CASE WHEN i.fact_total ~ '^-?\d{1,18}$' THEN i.fact_total::BIGINT END AS fact_total,
+                   i.reg_number AS reg_number_raw, i.district_code AS district_code_raw,
+                   i.report_year AS report_year_raw, i.indicator_code AS indicator_code_raw,
+                   i.plan_total AS plan_total_raw, i.fact_total AS fact_total_raw
+            FROM services_import i
+        ) t
+        LEFT JOIN service_types st ON st."Наименование_вида_услуг" = t.service_type
+        LEFT JOIN enterprises e ON e."Регистрационный_номер" = t.reg_number
+        LEFT JOIN districts d ON d."Код_района" = t.district_code
+        LEFT JOIN period p ON p."Регистрационный_номер" = t.reg_number AND p."Отчетный_период" = t.report_year
+        LEFT JOIN closed_years c ON c."Отчетный_период" = t.report_year
+    """)
+
+    cur.execute("""
+        SELECT row_no, errors FROM (
+            SELECT row_no, array_remove(ARRAY[
+                CASE WHEN reg_number IS NULL THEN 'Неверный регистрационный номер'
+                     WHEN NOT enterprise_found THEN 'Предприятие не найдено' END,
+                CASE WHEN district_code IS NULL THEN 'Неверный код района'
+                     WHEN NOT district_found THEN 'Район не найден' END,
+                CASE WHEN report_year IS NULL THEN 'Неверный отчетный период'
+                     WHEN year_closed THEN 'Отчетный период закрыт для изменений'
+                     WHEN enterprise_found AND NOT period_found THEN 'У предприятия нет этого отчетного периода' END,
+                CASE WHEN service_type IS NULL THEN 'Не указан вид услуги'
+                     WHEN service_type_id IS NULL THEN 'Вид услуги не найден' END,
+                CASE WHEN indicator_code_raw IS NOT NULL AND indicator_code IS NULL THEN 'Неверный код показателя' END,
+                CASE WHEN plan_total_raw IS NOT NULL AND plan_total IS NULL THEN 'Неверное значение плана' END,
+                CASE WHEN fact_total_raw IS NOT NULL AND fact_total IS NULL THEN 'Неверное значение факта' END,
+                CASE WHEN service_type_id IS NOT NULL AND row_no <> first_row_no
+                     THEN 'Повтор строки ' || first_row_no END
+            ], NULL) AS errors
+            FROM services_import_typed
+        ) checked
+        WHERE cardinality(errors) > 0
+        ORDER BY row_no
+    """)
+    invalid_rows = cur.fetchall()
+    errors = [{"row": row_no, "error": "; ".join(messages)} for row_no, messages in invalid_rows]
+    result = {
+        "rows": len(rows),
+        "error_count": len(errors),
+        "errors": errors[:MAX_REPORTED_ERRORS],
+        "inserted": 0,
+        "updated": 0
+    }
+    if errors or dry_run:
+        conn.rollback()
+        return result
+
+    cur.execute("""
+        SELECT ensure_services_partition(report_year)
+        FROM (SELECT DISTINCT report_year FROM services_import_typed) years
+    """)
+    cur.execute("""
+        INSERT INTO services AS s
+            ("Регистрационный_номер", "Код_района", "Код_области", "Отчетный_период",
+             "Код_вида_услуг", "Код_показателя", "План_всего", "Фактически_выполнено_всего")
+        SELECT reg_number, district_code, region_code, report_year,
+               service_type_id, indicator_code, plan_total, fact_total
+        FROM services_import_typed
+        ORDER BY row_no
+        ON CONFLICT ("Регистрационный_номер", "Код_района", "Отчетный_период", "Код_вида_услуг")
+        DO UPDATE SET
+            "Код_показателя" = EXCLUDED."Код_показателя",
+            "План_всего" = EXCLUDED."План_всего",
+            "Фактически_выполнено_всего" = EXCLUDED."Фактически_выполнено_всего"
+        RETURNING xmax = 0
+    """)
+    inserted_flags = [row[0] for row in cur.fetchall()]
+    conn.commit()
+
+    result["inserted"] = sum(inserted_flags)
+    result["updated"] = len(inserted_flags) - result["inserted"]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Массовый импорт услуг из CSV/XLSX")
+    parser.add_argument("file", help="файл .csv или .xlsx")
+    parser.add_argument("--dry-run", action="store_true", help="только проверить строки, ничего не записывать")
+    args = parser.parse_args()
+
+    from app.database import main_db_connection
+    from app.cube_refresh import refresh_services_cube
+    from app.main import invalidate_indicator_codes
+
+    try:
+        with open(args.file, "rb") as file:
+            rows = read_import_file(args.file, file.read())
+    except (OSError, ImportFileError) as error:
+        print(f"❌ {error}")
+        return 1
+
+    with main_db_connection() as conn:
+        if conn is None:
+            print("❌ Ошибка подключения к БД")
+            return 1
+        result = import_services(conn, rows, dry_run=args.dry_run)
+        if result["inserted"] or result["updated"]:
+            invalidate_indicator_codes()
+            refresh_services_cube(conn)
+
+    for error in result["errors"]:
+        print(f"    строка {error['row']}: {error['error']}")
+    if result["error_count"]:
+        print(f"❌ Ошибок: {result['error_count']} из {result['rows']} строк, ничего не записано")
+        return 1
+    if args.dry_run:
+        print(f"✅ Проверено строк: {result['rows']}, ошибок нет")
+    else:
+        print(f"✅ Добавлено: {result['inserted']}, обновлено: {result['updated']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных вычислений: пока вычисление по ключу
+    выполняется, остальные запросы с тем же ключом ждут его результат, а не
+    запускают своё. Работает в event loop процесса, поэтому блокировки не нужны.
+    """
+
+    def __init__(self):
+        self._in_flight = {}  # {ключ: asyncio.Task}
+        self.stats = {"executed": 0, "shared": 0, "failed": 0}
+
+    def _forget(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled() and task.exception() is not None:
+            self.stats["failed"] += 1
+
+    async def do(self, key, func):
+        """Возвращает результат await func() — общий для всех одновременных вызовов с этим ключом"""
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.stats["executed"] += 1
+        else:
+            self.stats["shared"] += 1
+        # shield: отмена одного ожидающего (клиент ушёл) не прерывает вычисление для остальных
+        return await asyncio.shield(task)
+
+    def get_stats(self) -> dict:
+        return {"in_flight": len(self._in_flight), **self.stats}
+
+
+report_single_flight = SingleFlight()
+
+
+def get_single_flight_stats() -> dict:
+    return report_single_flight.get_stats()
@@ -0,0 +1,102 @@
+"""
+Проверка планов отчетных запросов: каждый запрос к services / services_cube
+должен читать данные по индексу, а не последовательным сканированием.
+
+Скрипт заполняет схему бенчмарка (см. benchmarks.round_trips), выполняет
+обработчики отчетов и перед каждым SELECT запрашивает EXPLAIN (FORMAT JSON).
+Последовательное сканирование отключено (enable_seqscan = off), поэтому
+Seq Scan в плане означает, что для запроса нет подходящего индекса.
+
+Запуск из каталога Practise_make_perfect (нужна доступная основная БД):
+    python -m benchmarks.explain_indexes
+    python -m benchmarks.explain_indexes --scenario district_summary --verbose
+"""
+import argparse
+import json
+import sys
+
+from psycopg2 import extensions
+
+from app import database
+from benchmarks.round_trips import BENCH_SCHEMA, SCENARIOS, drop_schema, seed
+
+# Таблицы фактов, которые нельзя читать целиком
+CHECKED_RELATIONS = {"services", "services_cube"}
+
+plans = []
+
+
+class ExplainingCursor(extensions.cursor):
+    """Курсор, сохраняющий план каждого SELECT перед его выполнением"""
+
+    def execute(self, query, vars=None):
+        text = query.lstrip().upper() if isinstance(query, str) else ""
+        if text.startswith("SELECT") or text.startswith("WITH"):
+            super().execute("EXPLAIN (FORMAT JSON) " + query, vars)
+            plans.append((query, self.fetchone()[0][0]["Plan"]))
+        return super().execute(query, vars)
+
+
+def walk(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from walk(child)
+
+
+def check_scenario(name: str, verbose: bool):
+    """Выполняет сценарий и возвращает (использованные индексы, запросы с Seq Scan)"""
+    plans.clear()
+    response = SCENARIOS[name]()
+    if not json.loads(response.body).get("success", False):
+        print(f"⚠️ {name}: обработчик вернул ошибку")
+
+    used_indexes = set()
+    seq_scans = []
+    for query, plan in plans:
+        for node in walk(plan):
+            relation = node.get("Relation Name")
+            if node.get("Index Name"):
+                used_indexes.add(node["Index Name"])
+            if node["Node Type"] == "Seq Scan" and relation in CHECKED_RELATIONS:
+                seq_scans.append((relation, " ".join(query.split())[:160]))
+        if verbose:
+            print(json.dumps(plan, ensure_ascii=False, indent=2))
+    return used_indexes, seq_scans
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка использования индексов отчетными запросами")
+    parser.add_argument("--size", type=int, default=1000, help="количество предприятий в синтетических данных")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), nargs="+", default=sorted(SCENARIOS))
+    parser.add_argument("--verbose", action="store_true", help="печатать планы целиком")
+    parser.add_argument("--keep", action="store_true", help="не удалять схему бенчмарка")
+    args = parser.parse_args()
+
+    database.main_db_pool.db_config = {
+        **database.MAIN_DB_CONFIG,
+        "cursor_factory": ExplainingCursor,
+        "options": f"-c search_path={BENCH_SCHEMA} -c enable_seqscan=off"
+    }
+
+    failed = False
+    try:
+        seed(args.size)
+        for name in args.scenario:
+            used_indexes, seq_scans = check_scenario(name, args.verbose)
+            status = "ok" if not seq_scans else "SEQ SCAN"
+            print(f"{name:<28} {status:<9} индексы: {', '.join(sorted(used_indexes)) or '-'}")
+            for relation, query in seq_scans:
+                failed = True
+                print(f"    ❌ {relation}: {query}")
+    finally:
+        database.close_all_pools()
+        if not args.keep:
+            drop_schema()
+
+    if not failed:
+        print("✅ Все запросы к services/services_cube используют индексы")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""
+Замер количества обращений к БД (round-trips) у отчётных эндпоинтов.
+
+Скрипт создаёт отдельную схему с синтетическими данными нужного объёма,
+направляет туда пул соединений через search_path и считает вызовы
+cursor.execute() внутри обработчика. Число обращений не должно зависеть
+от количества предприятий.
+
+Запуск из каталога Practise_make_perfect (нужна доступная основная БД):
+    python -m benchmarks.round_trips --sizes 10 100 1000
+    python -m benchmarks.round_trips --scenario enterprises
+"""
+import argparse
+import json
+import sys
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+from app import database
+
+BENCH_SCHEMA = "bench_round_trips"
+BENCH_YEAR = 2024
+BENCH_DISTRICT = 1
+BENCH_REGION = 1
+
+SERVICE_CATEGORIES = [
+    "Услуги транспорта - всего",
+    "Услуги транспорта, в т.ч. в сельской местности",
+    "Услуги связи - всего",
+    "Услуги связи, в т.ч. в сельской местности",
+    "Услуги жилищного хозяйства - всего",
+    "Услуги жилищного хозяйства, в т.ч. в сельской местности",
+    "Услуги культуры - всего",
+    "Услуги культуры, в т.ч. в сельской местности",
+    "Прочие услуги - всего",
+    "Прочие услуги, в т.ч. в сельской местности"
+]
+
+executed_queries = 0
+
+
+class CountingCursor(extensions.cursor):
+    """Курсор, считающий каждое обращение к серверу"""
+
+    def execute(self, query, vars=None):
+        global executed_queries
+        executed_queries += 1
+        return super().execute(query, vars)
+
+
+def seed(enterprises_count: int):
+    """Пересоздаёт схему бенчмарка и заполняет её синтетическими данными"""
+    conn = psycopg2.connect(**database.MAIN_DB_CONFIG)
+    try:
+        cur = conn.cursor()
+        # Определение куба агрегатов и его индексы берём из основной схемы
+        cur.execute("SELECT definition FROM pg_matviews WHERE schemaname = 'public' AND matviewname = 'services_cube'")
+        cube_definition = cur.fetchone()[0]
+        cur.execute("SELECT indexdef FROM pg_indexes WHERE schemaname = 'public' AND tablename = 'services_cube'")
+        cube_indexes = [row[0].replace(" ON public.", f" ON {BENCH_SCHEMA}.") for row in cur.fetchall()]
+
+        cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        cur.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+        for table in ("service_types", "ministries", "industries", "regions", "districts",
+                      "enterprises", "period", "services"):
+            cur.execute(f"CREATE TABLE {BENCH_SCHEMA}.{table} (LIKE public.{table} INCLUDING INDEXES)")
+
+        cur.execute(f"SET search_path TO {BENCH_SCHEMA}")
+        cur.execute('INSERT INTO regions (id, "Код_области", "Наименование_области") VALUES (1, %s, %s)',
+                    (BENCH_REGION, "Тестовая область"))
+        cur.execute("""
+            INSERT INTO districts (id, "Код_района", "Наименование_района", "Код_области")
+            VALUES (1, %s, %s, %s)
+        """, (BENCH_DISTRICT, "Тестовый район", BENCH_REGION))
+        for i, name in enumerate(SERVICE_CATEGORIES, 1):
+            cur.execute("""
+                INSERT INTO service_types (id, "Наименование_вида_услуг", "Сельская_местность", "Порядок")
+                VALUES (%s, %s, %s, %s)
+            """, (i, name, "в т.ч. в сельской местности" in name, i))
+
+        cur.execute("""
+            INSERT INTO enterprises (id, "Наименование_предприятия", "Регистрационный_номер", "Код_области")
+            SELECT n, 'Предприятие ' || n, 100000 + n, %s
+            FROM generate_series(1, %s) AS n
+        """, (BENCH_REGION, enterprises_count))
+        cur.execute("""
+            INSERT INTO period (id, "Регистрационный_номер", "Отчетный_период", "ФИО_директора")
+            SELECT row_number() OVER (), 100000 + n, y, 'Директор ' || n
+            FROM generate_series(1, %s) AS n, (VALUES (%s - 1), (%s)) AS years(y)
+        """, (enterprises_count, BENCH_YEAR, BENCH_YEAR))
+        cur.execute("""
+            INSERT INTO services (id, "Регистрационный_номер", "Код_района", "Код_области",
+                                  "Отчетный_период", "Код_вида_услуг", "Код_показателя",
+                                  "План_всего", "Фактически_выполнено_всего")
+            SELECT row_number() OVER (), 100000 + n, %s, %s, y, st.id, st.id,
+                   1000 + n, 900 + n
+            FROM generate_series(1, %s) AS n,
+                 (VALUES (%s - 1), (%s)) AS years(y),
+                 service_types st
+        """, (BENCH_DISTRICT, BENCH_REGION, enterprises_count, BENCH_YEAR, BENCH_YEAR))
+        cur.execute(f"CREATE MATERIALIZED VIEW services_cube AS {cube_definition}")
+        for index_sql in cube_indexes:
+            cur.execute(index_sql)
+        cur.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def drop_schema():
+    conn = psycopg2.connect(**database.MAIN_DB_CONFIG)
+    try:
+        conn.cursor().execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def scenario_enterprises():
+    from app.main import get_enterprises_with_stats
+    return get_enterprises_with_stats()
+
+
+def scenario_enterprise_periods():
+    from app.main import get_enterprise_periods
+    return get_enterprise_periods(100001)
+
+
+def scenario_enterprise_regions():
+    from app.main import get_enterprise_regions
+    return get_enterprise_regions(100001, BENCH_YEAR)
+
+
+def scenario_district_summary():
+    from app.main import get_district_period_summary
+    return get_district_period_summary(BENCH_DISTRICT, BENCH_YEAR)
+
+
+def scenario_filtered_report():
+    from app.main import get_filtered_report, invalidate_indicator_codes
+    # Данные пересоздаются для каждого объёма — сбрасываем кэш кодов показателей
+    invalidate_indicator_codes()
+    return get_filtered_report(100001, BENCH_YEAR, BENCH_YEAR, f"district_{BENCH_DISTRICT}", "district")
+
+
+def scenario_combined_reports():
+    from fastapi.responses import JSONResponse
+    from app.main import build_district_final_reports
+    with database.main_db_connection() as conn:
+        district_info, reports = build_district_final_reports(conn.cursor(), BENCH_DISTRICT, BENCH_YEAR)
+    return JSONResponse(content={"success": district_info is not None, "reports": len(reports)})
+
+
+def scenario_combined_filtered_reports():
+    from fastapi.responses import JSONResponse
+    from app.main import build_filtered_reports, invalidate_indicator_codes
+    invalidate_indicator_codes()
+    with database.main_db_connection() as conn:
+        reports = build_filtered_reports(conn.cursor(), f"region_{BENCH_REGION}", "region",
+                                         BENCH_YEAR - 1, BENCH_YEAR)
+    return JSONResponse(content={"success": reports is not None})
+
+
+def scenario_admin_services():
+    from app.main import get_admin_services
+    first_page = get_admin_services(year=BENCH_YEAR, sort="enterprise", order="asc")
+    next_cursor = json.loads(first_page.body)["next_cursor"]
+    return get_admin_services(year=BENCH_YEAR, sort="enterprise", order="asc", cursor=next_cursor)
+
+
+SCENARIOS = {
+    "enterprises": scenario_enterprises,
+    "enterprise_periods": scenario_enterprise_periods,
+    "enterprise_regions": scenario_enterprise_regions,
+    "district_summary": scenario_district_summary,
+    "filtered_report": scenario_filtered_report,
+    "combined_reports": scenario_combined_reports,
+    "combined_filtered_reports": scenario_combined_filtered_reports,
+    "admin_services": scenario_admin_services,
+}
+
+
+def run_scenario(name: str):
+    """Выполняет обработчик и возвращает (число запросов, время в мс, успех)"""
+    global executed_queries
+    executed_queries = 0
+    started = time.perf_counter()
+    response = SCENARIOS[name]()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    success = json.loads(response.body).get("success", False)
+    return executed_queries, elapsed_ms, success
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер round-trips отчётных эндпоинтов")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000],
+                        help="количество предприятий в синтетических данных")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), nargs="+", default=sorted(SCENARIOS))
+    parser.add_argument("--keep", action="store_true", help="не удалять схему бенчмарка")
+    args = parser.parse_args()
+
+    # Все соединения пула смотрят в схему бенчмарка и считают запросы
+    database.main_db_pool.db_config = {
+        **database.MAIN_DB_CONFIG,
+        "cursor_factory": CountingCursor,
+        "options": f"-c search_path={BENCH_SCHEMA}"
+    }
+
+    results = {name: [] for name in args.scenario}
+    try:
+        for size in args.sizes:
+            seed(size)
+            for name in args.scenario:
+                queries, elapsed_ms, success = run_scenario(name)
+                results[name].append(queries)
+                status = "ok" if success else "ОШИБКА"
+                print(f"{name:<24} предприятий={size:<7} запросов={queries:<5} {elapsed_ms:9.1f} мс  {status}")
+    finally:
+        database.close_all_pools()
+        if not args.keep:
+            drop_schema()
+
+    # O(1): число запросов одинаково для любого объёма данных
+    failed = [name for name, counts in results.items() if len(set(counts)) > 1]
+    for name in failed:
+        print(f"❌ {name}: число запросов растёт вместе с данными {results[name]}")
+    if not failed:
+        print("✅ Число запросов не зависит от количества предприятий")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
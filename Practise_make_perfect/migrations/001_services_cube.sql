@@ -0,0 +1,29 @@
+-- Куб агрегатов services_cube для существующей основной БД
+-- (новые базы создаются по scripts.sql)
+BEGIN;
+-- Куб агрегатов план/факт: предприятие × район × область × год × вид услуги.
+-- Отчеты читают суммы отсюда, а не из services; обновляется после изменений через админку
+-- (REFRESH MATERIALIZED VIEW CONCURRENTLY services_cube)
+CREATE MATERIALIZED VIEW IF NOT EXISTS services_cube AS
+SELECT
+    s."Регистрационный_номер",
+    s."Код_района",
+    d."Код_области",
+    s."Отчетный_период",
+    s."Наименование_вида_услуг",
+    s."Наименование_вида_услуг" LIKE '%в т.ч. в сельской местности%' AS "Сельская_местность",
+    COALESCE(SUM(s."План_всего"), 0) AS "План_всего",
+    COALESCE(SUM(s."Фактически_выполнено_всего"), 0) AS "Фактически_выполнено_всего",
+    COUNT(*) AS "Количество_записей"
+FROM services s
+LEFT JOIN districts d ON d."Код_района" = s."Код_района"
+GROUP BY s."Регистрационный_номер", s."Код_района", d."Код_области",
+         s."Отчетный_период", s."Наименование_вида_услуг";
+
+-- Уникальный индекс нужен для REFRESH ... CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS idx_services_cube_key ON services_cube(
+    "Регистрационный_номер", "Код_района", "Отчетный_период", "Наименование_вида_услуг"
+);
+CREATE INDEX IF NOT EXISTS idx_services_cube_district_year ON services_cube("Код_района", "Отчетный_период");
+CREATE INDEX IF NOT EXISTS idx_services_cube_region_year ON services_cube("Код_области", "Отчетный_период");
+COMMIT;
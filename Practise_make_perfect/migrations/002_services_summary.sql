@@ -0,0 +1,98 @@
+-- Сводные итоги services_summary для существующей основной БД
+-- (новые базы создаются по scripts.sql). Таблица заполняется по текущим данным;
+-- services блокируется на время миграции, чтобы итоги не разошлись с триггером
+BEGIN;
+LOCK TABLE services IN SHARE ROW EXCLUSIVE MODE;
+
+-- Сводные итоги по услугам для главной страницы и дашборда:
+-- общий итог (срез 'global', ключ ''), по виду услуг, по области и по году.
+-- Поддерживаются триггером на services в той же транзакции, что и изменение услуги
+CREATE TABLE IF NOT EXISTS services_summary (
+    "Срез" VARCHAR(20) NOT NULL,
+    "Ключ" VARCHAR(250) NOT NULL,
+    "План_всего" BIGINT NOT NULL DEFAULT 0,
+    "Фактически_выполнено_всего" BIGINT NOT NULL DEFAULT 0,
+    "План_село" BIGINT NOT NULL DEFAULT 0,
+    "Факт_село" BIGINT NOT NULL DEFAULT 0,
+    "Количество_записей" BIGINT NOT NULL DEFAULT 0,
+
+    PRIMARY KEY ("Срез", "Ключ"),
+    CONSTRAINT valid_summary_scope CHECK ("Срез" IN ('global', 'service_type', 'region', 'year'))
+);
+
+-- Добавляет (sign = 1) или вычитает (sign = -1) строку услуги из всех срезов
+CREATE OR REPLACE FUNCTION services_summary_apply(s services, sign INTEGER) RETURNS VOID AS $$
+DECLARE
+    plan_value BIGINT := sign * COALESCE(s."План_всего", 0);
+    fact_value BIGINT := sign * COALESCE(s."Фактически_выполнено_всего", 0);
+    is_rural BOOLEAN := s."Наименование_вида_услуг" LIKE '%в т.ч. в сельской местности%';
+    region_code INTEGER;
+BEGIN
+    SELECT d."Код_области" INTO region_code FROM districts d WHERE d."Код_района" = s."Код_района";
+
+    INSERT INTO services_summary AS t
+        ("Срез", "Ключ", "План_всего", "Фактически_выполнено_всего", "План_село", "Факт_село", "Количество_записей")
+    SELECT scope, key,
+           plan_value, fact_value,
+           CASE WHEN is_rural THEN plan_value ELSE 0 END,
+           CASE WHEN is_rural THEN fact_value ELSE 0 END,
+           sign
+    FROM (VALUES
+        ('global', ''),
+        ('service_type', s."Наименование_вида_услуг"),
+        ('region', region_code::TEXT),
+        ('year', s."Отчетный_период"::TEXT)
+    ) AS scopes(scope, key)
+    WHERE key IS NOT NULL
+    ON CONFLICT ("Срез", "Ключ") DO UPDATE SET
+        "План_всего" = t."План_всего" + EXCLUDED."План_всего",
+        "Фактически_выполнено_всего" = t."Фактически_выполнено_всего" + EXCLUDED."Фактически_выполнено_всего",
+        "План_село" = t."План_село" + EXCLUDED."План_село",
+        "Факт_село" = t."Факт_село" + EXCLUDED."Факт_село",
+        "Количество_записей" = t."Количество_записей" + EXCLUDED."Количество_записей";
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION services_summary_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM services_summary_apply(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM services_summary_apply(NEW, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_services_summary ON services;
+CREATE TRIGGER trg_services_summary
+AFTER INSERT OR UPDATE OR DELETE ON services
+FOR EACH ROW EXECUTE FUNCTION services_summary_trigger();
+
+DELETE FROM services_summary;
+INSERT INTO services_summary
+    ("Срез", "Ключ", "План_всего", "Фактически_выполнено_всего", "План_село", "Факт_село", "Количество_записей")
+SELECT scope, key,
+       SUM(plan_value), SUM(fact_value),
+       COALESCE(SUM(plan_value) FILTER (WHERE is_rural), 0),
+       COALESCE(SUM(fact_value) FILTER (WHERE is_rural), 0),
+       COUNT(*)
+FROM (
+    SELECT COALESCE(s."План_всего", 0) AS plan_value,
+           COALESCE(s."Фактически_выполнено_всего", 0) AS fact_value,
+           s."Наименование_вида_услуг" LIKE '%в т.ч. в сельской местности%' AS is_rural,
+           scopes.scope, scopes.key
+    FROM services s
+    LEFT JOIN districts d ON d."Код_района" = s."Код_района"
+    CROSS JOIN LATERAL (VALUES
+        ('global', ''),
+        ('service_type', s."Наименование_вида_услуг"),
+        ('region', d."Код_области"::TEXT),
+        ('year', s."Отчетный_период"::TEXT)
+    ) AS scopes(scope, key)
+    WHERE scopes.key IS NOT NULL
+) rows
+GROUP BY scope, key;
+
+COMMIT;
@@ -0,0 +1,133 @@
+-- services ссылается на service_types по SMALLINT-коду вместо наименования,
+-- у видов услуг появляются признак сельской местности и порядок вывода.
+-- Применяется после 001_services_cube.sql и 002_services_summary.sql
+BEGIN;
+
+-- 1. Справочник видов услуг
+ALTER TABLE service_types ALTER COLUMN id TYPE SMALLINT;
+ALTER SEQUENCE service_types_id_seq AS SMALLINT;
+ALTER TABLE service_types
+    ADD COLUMN IF NOT EXISTS "Сельская_местность" BOOLEAN NOT NULL DEFAULT FALSE,
+    ADD COLUMN IF NOT EXISTS "Порядок" SMALLINT NOT NULL DEFAULT 0;
+
+UPDATE service_types
+SET "Сельская_местность" = "Наименование_вида_услуг" LIKE '%в т.ч. в сельской местности%';
+
+UPDATE service_types st
+SET "Порядок" = o.position
+FROM (VALUES
+    ('Услуги транспорта - всего', 1),
+    ('Услуги транспорта, в т.ч. в сельской местности', 2),
+    ('Услуги связи - всего', 3),
+    ('Услуги связи, в т.ч. в сельской местности', 4),
+    ('Услуги жилищного хозяйства - всего', 5),
+    ('Услуги жилищного хозяйства, в т.ч. в сельской местности', 6),
+    ('Услуги культуры - всего', 7),
+    ('Услуги культуры, в т.ч. в сельской местности', 8),
+    ('Прочие услуги - всего', 9),
+    ('Прочие услуги, в т.ч. в сельской местности', 10)
+) AS o(name, position)
+WHERE st."Наименование_вида_услуг" = o.name;
+
+-- 2. Куб и триггер итогов зависят от старой колонки — пересоздаются ниже
+DROP MATERIALIZED VIEW IF EXISTS services_cube;
+DROP TRIGGER IF EXISTS trg_services_summary ON services;
+
+-- 3. Код вида услуги в services
+ALTER TABLE services ADD COLUMN "Код_вида_услуг" SMALLINT;
+
+UPDATE services s
+SET "Код_вида_услуг" = st.id
+FROM service_types st
+WHERE st."Наименование_вида_услуг" = s."Наименование_вида_услуг";
+
+ALTER TABLE services ALTER COLUMN "Код_вида_услуг" SET NOT NULL;
+ALTER TABLE services ADD FOREIGN KEY ("Код_вида_услуг") REFERENCES service_types(id);
+
+-- Внешний ключ и индекс по наименованию удаляются вместе с колонкой
+DROP INDEX IF EXISTS idx_services_service_type;
+ALTER TABLE services DROP COLUMN "Наименование_вида_услуг";
+CREATE INDEX idx_services_service_type ON services("Код_вида_услуг");
+
+-- 4. Куб агрегатов
+CREATE MATERIALIZED VIEW services_cube AS
+SELECT
+    s."Регистрационный_номер",
+    s."Код_района",
+    d."Код_области",
+    s."Отчетный_период",
+    s."Код_вида_услуг",
+    st."Сельская_местность",
+    COALESCE(SUM(s."План_всего"), 0) AS "План_всего",
+    COALESCE(SUM(s."Фактически_выполнено_всего"), 0) AS "Фактически_выполнено_всего",
+    COUNT(*) AS "Количество_записей"
+FROM services s
+JOIN service_types st ON st.id = s."Код_вида_услуг"
+LEFT JOIN districts d ON d."Код_района" = s."Код_района"
+GROUP BY s."Регистрационный_номер", s."Код_района", d."Код_области",
+         s."Отчетный_период", s."Код_вида_услуг", st."Сельская_местность";
+
+-- Уникальный индекс нужен для REFRESH ... CONCURRENTLY
+CREATE UNIQUE INDEX idx_services_cube_key ON services_cube(
+    "Регистрационный_номер", "Код_района", "Отчетный_период", "Код_вида_услуг"
+);
+CREATE INDEX idx_services_cube_district_year ON services_cube("Код_района", "Отчетный_период");
+CREATE INDEX idx_services_cube_region_year ON services_cube("Код_области", "Отчетный_период");
+
+-- 5. Триггер сводных итогов (ключ среза service_type остаётся наименованием)
+-- Добавляет (sign = 1) или вычитает (sign = -1) строку услуги из всех срезов
+CREATE OR REPLACE FUNCTION services_summary_apply(s services, sign INTEGER) RETURNS VOID AS $$
+DECLARE
+    plan_value BIGINT := sign * COALESCE(s."План_всего", 0);
+    fact_value BIGINT := sign * COALESCE(s."Фактически_выполнено_всего", 0);
+    service_name VARCHAR(50);
+    is_rural BOOLEAN;
+    region_code INTEGER;
+BEGIN
+    SELECT st."Наименование_вида_услуг", st."Сельская_местность" INTO service_name, is_rural
+    FROM service_types st WHERE st.id = s."Код_вида_услуг";
+    SELECT d."Код_области" INTO region_code FROM districts d WHERE d."Код_района" = s."Код_района";
+
+    INSERT INTO services_summary AS t
+        ("Срез", "Ключ", "План_всего", "Фактически_выполнено_всего", "План_село", "Факт_село", "Количество_записей")
+    SELECT scope, key,
+           plan_value, fact_value,
+           CASE WHEN is_rural THEN plan_value ELSE 0 END,
+           CASE WHEN is_rural THEN fact_value ELSE 0 END,
+           sign
+    FROM (VALUES
+        ('global', ''),
+        ('service_type', service_name),
+        ('region', region_code::TEXT),
+        ('year', s."Отчетный_период"::TEXT)
+    ) AS scopes(scope, key)
+    WHERE key IS NOT NULL
+    ON CONFLICT ("Срез", "Ключ") DO UPDATE SET
+        "План_всего" = t."План_всего" + EXCLUDED."План_всего",
+        "Фактически_выполнено_всего" = t."Фактически_выполнено_всего" + EXCLUDED."Фактически_выполнено_всего",
+        "План_село" = t."План_село" + EXCLUDED."План_село",
+        "Факт_село" = t."Факт_село" + EXCLUDED."Факт_село",
+        "Количество_записей" = t."Количество_записей" + EXCLUDED."Количество_записей";
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION services_summary_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM services_summary_apply(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM services_summary_apply(NEW, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_services_summary
+AFTER INSERT OR UPDATE OR DELETE ON services
+FOR EACH ROW EXECUTE FUNCTION services_summary_trigger();
+
+COMMIT;
+
+-- Место, освобождённое удалённой колонкой, возвращается после
+-- VACUUM FULL services; (вне транзакции, блокирует таблицу)
@@ -0,0 +1,36 @@
+-- Составные покрывающие индексы для отчетов (см. scripts.sql).
+-- Выполнять вне транзакции: CONCURRENTLY не блокирует запись в services.
+-- Применяется после 003_service_type_codes.sql; проверка планов —
+-- python -m benchmarks.explain_indexes
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_services_reg_year_district
+    ON services("Регистрационный_номер", "Отчетный_период", "Код_района")
+    INCLUDE ("Код_вида_услуг", "Код_показателя", "План_всего", "Фактически_выполнено_всего");
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_services_district_year
+    ON services("Код_района", "Отчетный_период")
+    INCLUDE ("Регистрационный_номер", "Код_вида_услуг", "Код_показателя", "План_всего", "Фактически_выполнено_всего");
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_period_reg_year
+    ON period("Регистрационный_номер", "Отчетный_период")
+    INCLUDE ("ФИО_директора");
+
+-- Одноколоночные индексы, ставшие префиксами составных
+DROP INDEX CONCURRENTLY IF EXISTS idx_services_reg_number;
+DROP INDEX CONCURRENTLY IF EXISTS idx_services_district;
+DROP INDEX CONCURRENTLY IF EXISTS idx_period_reg_number;
+
+-- Индексы куба агрегатов с INCLUDE-колонками
+DROP INDEX CONCURRENTLY IF EXISTS idx_services_cube_district_year;
+DROP INDEX CONCURRENTLY IF EXISTS idx_services_cube_region_year;
+CREATE INDEX CONCURRENTLY idx_services_cube_district_year ON services_cube("Код_района", "Отчетный_период")
+    INCLUDE ("Регистрационный_номер", "Код_вида_услуг", "Сельская_местность",
+             "План_всего", "Фактически_выполнено_всего", "Количество_записей");
+CREATE INDEX CONCURRENTLY idx_services_cube_region_year ON services_cube("Код_области", "Отчетный_период")
+    INCLUDE ("Регистрационный_номер", "Код_района", "Код_вида_услуг", "Сельская_местность",
+             "План_всего", "Фактически_выполнено_всего", "Количество_записей");
+
+-- Index-only scan требует актуальной карты видимости
+VACUUM ANALYZE services;
+VACUUM ANALYZE period;
+ANALYZE services_cube;
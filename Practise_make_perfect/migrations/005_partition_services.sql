@@ -0,0 +1,180 @@
+-- Секционирование services по отчетному году (RANGE по "Отчетный_период").
+-- Таблица пересоздаётся: данные копируются в секции services_y<год>, последовательность
+-- id сохраняется. Применяется после 004_report_indexes.sql, services блокируется на
+-- время миграции. Сводные итоги services_summary не меняются (строки те же).
+BEGIN;
+LOCK TABLE services IN ACCESS EXCLUSIVE MODE;
+
+-- Куб и триггер итогов ссылаются на старую таблицу
+DROP MATERIALIZED VIEW IF EXISTS services_cube;
+DROP TRIGGER IF EXISTS trg_services_summary ON services;
+DROP FUNCTION IF EXISTS services_summary_apply(services, INTEGER);
+
+ALTER TABLE services RENAME TO services_unpartitioned;
+ALTER TABLE services_unpartitioned RENAME CONSTRAINT services_pkey TO services_unpartitioned_pkey;
+ALTER INDEX IF EXISTS idx_services_reg_year_district RENAME TO idx_services_unpartitioned_reg_year_district;
+ALTER INDEX IF EXISTS idx_services_district_year RENAME TO idx_services_unpartitioned_district_year;
+ALTER INDEX IF EXISTS idx_services_period RENAME TO idx_services_unpartitioned_period;
+ALTER INDEX IF EXISTS idx_services_service_type RENAME TO idx_services_unpartitioned_service_type;
+
+-- Строки без отчетного года в секционированную таблицу не попадают
+DO $$
+DECLARE
+    orphan_rows BIGINT;
+BEGIN
+    SELECT COUNT(*) INTO orphan_rows FROM services_unpartitioned WHERE "Отчетный_период" IS NULL;
+    IF orphan_rows > 0 THEN
+        RAISE EXCEPTION 'В services % строк без отчетного года — заполните "Отчетный_период" перед миграцией', orphan_rows;
+    END IF;
+END;
+$$;
+
+CREATE TABLE services (
+    id INTEGER NOT NULL,  -- последовательность services_id_seq переносится со старой таблицы
+    "Регистрационный_номер" BIGINT NOT NULL,
+    "Код_района" INTEGER,
+    "Отчетный_период" INTEGER NOT NULL,
+    "Код_вида_услуг" SMALLINT NOT NULL,
+    "Код_показателя" INTEGER,
+    "План_всего" BIGINT,
+    "Фактически_выполнено_всего" BIGINT,
+    
+    FOREIGN KEY ("Регистрационный_номер") REFERENCES enterprises("Регистрационный_номер") ON DELETE CASCADE,
+    FOREIGN KEY ("Код_района") REFERENCES districts("Код_района"),
+    FOREIGN KEY ("Регистрационный_номер", "Отчетный_период") REFERENCES period("Регистрационный_номер", "Отчетный_период"),
+    FOREIGN KEY ("Код_вида_услуг") REFERENCES service_types(id),
+    PRIMARY KEY (id, "Отчетный_период")
+) PARTITION BY RANGE ("Отчетный_период");
+
+-- Создаёт секцию services за год, если её ещё нет
+CREATE OR REPLACE FUNCTION ensure_services_partition(report_year INTEGER) RETURNS VOID AS $$
+DECLARE
+    partition_name TEXT := 'services_y' || report_year;
+BEGIN
+    IF to_regclass(partition_name) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF services FOR VALUES FROM (%s) TO (%s)',
+            partition_name, report_year, report_year + 1
+        );
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_services_partition(year)
+FROM (SELECT DISTINCT "Отчетный_период" AS year FROM services_unpartitioned) years;
+
+INSERT INTO services
+SELECT id, "Регистрационный_номер", "Код_района", "Отчетный_период", "Код_вида_услуг",
+       "Код_показателя", "План_всего", "Фактически_выполнено_всего"
+FROM services_unpartitioned;
+
+ALTER TABLE services ALTER COLUMN id SET DEFAULT nextval('services_id_seq');
+ALTER SEQUENCE services_id_seq OWNED BY services.id;
+DROP TABLE services_unpartitioned;
+
+-- Индексы создаются на родительской таблице и наследуются секциями
+-- Отчеты по предприятию: предприятие (+ год, + район) — периоды, области, районы, бланк № ПУ
+CREATE INDEX idx_services_reg_year_district ON services("Регистрационный_номер", "Отчетный_период", "Код_района")
+    INCLUDE ("Код_вида_услуг", "Код_показателя", "План_всего", "Фактически_выполнено_всего");
+
+-- Отчеты по району: район + год — сводка района, пакетные бланки, услуги района
+CREATE INDEX idx_services_district_year ON services("Код_района", "Отчетный_период")
+    INCLUDE ("Регистрационный_номер", "Код_вида_услуг", "Код_показателя", "План_всего", "Фактически_выполнено_всего");
+
+-- Для фильтрации услуг по периоду
+CREATE INDEX idx_services_period ON services("Отчетный_период");
+
+-- Для поиска услуг по виду услуги
+CREATE INDEX idx_services_service_type ON services("Код_вида_услуг");
+
+-- Куб агрегатов
+CREATE MATERIALIZED VIEW services_cube AS
+SELECT
+    s."Регистрационный_номер",
+    s."Код_района",
+    d."Код_области",
+    s."Отчетный_период",
+    s."Код_вида_услуг",
+    st."Сельская_местность",
+    COALESCE(SUM(s."План_всего"), 0) AS "План_всего",
+    COALESCE(SUM(s."Фактически_выполнено_всего"), 0) AS "Фактически_выполнено_всего",
+    COUNT(*) AS "Количество_записей"
+FROM services s
+JOIN service_types st ON st.id = s."Код_вида_услуг"
+LEFT JOIN districts d ON d."Код_района" = s."Код_района"
+GROUP BY s."Регистрационный_номер", s."Код_района", d."Код_области",
+         s."Отчетный_период", s."Код_вида_услуг", st."Сельская_местность";
+
+-- Уникальный индекс нужен для REFRESH ... CONCURRENTLY
+CREATE UNIQUE INDEX idx_services_cube_key ON services_cube(
+    "Регистрационный_номер", "Код_района", "Отчетный_период", "Код_вида_услуг"
+);
+CREATE INDEX idx_services_cube_district_year ON services_cube("Код_района", "Отчетный_период")
+    INCLUDE ("Регистрационный_номер", "Код_вида_услуг", "Сельская_местность",
+             "План_всего", "Фактически_выполнено_всего", "Количество_записей");
+CREATE INDEX idx_services_cube_region_year ON services_cube("Код_области", "Отчетный_период")
+    INCLUDE ("Регистрационный_номер", "Код_района", "Код_вида_услуг", "Сельская_местность",
+             "План_всего", "Фактически_выполнено_всего", "Количество_записей");
+
+-- Триггер сводных итогов (создаётся после копирования, чтобы не учесть строки дважды)
+-- Добавляет (sign = 1) или вычитает (sign = -1) строку услуги из всех срезов
+-- (поля передаются по отдельности: в триггере секционированной таблицы строка имеет тип секции)
+CREATE OR REPLACE FUNCTION services_summary_apply(
+    service_type_id SMALLINT, district_code INTEGER, report_year INTEGER,
+    plan_total BIGINT, fact_total BIGINT, sign INTEGER
+) RETURNS VOID AS $$
+DECLARE
+    plan_value BIGINT := sign * COALESCE(plan_total, 0);
+    fact_value BIGINT := sign * COALESCE(fact_total, 0);
+    service_name VARCHAR(50);
+    is_rural BOOLEAN;
+    region_code INTEGER;
+BEGIN
+    SELECT st."Наименование_вида_услуг", st."Сельская_местность" INTO service_name, is_rural
+    FROM service_types st WHERE st.id = service_type_id;
+    SELECT d."Код_области" INTO region_code FROM districts d WHERE d."Код_района" = district_code;
+
+    INSERT INTO services_summary AS t
+        ("Срез", "Ключ", "План_всего", "Фактически_выполнено_всего", "План_село", "Факт_село", "Количество_записей")
+    SELECT scope, key,
+           plan_value, fact_value,
+           CASE WHEN is_rural THEN plan_value ELSE 0 END,
+           CASE WHEN is_rural THEN fact_value ELSE 0 END,
+           sign
+    FROM (VALUES
+        ('global', ''),
+        ('service_type', service_name),
+        ('region', region_code::TEXT),
+        ('year', report_year::TEXT)
+    ) AS scopes(scope, key)
+    WHERE key IS NOT NULL
+    ON CONFLICT ("Срез", "Ключ") DO UPDATE SET
+        "План_всего" = t."План_всего" + EXCLUDED."План_всего",
+        "Фактически_выполнено_всего" = t."Фактически_выполнено_всего" + EXCLUDED."Фактически_выполнено_всего",
+        "План_село" = t."План_село" + EXCLUDED."План_село",
+        "Факт_село" = t."Факт_село" + EXCLUDED."Факт_село",
+        "Количество_записей" = t."Количество_записей" + EXCLUDED."Количество_записей";
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION services_summary_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM services_summary_apply(OLD."Код_вида_услуг", OLD."Код_района", OLD."Отчетный_период",
+                                       OLD."План_всего", OLD."Фактически_выполнено_всего", -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM services_summary_apply(NEW."Код_вида_услуг", NEW."Код_района", NEW."Отчетный_период",
+                                       NEW."План_всего", NEW."Фактически_выполнено_всего", 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_services_summary
+AFTER INSERT OR UPDATE OR DELETE ON services
+FOR EACH ROW EXECUTE FUNCTION services_summary_trigger();
+
+COMMIT;
+
+ANALYZE services;
@@ -0,0 +1,54 @@
+-- Код области в services (копия districts."Код_области"): отчеты по области
+-- фильтруют services напрямую, без подзапроса к districts.
+-- Применяется после 005_partition_services.sql. Индекс на секционированной
+-- таблице строится без CONCURRENTLY — services блокируется на время миграции.
+BEGIN;
+LOCK TABLE services IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE services ADD COLUMN IF NOT EXISTS "Код_области" INTEGER;
+
+UPDATE services s
+SET "Код_области" = d."Код_области"
+FROM districts d
+WHERE d."Код_района" = s."Код_района"
+    AND s."Код_области" IS DISTINCT FROM d."Код_области";
+
+ALTER TABLE services
+    ADD CONSTRAINT services_region_fkey FOREIGN KEY ("Код_области") REFERENCES regions("Код_области");
+
+-- Отчеты по области: область + год — сводки и списки предприятий области
+CREATE INDEX IF NOT EXISTS idx_services_region_year ON services("Код_области", "Отчетный_период")
+    INCLUDE ("Регистрационный_номер", "Код_района", "Код_вида_услуг", "Код_показателя", "План_всего", "Фактически_выполнено_всего");
+
+-- Куб берёт область из services вместо соединения с districts
+DROP MATERIALIZED VIEW IF EXISTS services_cube;
+CREATE MATERIALIZED VIEW services_cube AS
+SELECT
+    s."Регистрационный_номер",
+    s."Код_района",
+    s."Код_области",
+    s."Отчетный_период",
+    s."Код_вида_услуг",
+    st."Сельская_местность",
+    COALESCE(SUM(s."План_всего"), 0) AS "План_всего",
+    COALESCE(SUM(s."Фактически_выполнено_всего"), 0) AS "Фактически_выполнено_всего",
+    COUNT(*) AS "Количество_записей"
+FROM services s
+JOIN service_types st ON st.id = s."Код_вида_услуг"
+GROUP BY s."Регистрационный_номер", s."Код_района", s."Код_области",
+         s."Отчетный_период", s."Код_вида_услуг", st."Сельская_местность";
+
+CREATE UNIQUE INDEX idx_services_cube_key ON services_cube(
+    "Регистрационный_номер", "Код_района", "Отчетный_период", "Код_вида_услуг"
+);
+CREATE INDEX idx_services_cube_district_year ON services_cube("Код_района", "Отчетный_период")
+    INCLUDE ("Регистрационный_номер", "Код_вида_услуг", "Сельская_местность",
+             "План_всего", "Фактически_выполнено_всего", "Количество_записей");
+CREATE INDEX idx_services_cube_region_year ON services_cube("Код_области", "Отчетный_период")
+    INCLUDE ("Регистрационный_номер", "Код_района", "Код_вида_услуг", "Сельская_местность",
+             "План_всего", "Фактически_выполнено_всего", "Количество_записей");
+
+COMMIT;
+
+ANALYZE services;
+ANALYZE services_cube;
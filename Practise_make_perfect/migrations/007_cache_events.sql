@@ -0,0 +1,38 @@
+-- Уведомления cache_events для сброса кэшей во всех воркерах (см. scripts.sql).
+-- Применяется после 006_services_region_code.sql; повторный запуск безопасен.
+BEGIN;
+
+CREATE OR REPLACE FUNCTION notify_cache_event() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('cache_events', TG_ARGV[0]);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_enterprises_cache_event ON enterprises;
+DROP TRIGGER IF EXISTS trg_services_cache_event ON services;
+DROP TRIGGER IF EXISTS trg_period_cache_event ON period;
+DROP TRIGGER IF EXISTS trg_districts_cache_event ON districts;
+DROP TRIGGER IF EXISTS trg_regions_cache_event ON regions;
+DROP TRIGGER IF EXISTS trg_ministries_cache_event ON ministries;
+DROP TRIGGER IF EXISTS trg_industries_cache_event ON industries;
+DROP TRIGGER IF EXISTS trg_service_types_cache_event ON service_types;
+
+CREATE TRIGGER trg_enterprises_cache_event AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON enterprises
+FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event('enterprises');
+CREATE TRIGGER trg_services_cache_event AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON services
+FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event('services');
+CREATE TRIGGER trg_period_cache_event AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON period
+FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event('period');
+CREATE TRIGGER trg_districts_cache_event AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON districts
+FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event('districts');
+CREATE TRIGGER trg_regions_cache_event AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON regions
+FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event('regions');
+CREATE TRIGGER trg_ministries_cache_event AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON ministries
+FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event('ministries');
+CREATE TRIGGER trg_industries_cache_event AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON industries
+FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event('industries');
+CREATE TRIGGER trg_service_types_cache_event AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON service_types
+FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event('service_types');
+
+COMMIT;
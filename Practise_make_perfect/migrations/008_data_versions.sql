@@ -0,0 +1,26 @@
+-- Версии данных для ETag отчетных и справочных API (см. scripts.sql).
+-- Применяется после 007_cache_events.sql: триггеры cache_events начинают
+-- увеличивать версию таблицы перед уведомлением.
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS data_versions (
+    "Таблица" VARCHAR(50) PRIMARY KEY,
+    "Версия" BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION bump_data_version(table_name VARCHAR) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO data_versions AS v ("Таблица", "Версия") VALUES (table_name, 1)
+    ON CONFLICT ("Таблица") DO UPDATE SET "Версия" = v."Версия" + 1;
+    PERFORM pg_notify('cache_events', table_name);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_cache_event() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM bump_data_version(TG_ARGV[0]);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMIT;
@@ -0,0 +1,35 @@
+-- Закрытые отчетные годы (см. scripts.sql). Применяется после 008_data_versions.sql.
+BEGIN;
+
+-- Закрытые отчетные годы: данные года больше не меняются, отчеты за него
+-- сохраняются на диске и отдаются без обращения к БД (app/report_store.py)
+CREATE TABLE IF NOT EXISTS closed_years (
+    "Отчетный_период" INTEGER PRIMARY KEY,
+    "Дата_закрытия" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Запрещает изменять услуги и периоды закрытого года
+CREATE OR REPLACE FUNCTION forbid_closed_year_changes() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' AND EXISTS (SELECT 1 FROM closed_years c WHERE c."Отчетный_период" = OLD."Отчетный_период") THEN
+        RAISE EXCEPTION 'Отчетный период % закрыт для изменений', OLD."Отчетный_период";
+    END IF;
+    IF TG_OP <> 'DELETE' AND EXISTS (SELECT 1 FROM closed_years c WHERE c."Отчетный_период" = NEW."Отчетный_период") THEN
+        RAISE EXCEPTION 'Отчетный период % закрыт для изменений', NEW."Отчетный_период";
+    END IF;
+    RETURN COALESCE(NEW, OLD);
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_services_closed_year ON services;
+DROP TRIGGER IF EXISTS trg_period_closed_year ON period;
+DROP TRIGGER IF EXISTS trg_closed_years_cache_event ON closed_years;
+
+CREATE TRIGGER trg_services_closed_year BEFORE INSERT OR UPDATE OR DELETE ON services
+FOR EACH ROW EXECUTE FUNCTION forbid_closed_year_changes();
+CREATE TRIGGER trg_period_closed_year BEFORE INSERT OR UPDATE OR DELETE ON period
+FOR EACH ROW EXECUTE FUNCTION forbid_closed_year_changes();
+CREATE TRIGGER trg_closed_years_cache_event AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON closed_years
+FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event('closed_years');
+
+COMMIT;
@@ -0,0 +1,19 @@
+-- Индексы keyset-пагинации списка услуг в админке (см. scripts.sql).
+-- Применяется после 009_closed_years.sql. services секционирована, поэтому
+-- индексы строятся без CONCURRENTLY (запись в services блокируется на время построения).
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS idx_services_admin_enterprise
+    ON services("Регистрационный_номер", "Отчетный_период", "Код_вида_услуг", id);
+CREATE INDEX IF NOT EXISTS idx_services_admin_year
+    ON services("Отчетный_период", "Регистрационный_номер", "Код_вида_услуг", id);
+CREATE INDEX IF NOT EXISTS idx_services_admin_service_type
+    ON services("Код_вида_услуг", "Отчетный_период", "Регистрационный_номер", id);
+
+-- Одноколоночные индексы, ставшие префиксами новых
+DROP INDEX IF EXISTS idx_services_period;
+DROP INDEX IF EXISTS idx_services_service_type;
+
+COMMIT;
+
+ANALYZE services;
@@ -0,0 +1,23 @@
+-- Уникальность услуги (предприятие + район + год + вид услуги) — ключ ON CONFLICT
+-- массового импорта (app/services_import.py). Применяется после 010_admin_services_indexes.sql.
+BEGIN;
+
+DO $$
+DECLARE
+    duplicate_groups BIGINT;
+BEGIN
+    SELECT COUNT(*) INTO duplicate_groups FROM (
+        SELECT 1 FROM services
+        GROUP BY "Регистрационный_номер", "Код_района", "Отчетный_период", "Код_вида_услуг"
+        HAVING COUNT(*) > 1
+    ) duplicates;
+    IF duplicate_groups > 0 THEN
+        RAISE EXCEPTION 'В services % повторяющихся услуг — удалите повторы перед миграцией', duplicate_groups;
+    END IF;
+END;
+$$;
+
+ALTER TABLE services
+    ADD CONSTRAINT unique_service UNIQUE ("Регистрационный_номер", "Код_района", "Отчетный_период", "Код_вида_услуг");
+
+COMMIT;
@@ -0,0 +1,53 @@
+-- Имена ограничений enterprises, period и services (см. scripts.sql): API админки
+-- сопоставляет по ним ошибки записи с сообщениями (app/db_errors.py).
+-- Применяется после 011_unique_service.sql. Ограничение ищется по таблице, типу и колонкам;
+-- у секционированной services внешние ключи пересоздаются, чтобы новое имя получили
+-- и копии ограничения в секциях (ключи при этом проверяются заново).
+BEGIN;
+
+CREATE FUNCTION pg_temp.name_constraint(table_name REGCLASS, kind "char", columns TEXT[], new_name NAME)
+RETURNS VOID AS $$
+DECLARE
+    constraint_oid OID;
+    old_name NAME;
+BEGIN
+    SELECT c.oid, c.conname INTO constraint_oid, old_name
+    FROM pg_constraint c
+    WHERE c.conrelid = table_name AND c.contype = kind
+      AND ARRAY(
+          SELECT a.attname::TEXT
+          FROM unnest(c.conkey) WITH ORDINALITY k(attnum, ord)
+          JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+          ORDER BY k.ord
+      ) = columns;
+
+    IF old_name IS NULL THEN
+        RAISE EXCEPTION 'В % не найдено ограничение по колонкам %', table_name, columns;
+    END IF;
+    IF old_name = new_name THEN
+        RETURN;
+    END IF;
+
+    IF (SELECT relkind FROM pg_class WHERE oid = table_name) = 'p' THEN
+        EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I, ADD CONSTRAINT %I %s',
+                       table_name, old_name, new_name, pg_get_constraintdef(constraint_oid));
+    ELSE
+        EXECUTE format('ALTER TABLE %s RENAME CONSTRAINT %I TO %I', table_name, old_name, new_name);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT pg_temp.name_constraint('enterprises', 'u', ARRAY['Регистрационный_номер'], 'unique_enterprise_reg_number');
+SELECT pg_temp.name_constraint('enterprises', 'f', ARRAY['Код_министерства'], 'fk_enterprise_ministry');
+SELECT pg_temp.name_constraint('enterprises', 'f', ARRAY['Код_отрасли'], 'fk_enterprise_industry');
+SELECT pg_temp.name_constraint('enterprises', 'f', ARRAY['Код_области'], 'fk_enterprise_region');
+
+SELECT pg_temp.name_constraint('period', 'f', ARRAY['Регистрационный_номер'], 'fk_period_enterprise');
+
+SELECT pg_temp.name_constraint('services', 'f', ARRAY['Регистрационный_номер'], 'fk_service_enterprise');
+SELECT pg_temp.name_constraint('services', 'f', ARRAY['Код_района'], 'fk_service_district');
+SELECT pg_temp.name_constraint('services', 'f', ARRAY['Код_области'], 'fk_service_region');
+SELECT pg_temp.name_constraint('services', 'f', ARRAY['Регистрационный_номер', 'Отчетный_период'], 'fk_service_period');
+SELECT pg_temp.name_constraint('services', 'f', ARRAY['Код_вида_услуг'], 'fk_service_type');
+
+COMMIT;
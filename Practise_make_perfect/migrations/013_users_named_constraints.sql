@@ -0,0 +1,30 @@
+-- Имена уникальных ограничений users (см. scripts.sql): по ним API админки сообщает
+-- о повторе email или логина (app/db_errors.py). Применяется к БД пользователей.
+BEGIN;
+
+DO $$
+DECLARE
+    item RECORD;
+    old_name NAME;
+BEGIN
+    FOR item IN SELECT * FROM (VALUES
+        ('email', 'unique_user_email'),
+        ('логин', 'unique_user_login')
+    ) AS t(column_name, new_name) LOOP
+        SELECT c.conname INTO old_name
+        FROM pg_constraint c
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+        WHERE c.conrelid = 'users'::REGCLASS AND c.contype = 'u'
+          AND cardinality(c.conkey) = 1 AND a.attname = item.column_name;
+
+        IF old_name IS NULL THEN
+            RAISE EXCEPTION 'В users не найдено уникальное ограничение по колонке %', item.column_name;
+        END IF;
+        IF old_name <> item.new_name THEN
+            EXECUTE format('ALTER TABLE users RENAME CONSTRAINT %I TO %I', old_name, item.new_name);
+        END IF;
+    END LOOP;
+END;
+$$;
+
+COMMIT;
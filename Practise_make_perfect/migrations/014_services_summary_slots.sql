@@ -0,0 +1,70 @@
+-- Итоги services_summary: только используемые срезы (общий и по виду услуг), каждый итог
+-- разнесён по 16 строкам-слотам, построчный триггер заменён операторными с переходными
+-- таблицами (см. scripts.sql). Применяется после 012_named_constraints.sql;
+-- services блокируется на время миграции, чтобы итоги не разошлись с триггерами.
+BEGIN;
+LOCK TABLE services IN SHARE ROW EXCLUSIVE MODE;
+
+DROP TRIGGER IF EXISTS trg_services_summary ON services;
+DROP FUNCTION IF EXISTS services_summary_trigger();
+DROP FUNCTION IF EXISTS services_summary_apply(SMALLINT, INTEGER, INTEGER, BIGINT, BIGINT, INTEGER);
+
+-- Срезы по области и по году нигде не читались
+DELETE FROM services_summary WHERE "Срез" NOT IN ('global', 'service_type');
+ALTER TABLE services_summary DROP CONSTRAINT valid_summary_scope;
+ALTER TABLE services_summary ADD CONSTRAINT valid_summary_scope CHECK ("Срез" IN ('global', 'service_type'));
+
+-- Существующие итоги остаются в слоте 0
+ALTER TABLE services_summary ADD COLUMN "Слот" SMALLINT NOT NULL DEFAULT 0;
+ALTER TABLE services_summary DROP CONSTRAINT services_summary_pkey;
+ALTER TABLE services_summary ADD PRIMARY KEY ("Срез", "Ключ", "Слот");
+
+-- Применяет к итогам изменённые строки услуг одним запросом на оператор (INSERT, UPDATE,
+-- DELETE, в т.ч. массовый импорт): строки берутся из переходных таблиц old_rows/new_rows
+CREATE OR REPLACE FUNCTION services_summary_trigger() RETURNS TRIGGER AS $$
+DECLARE
+    changes TEXT := CASE TG_OP
+        WHEN 'INSERT' THEN 'SELECT n.*, 1 AS sign FROM new_rows n'
+        WHEN 'DELETE' THEN 'SELECT o.*, -1 AS sign FROM old_rows o'
+        ELSE 'SELECT o.*, -1 AS sign FROM old_rows o UNION ALL SELECT n.*, 1 FROM new_rows n'
+    END;
+BEGIN
+    EXECUTE format($sql$
+        INSERT INTO services_summary AS t
+            ("Срез", "Ключ", "Слот", "План_всего", "Фактически_выполнено_всего",
+             "План_село", "Факт_село", "Количество_записей")
+        SELECT scopes.scope, scopes.key, pg_backend_pid() %% 16,
+               SUM(c.sign * COALESCE(c."План_всего", 0)),
+               SUM(c.sign * COALESCE(c."Фактически_выполнено_всего", 0)),
+               SUM(CASE WHEN st."Сельская_местность" THEN c.sign * COALESCE(c."План_всего", 0) ELSE 0 END),
+               SUM(CASE WHEN st."Сельская_местность" THEN c.sign * COALESCE(c."Фактически_выполнено_всего", 0) ELSE 0 END),
+               SUM(c.sign)
+        FROM (%s) c
+        JOIN service_types st ON st.id = c."Код_вида_услуг"
+        CROSS JOIN LATERAL (VALUES ('global', ''), ('service_type', st."Наименование_вида_услуг")) AS scopes(scope, key)
+        GROUP BY scopes.scope, scopes.key
+        -- Постоянный порядок блокировки строк итогов: сеансы с одним слотом не взаимоблокируются
+        ORDER BY scopes.scope, scopes.key
+        ON CONFLICT ("Срез", "Ключ", "Слот") DO UPDATE SET
+            "План_всего" = t."План_всего" + EXCLUDED."План_всего",
+            "Фактически_выполнено_всего" = t."Фактически_выполнено_всего" + EXCLUDED."Фактически_выполнено_всего",
+            "План_село" = t."План_село" + EXCLUDED."План_село",
+            "Факт_село" = t."Факт_село" + EXCLUDED."Факт_село",
+            "Количество_записей" = t."Количество_записей" + EXCLUDED."Количество_записей"
+    $sql$, changes);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Переходные таблицы допускаются только у триггера на одно событие — триггеров три
+CREATE TRIGGER trg_services_summary_insert
+AFTER INSERT ON services REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION services_summary_trigger();
+CREATE TRIGGER trg_services_summary_update
+AFTER UPDATE ON services REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION services_summary_trigger();
+CREATE TRIGGER trg_services_summary_delete
+AFTER DELETE ON services REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION services_summary_trigger();
+
+COMMIT;
@@ -0,0 +1,18 @@
+-- ФИО директора переносится в индекс ограничения unique_reg_period (INCLUDE), отдельный
+-- idx_period_reg_year с тем же ключом удаляется — запись периода обновляет один индекс.
+-- Применяется после 014_services_summary_slots.sql. Внешний ключ fk_service_period
+-- опирается на unique_reg_period, поэтому пересоздаётся (services проверяется заново).
+BEGIN;
+
+CREATE UNIQUE INDEX unique_reg_period_include ON period("Регистрационный_номер", "Отчетный_период")
+    INCLUDE ("ФИО_директора");
+
+ALTER TABLE services DROP CONSTRAINT fk_service_period;
+ALTER TABLE period DROP CONSTRAINT unique_reg_period;
+ALTER TABLE period ADD CONSTRAINT unique_reg_period UNIQUE USING INDEX unique_reg_period_include;
+ALTER TABLE services ADD CONSTRAINT fk_service_period FOREIGN KEY ("Регистрационный_номер", "Отчетный_период")
+    REFERENCES period("Регистрационный_номер", "Отчетный_период");
+
+DROP INDEX IF EXISTS idx_period_reg_year;
+
+COMMIT;
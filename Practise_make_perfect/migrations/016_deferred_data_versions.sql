@@ -0,0 +1,49 @@
+-- Версии data_versions повышаются один раз на транзакцию при её фиксации, а не в каждом
+-- операторе записи (см. scripts.sql): строка версии services больше не держится
+-- блокировкой до конца каждой транзакции, изменяющей услуги.
+-- Применяется после 015_period_unique_include.sql.
+BEGIN;
+
+-- Таблицы, изменённые текущей транзакцией: строка на транзакцию и таблицу, удаляется
+-- при фиксации той же транзакции. Разные транзакции пишут разные строки и не ждут друг друга
+CREATE UNLOGGED TABLE IF NOT EXISTS data_version_changes (
+    "Транзакция" BIGINT NOT NULL,
+    "Таблица" VARCHAR(50) NOT NULL,
+    PRIMARY KEY ("Транзакция", "Таблица")
+);
+
+-- Повышает версии таблиц, изменённых транзакцией, один раз при её фиксации (отложенный
+-- триггер): строка data_versions блокируется только на время фиксации, а не на всю
+-- транзакцию записи. Первый вызов забирает все изменения транзакции, остальные ничего
+-- не находят; версии повышаются в порядке имён таблиц — без взаимоблокировок
+CREATE OR REPLACE FUNCTION apply_data_version_changes() RETURNS TRIGGER AS $$
+BEGIN
+    WITH changed AS (
+        DELETE FROM data_version_changes WHERE "Транзакция" = NEW."Транзакция"
+        RETURNING "Таблица"
+    )
+    INSERT INTO data_versions AS v ("Таблица", "Версия")
+    SELECT "Таблица", 1 FROM changed ORDER BY "Таблица"
+    ON CONFLICT ("Таблица") DO UPDATE SET "Версия" = v."Версия" + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_data_version_changes ON data_version_changes;
+CREATE CONSTRAINT TRIGGER trg_data_version_changes AFTER INSERT ON data_version_changes
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE FUNCTION apply_data_version_changes();
+
+-- Триггеры уровня оператора — одно событие на запрос; повторные уведомления
+-- в одной транзакции PostgreSQL склеивает. Уведомление доставляется после фиксации,
+-- когда версия таблицы уже повышена
+CREATE OR REPLACE FUNCTION notify_cache_event() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO data_version_changes ("Транзакция", "Таблица") VALUES (txid_current(), TG_ARGV[0])
+    ON CONFLICT DO NOTHING;
+    PERFORM pg_notify('cache_events', TG_ARGV[0]);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMIT;
@@ -0,0 +1,22 @@
+-- Объединение пересекающихся индексов services (см. scripts.sql): unique_service
+-- перестраивается с ключом (предприятие, год, вид услуги, район) и INCLUDE сумм и заменяет
+-- idx_services_reg_year_district и idx_services_admin_enterprise: при каждой записи услуги
+-- и при массовом импорте обновляются 6 индексов вместо 8.
+-- Цена: в отчетах по предприятию район проверяется внутри диапазона предприятия и года
+-- (десятки строк), а сортировка «по предприятию» в админке досортировывает id внутри
+-- группы (предприятие, год, вид услуги) — обе группы малы.
+-- Применяется после 016_deferred_data_versions.sql; services блокируется на время
+-- построения индекса (секционированная таблица — без CONCURRENTLY).
+BEGIN;
+
+ALTER TABLE services DROP CONSTRAINT unique_service;
+ALTER TABLE services ADD CONSTRAINT unique_service
+    UNIQUE ("Регистрационный_номер", "Отчетный_период", "Код_вида_услуг", "Код_района")
+    INCLUDE ("Код_показателя", "План_всего", "Фактически_выполнено_всего");
+
+DROP INDEX IF EXISTS idx_services_reg_year_district;
+DROP INDEX IF EXISTS idx_services_admin_enterprise;
+
+COMMIT;
+
+ANALYZE services;
@@ -1,6 +1,8 @@
 CREATE TABLE service_types (
-    id SERIAL PRIMARY KEY,
-    "Наименование_вида_услуг" VARCHAR(50) NOT NULL UNIQUE
+    id SMALLSERIAL PRIMARY KEY,
+    "Наименование_вида_услуг" VARCHAR(50) NOT NULL UNIQUE,
+    "Сельская_местность" BOOLEAN NOT NULL DEFAULT FALSE,  -- строка "в т.ч. в сельской местности"
+    "Порядок" SMALLINT NOT NULL DEFAULT 0  -- порядок строк в формах отчетов
 );
 
 -- 2. Таблица министерств
@@ -36,13 +38,15 @@ CREATE TABLE districts (
 CREATE TABLE enterprises (
     id SERIAL PRIMARY KEY,
     "Наименование_предприятия" VARCHAR(255) NOT NULL,
-    "Регистрационный_номер" BIGINT NOT NULL UNIQUE,
+    "Регистрационный_номер" BIGINT NOT NULL,
     "Код_министерства" INTEGER,
     "Код_отрасли" INTEGER,
     "Код_области" INTEGER,
-    FOREIGN KEY ("Код_министерства") REFERENCES ministries("Код_министерства"),
-    FOREIGN KEY ("Код_отрасли") REFERENCES industries("Код_отрасли"),
-    FOREIGN KEY ("Код_области") REFERENCES regions("Код_области")
+    -- Ошибки записи сопоставляются с сообщениями API по именам ограничений (app/db_errors.py)
+    CONSTRAINT unique_enterprise_reg_number UNIQUE ("Регистрационный_номер"),
+    CONSTRAINT fk_enterprise_ministry FOREIGN KEY ("Код_министерства") REFERENCES ministries("Код_министерства"),
+    CONSTRAINT fk_enterprise_industry FOREIGN KEY ("Код_отрасли") REFERENCES industries("Код_отрасли"),
+    CONSTRAINT fk_enterprise_region FOREIGN KEY ("Код_области") REFERENCES regions("Код_области")
 );
 
 CREATE TABLE period (
@@ -51,57 +55,293 @@ CREATE TABLE period (
     "Отчетный_период" INTEGER NOT NULL,
     
     "ФИО_директора" VARCHAR(250),
-    FOREIGN KEY ("Регистрационный_номер") REFERENCES enterprises("Регистрационный_номер") ON DELETE CASCADE,
-    CONSTRAINT unique_reg_period UNIQUE ("Регистрационный_номер", "Отчетный_период")
+    CONSTRAINT fk_period_enterprise FOREIGN KEY ("Регистрационный_номер") REFERENCES enterprises("Регистрационный_номер") ON DELETE CASCADE,
+    -- Индекс ограничения отдает и ФИО директора по предприятию и году
+    -- (в т.ч. последний период предприятия) без чтения таблицы
+    CONSTRAINT unique_reg_period UNIQUE ("Регистрационный_номер", "Отчетный_период") INCLUDE ("ФИО_директора")
 );
 
+-- Услуги секционированы по отчетному году (services_y<год>): запросы за год или
+-- диапазон лет читают только нужные секции, старые годы архивируются через
+-- ALTER TABLE services DETACH PARTITION services_y<год> CONCURRENTLY.
+-- Секция года создаётся функцией ensure_services_partition (вызывается при записи из админки)
 CREATE TABLE services (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     "Регистрационный_номер" BIGINT NOT NULL,
     "Код_района" INTEGER,
-    "Отчетный_период" INTEGER,
-    "Наименование_вида_услуг" VARCHAR(250) NOT NULL,
+    -- Область района (копия districts."Код_области"), заполняется API админки
+    "Код_области" INTEGER,
+    "Отчетный_период" INTEGER NOT NULL,
+    "Код_вида_услуг" SMALLINT NOT NULL,
     "Код_показателя" INTEGER,
     "План_всего" BIGINT,
     "Фактически_выполнено_всего" BIGINT,
     
-    FOREIGN KEY ("Регистрационный_номер") REFERENCES enterprises("Регистрационный_номер") ON DELETE CASCADE,
-    FOREIGN KEY ("Код_района") REFERENCES districts("Код_района"),
-    FOREIGN KEY ("Регистрационный_номер", "Отчетный_период") REFERENCES period("Регистрационный_номер", "Отчетный_период"),
-    FOREIGN KEY ("Наименование_вида_услуг") REFERENCES service_types("Наименование_вида_услуг")
-);
+    CONSTRAINT fk_service_enterprise FOREIGN KEY ("Регистрационный_номер") REFERENCES enterprises("Регистрационный_номер") ON DELETE CASCADE,
+    CONSTRAINT fk_service_district FOREIGN KEY ("Код_района") REFERENCES districts("Код_района"),
+    CONSTRAINT fk_service_region FOREIGN KEY ("Код_области") REFERENCES regions("Код_области"),
+    CONSTRAINT fk_service_period FOREIGN KEY ("Регистрационный_номер", "Отчетный_период") REFERENCES period("Регистрационный_номер", "Отчетный_период"),
+    CONSTRAINT fk_service_type FOREIGN KEY ("Код_вида_услуг") REFERENCES service_types(id),
+    PRIMARY KEY (id, "Отчетный_период"),
+    -- Одна услуга вида на предприятие, район и год (ключ ON CONFLICT при импорте и в админке).
+    -- Индекс ограничения заодно покрывает отчеты по предприятию (предприятие + год, район —
+    -- условие внутри диапазона предприятия и года, суммы — из INCLUDE) и сортировку
+    -- «по предприятию» списка услуг в админке (предприятие, год, вид услуги; id досортировывается)
+    CONSTRAINT unique_service UNIQUE ("Регистрационный_номер", "Отчетный_период", "Код_вида_услуг", "Код_района")
+        INCLUDE ("Код_показателя", "План_всего", "Фактически_выполнено_всего")
+) PARTITION BY RANGE ("Отчетный_период");
+
+-- Создаёт секцию services за год, если её ещё нет
+CREATE OR REPLACE FUNCTION ensure_services_partition(report_year INTEGER) RETURNS VOID AS $$
+DECLARE
+    partition_name TEXT := 'services_y' || report_year;
+BEGIN
+    IF to_regclass(partition_name) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF services FOR VALUES FROM (%s) TO (%s)',
+            partition_name, report_year, report_year + 1
+        );
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
 
 -- Для поиска предприятий по названию
 CREATE INDEX idx_enterprises_name ON enterprises("Наименование_предприятия");
 
--- Для поиска услуг по предприятию (основной сценарий)
-CREATE INDEX idx_services_reg_number ON services("Регистрационный_номер");
+-- Составные покрывающие индексы под запросы отчетов (main.py): фильтр идёт по
+-- ключевым колонкам, а суммируемые колонки берутся из INCLUDE без чтения таблицы.
+
+-- Отчеты по предприятию: предприятие (+ год, + район) — индекс ограничения unique_service
+
+-- Отчеты по району: район + год — сводка района, пакетные бланки, услуги района
+CREATE INDEX idx_services_district_year ON services("Код_района", "Отчетный_период")
+    INCLUDE ("Регистрационный_номер", "Код_вида_услуг", "Код_показателя", "План_всего", "Фактически_выполнено_всего");
+
+-- Отчеты по области: область + год — сводки и списки предприятий области
+CREATE INDEX idx_services_region_year ON services("Код_области", "Отчетный_период")
+    INCLUDE ("Регистрационный_номер", "Код_района", "Код_вида_услуг", "Код_показателя", "План_всего", "Фактически_выполнено_всего");
+
+-- Список услуг в админке (keyset-пагинация, main.py ADMIN_SERVICES_SORTS): сортировки по году
+-- и по виду услуги (заодно фильтры по ним); сортировку по предприятию обслуживает unique_service
+CREATE INDEX idx_services_admin_year ON services("Отчетный_период", "Регистрационный_номер", "Код_вида_услуг", id);
+CREATE INDEX idx_services_admin_service_type ON services("Код_вида_услуг", "Отчетный_период", "Регистрационный_номер", id);
+
+-- Куб агрегатов план/факт: предприятие × район × область × год × вид услуги.
+-- Отчеты читают суммы отсюда, а не из services; обновляется в фоне после изменений через
+-- админку, серия изменений — одним REFRESH MATERIALIZED VIEW CONCURRENTLY (app/cube_refresh.py)
+CREATE MATERIALIZED VIEW services_cube AS
+SELECT
+    s."Регистрационный_номер",
+    s."Код_района",
+    s."Код_области",
+    s."Отчетный_период",
+    s."Код_вида_услуг",
+    st."Сельская_местность",
+    COALESCE(SUM(s."План_всего"), 0) AS "План_всего",
+    COALESCE(SUM(s."Фактически_выполнено_всего"), 0) AS "Фактически_выполнено_всего",
+    COUNT(*) AS "Количество_записей"
+FROM services s
+JOIN service_types st ON st.id = s."Код_вида_услуг"
+GROUP BY s."Регистрационный_номер", s."Код_района", s."Код_области",
+         s."Отчетный_период", s."Код_вида_услуг", st."Сельская_местность";
+
+-- Уникальный индекс нужен для REFRESH ... CONCURRENTLY
+CREATE UNIQUE INDEX idx_services_cube_key ON services_cube(
+    "Регистрационный_номер", "Код_района", "Отчетный_период", "Код_вида_услуг"
+);
+CREATE INDEX idx_services_cube_district_year ON services_cube("Код_района", "Отчетный_период")
+    INCLUDE ("Регистрационный_номер", "Код_вида_услуг", "Сельская_местность",
+             "План_всего", "Фактически_выполнено_всего", "Количество_записей");
+CREATE INDEX idx_services_cube_region_year ON services_cube("Код_области", "Отчетный_период")
+    INCLUDE ("Регистрационный_номер", "Код_района", "Код_вида_услуг", "Сельская_местность",
+             "План_всего", "Фактически_выполнено_всего", "Количество_записей");
+
+-- Сводные итоги по услугам для главной страницы и дашборда:
+-- общий итог (срез 'global', ключ '') и по виду услуг (ключ — наименование).
+-- Поддерживаются триггерами на services в той же транзакции, что и изменение услуг.
+-- Каждый итог разнесён по 16 строкам («Слот» = pid сеанса по модулю 16):
+-- одновременные записи из разных сеансов обновляют разные строки и не ждут друг друга,
+-- при чтении слоты суммируются
+CREATE TABLE services_summary (
+    "Срез" VARCHAR(20) NOT NULL,
+    "Ключ" VARCHAR(250) NOT NULL,
+    "Слот" SMALLINT NOT NULL DEFAULT 0,
+    "План_всего" BIGINT NOT NULL DEFAULT 0,
+    "Фактически_выполнено_всего" BIGINT NOT NULL DEFAULT 0,
+    "План_село" BIGINT NOT NULL DEFAULT 0,
+    "Факт_село" BIGINT NOT NULL DEFAULT 0,
+    "Количество_записей" BIGINT NOT NULL DEFAULT 0,
+
+    PRIMARY KEY ("Срез", "Ключ", "Слот"),
+    CONSTRAINT valid_summary_scope CHECK ("Срез" IN ('global', 'service_type'))
+);
+
+-- Применяет к итогам изменённые строки услуг одним запросом на оператор (INSERT, UPDATE,
+-- DELETE, в т.ч. массовый импорт): строки берутся из переходных таблиц old_rows/new_rows
+CREATE OR REPLACE FUNCTION services_summary_trigger() RETURNS TRIGGER AS $$
+DECLARE
+    changes TEXT := CASE TG_OP
+        WHEN 'INSERT' THEN 'SELECT n.*, 1 AS sign FROM new_rows n'
+        WHEN 'DELETE' THEN 'SELECT o.*, -1 AS sign FROM old_rows o'
+        ELSE 'SELECT o.*, -1 AS sign FROM old_rows o UNION ALL SELECT n.*, 1 FROM new_rows n'
+    END;
+BEGIN
+    EXECUTE format($sql$
+        INSERT INTO services_summary AS t
+            ("Срез", "Ключ", "Слот", "План_всего", "Фактически_выполнено_всего",
+             "План_село", "Факт_село", "Количество_записей")
+        SELECT scopes.scope, scopes.key, pg_backend_pid() %% 16,
+               SUM(c.sign * COALESCE(c."План_всего", 0)),
+               SUM(c.sign * COALESCE(c."Фактически_выполнено_всего", 0)),
+               SUM(CASE WHEN st."Сельская_местность" THEN c.sign * COALESCE(c."План_всего", 0) ELSE 0 END),
+               SUM(CASE WHEN st."Сельская_местность" THEN c.sign * COALESCE(c."Фактически_выполнено_всего", 0) ELSE 0 END),
+               SUM(c.sign)
+        FROM (%s) c
+        JOIN service_types st ON st.id = c."Код_вида_услуг"
+        CROSS JOIN LATERAL (VALUES ('global', ''), ('service_type', st."Наименование_вида_услуг")) AS scopes(scope, key)
+        GROUP BY scopes.scope, scopes.key
+        -- Постоянный порядок блокировки строк итогов: сеансы с одним слотом не взаимоблокируются
+        ORDER BY scopes.scope, scopes.key
+        ON CONFLICT ("Срез", "Ключ", "Слот") DO UPDATE SET
+            "План_всего" = t."План_всего" + EXCLUDED."План_всего",
+            "Фактически_выполнено_всего" = t."Фактически_выполнено_всего" + EXCLUDED."Фактически_выполнено_всего",
+            "План_село" = t."План_село" + EXCLUDED."План_село",
+            "Факт_село" = t."Факт_село" + EXCLUDED."Факт_село",
+            "Количество_записей" = t."Количество_записей" + EXCLUDED."Количество_записей"
+    $sql$, changes);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Переходные таблицы допускаются только у триггера на одно событие — триггеров три
+CREATE TRIGGER trg_services_summary_insert
+AFTER INSERT ON services REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION services_summary_trigger();
+CREATE TRIGGER trg_services_summary_update
+AFTER UPDATE ON services REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION services_summary_trigger();
+CREATE TRIGGER trg_services_summary_delete
+AFTER DELETE ON services REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION services_summary_trigger();
+
+-- Закрытые отчетные годы: данные года больше не меняются, отчеты за него
+-- сохраняются на диске и отдаются без обращения к БД (app/report_store.py)
+CREATE TABLE closed_years (
+    "Отчетный_период" INTEGER PRIMARY KEY,
+    "Дата_закрытия" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Запрещает изменять услуги и периоды закрытого года
+CREATE OR REPLACE FUNCTION forbid_closed_year_changes() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' AND EXISTS (SELECT 1 FROM closed_years c WHERE c."Отчетный_период" = OLD."Отчетный_период") THEN
+        RAISE EXCEPTION 'Отчетный период % закрыт для изменений', OLD."Отчетный_период";
+    END IF;
+    IF TG_OP <> 'DELETE' AND EXISTS (SELECT 1 FROM closed_years c WHERE c."Отчетный_период" = NEW."Отчетный_период") THEN
+        RAISE EXCEPTION 'Отчетный период % закрыт для изменений', NEW."Отчетный_период";
+    END IF;
+    RETURN COALESCE(NEW, OLD);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_services_closed_year BEFORE INSERT OR UPDATE OR DELETE ON services
+FOR EACH ROW EXECUTE FUNCTION forbid_closed_year_changes();
+CREATE TRIGGER trg_period_closed_year BEFORE INSERT OR UPDATE OR DELETE ON period
+FOR EACH ROW EXECUTE FUNCTION forbid_closed_year_changes();
+
+-- Версии данных по таблицам: из них строятся ETag отчетных и справочных API
+-- (app/data_versions.py). services_cube получает новую версию после REFRESH
+CREATE TABLE data_versions (
+    "Таблица" VARCHAR(50) PRIMARY KEY,
+    "Версия" BIGINT NOT NULL DEFAULT 0
+);
+
+-- Сразу увеличивает версию таблицы и сообщает об изменении в канал cache_events
+-- (сброс кэшей приложения во всех воркерах, app/cache_events.py). Для изменений без
+-- триггеров, например REFRESH services_cube; таблицы с триггерами — см. notify_cache_event
+CREATE OR REPLACE FUNCTION bump_data_version(table_name VARCHAR) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO data_versions AS v ("Таблица", "Версия") VALUES (table_name, 1)
+    ON CONFLICT ("Таблица") DO UPDATE SET "Версия" = v."Версия" + 1;
+    PERFORM pg_notify('cache_events', table_name);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Таблицы, изменённые текущей транзакцией: строка на транзакцию и таблицу, удаляется
+-- при фиксации той же транзакции. Разные транзакции пишут разные строки и не ждут друг друга
+CREATE UNLOGGED TABLE data_version_changes (
+    "Транзакция" BIGINT NOT NULL,
+    "Таблица" VARCHAR(50) NOT NULL,
+    PRIMARY KEY ("Транзакция", "Таблица")
+);
 
--- Для фильтрации услуг по району
-CREATE INDEX idx_services_district ON services("Код_района");
+-- Повышает версии таблиц, изменённых транзакцией, один раз при её фиксации (отложенный
+-- триггер): строка data_versions блокируется только на время фиксации, а не на всю
+-- транзакцию записи. Первый вызов забирает все изменения транзакции, остальные ничего
+-- не находят; версии повышаются в порядке имён таблиц — без взаимоблокировок
+CREATE OR REPLACE FUNCTION apply_data_version_changes() RETURNS TRIGGER AS $$
+BEGIN
+    WITH changed AS (
+        DELETE FROM data_version_changes WHERE "Транзакция" = NEW."Транзакция"
+        RETURNING "Таблица"
+    )
+    INSERT INTO data_versions AS v ("Таблица", "Версия")
+    SELECT "Таблица", 1 FROM changed ORDER BY "Таблица"
+    ON CONFLICT ("Таблица") DO UPDATE SET "Версия" = v."Версия" + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
 
--- Для фильтрации услуг по периоду
-CREATE INDEX idx_services_period ON services("Отчетный_период");
+CREATE CONSTRAINT TRIGGER trg_data_version_changes AFTER INSERT ON data_version_changes
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE FUNCTION apply_data_version_changes();
 
--- Для поиска услуг по виду услуги
-CREATE INDEX idx_services_service_type ON services("Наименование_вида_услуг");
+-- Триггеры уровня оператора — одно событие на запрос; повторные уведомления
+-- в одной транзакции PostgreSQL склеивает. Уведомление доставляется после фиксации,
+-- когда версия таблицы уже повышена
+CREATE OR REPLACE FUNCTION notify_cache_event() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO data_version_changes ("Транзакция", "Таблица") VALUES (txid_current(), TG_ARGV[0])
+    ON CONFLICT DO NOTHING;
+    PERFORM pg_notify('cache_events', TG_ARGV[0]);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
 
--- Для поиска периодов по предприятию
-CREATE INDEX idx_period_reg_number ON period("Регистрационный_номер");
+CREATE TRIGGER trg_enterprises_cache_event AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON enterprises
+FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event('enterprises');
+CREATE TRIGGER trg_services_cache_event AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON services
+FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event('services');
+CREATE TRIGGER trg_period_cache_event AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON period
+FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event('period');
+CREATE TRIGGER trg_districts_cache_event AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON districts
+FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event('districts');
+CREATE TRIGGER trg_regions_cache_event AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON regions
+FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event('regions');
+CREATE TRIGGER trg_ministries_cache_event AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON ministries
+FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event('ministries');
+CREATE TRIGGER trg_industries_cache_event AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON industries
+FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event('industries');
+CREATE TRIGGER trg_service_types_cache_event AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON service_types
+FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event('service_types');
+CREATE TRIGGER trg_closed_years_cache_event AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON closed_years
+FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event('closed_years');
 
 отдельная база данных "юзер"
 
 CREATE TABLE users (
     id SERIAL PRIMARY KEY,
     "ФИО" VARCHAR(250) NOT NULL,
-    "email" VARCHAR(100) UNIQUE NOT NULL,
-    "логин" VARCHAR(50) UNIQUE NOT NULL,
+    "email" VARCHAR(100) NOT NULL,
+    "логин" VARCHAR(50) NOT NULL,
     "пароль_хэш" VARCHAR(255) NOT NULL,
     "роль" VARCHAR(20) NOT NULL DEFAULT 'user',
     "статус" VARCHAR(20) NOT NULL DEFAULT 'active',
     "Дата_регистрации" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     "Последний_вход" TIMESTAMP,
     
+    CONSTRAINT unique_user_email UNIQUE ("email"),
+    CONSTRAINT unique_user_login UNIQUE ("логин"),
     CONSTRAINT valid_role CHECK ("роль" IN ('user', 'admin')),
     CONSTRAINT valid_status CHECK ("статус" IN ('active', 'blocked'))
 );